@@ -1,170 +1,204 @@
-from wxauto import WeChat
-from openai import OpenAI
 import time
+_import_started = time.perf_counter()
 import json
 import os
 import random
-import requests
-from datetime import datetime
-from utils.willingness import WillingnessCalculator # type: ignore
-from utils.image_processor import ImageProcessor # type: ignore
-from utils.api_utils import call_deepseek_chat_api, parse_chat_response_xml # type: ignore
-from utils.schedule import Schedule # type: ignore
+from utils.api_utils import parse_chat_response_xml # type: ignore
 from utils.logger import log_info, log_warning, log_error # type: ignore
 from utils.chat_history import save_chat_history # type: ignore
 from utils.user_stats import update_user_interaction # type: ignore
-from utils.memory_manager import MemoryManager # type: ignore
-from utils.long_term_memory import LongTermMemory # type: ignore
-from utils.prompt_builder import PromptBuilder # type: ignore
-from utils.moderation import ContentModerator, is_content_safe # type: ignore
-
-
-# 加载配置文件
-config_dir = os.path.join(os.path.dirname(__file__), 'config')
-# 加载监听列表
-with open(os.path.join(config_dir, 'listen_list.json'), 'r', encoding='utf-8') as f:
-    listen_list = json.load(f)['listen_list']
-# 加载主配置
-with open(os.path.join(config_dir, 'config.json'), 'r', encoding='utf-8') as f:
-    app_config = json.load(f)
-# 处理other_name列表
-other_names_str = "，".join(app_config['other_name'])
-# 配置OpenAI API
-base = app_config['other_name']['base_url']
-key = app_config['other_name']['key']
-image_processor_key = app_config['image_processor_key']
-long_term_memory_key = app_config['long_term_memory_key']
-moderator_key = app_config['moderator_key']
-client = OpenAI(api_key=key, base_url=base)
-wx = WeChat()
-willingness_calc = WillingnessCalculator()  # 初始化意愿计算器
-image_processor = ImageProcessor(base_url=base,api_key=image_processor_key)  # 初始化图片处理器
-memory_manager = MemoryManager()  # 初始化记忆管理器
-long_term_memory = LongTermMemory(baseurl=base,api_key=long_term_memory_key)  # 初始化长期记忆
-prompt_builder = PromptBuilder(app_config)  # 初始化prompt构建器
-schedule_manager = Schedule(baseurl=base,api_key=key)  # 初始化日程管理器
-last_schedule_check = None
-moderator = ContentModerator(baseurl=base,api_key=moderator_key)  # 初始化内容审查器
-
-def get_history():
-
-    # 加载更多历史消息
-    wx.LoadMoreMessage()
-
-    # 获取当前聊天窗口消息
-    msgs = wx.GetAllMessage()
-    #返回msgs
-    return msgs
+from utils.dispatcher import ChatDispatcher # type: ignore
+from utils.coalescer import BurstCoalescer # type: ignore
+from utils.scheduler import PollingScheduler # type: ignore
+from utils.metrics import MESSAGES_RECEIVED, REPLIES, SKIPS, STAGE_SECONDS, start_metrics_server # type: ignore
+from utils.services import ServiceContainer, load_config # type: ignore
+from utils.willingness import PRIORITY_NAMES, PRIORITY_NORMAL # type: ignore
+
+
+# 加载并校验配置文件（可通过环境变量 OPENPOP_CONFIG_DIR 指定其他配置目录，如离线回放）
+config_dir = os.environ.get('OPENPOP_CONFIG_DIR') or os.path.join(os.path.dirname(__file__), 'config')
+app_config, listen_list = load_config(config_dir)
+# 各组件和 API 客户端在第一次使用时才创建，相同 base_url 和 key 的组件共用客户端
+services = ServiceContainer(app_config, import_seconds=time.perf_counter() - _import_started,
+                            moderate_replies=False)  # 不审查回复
+
 def on_message(msg, chat):
     log_info(f"收到来自 {chat.name} 的消息: {msg.content}")
 
-for i in listen_list:
-    wx.AddListenChat(nickname=i, callback=on_message)
-
-wait = 1  # 设置3秒查看一次是否新消息
-while True:
+stream_reply = app_config.get('stream_reply', True)  # 是否流式生成并逐条发送回复
+send_delay = app_config.get('send_delay', [0.5, 1.5])  # 每条消息发送后的随机停顿秒数，模拟真人打字
+
+def handle_message(chat, msgs):
+    """处理同一会话中连发合并后的一批好友消息：计算回复意愿、构建 prompt、调用模型并发送回复
+
+    由分发器在工作线程中调用，同一会话内的消息按到达顺序依次处理；
+    一批消息只计算一次回复意愿、只调用一次模型
+    """
+    sender = msgs[-1].sender
+    location_name = '私聊'
+    user_key = f"{sender}@{location_name}"
+    contents = [msg.content for msg in msgs]
+    for content in contents:
+        log_info(f'收到来自 [{location_name}] 的 [{sender}] 的消息: {content}')
+        # 存储用户消息到临时记忆
+        services.memory_manager.add_memory(user_key, content, is_bot=False)
+    combined_content = "\n".join(contents)
+    MESSAGES_RECEIVED.inc(len(contents))
+
+    # 计算回复概率并随机决定是否回复
+    with STAGE_SECONDS.labels("willingness").time():
+        reply_prob = services.willingness_calc.calculate_reply_probability(combined_content, sender, location_name)
+    should_reply = random.random() < reply_prob
+    log_info(f'回复概率: {reply_prob:.2%}, 决定: {"回复" if should_reply else "不回复"}')
+
+    if not should_reply:
+        services.willingness_calc.update_state_after_skip(sender, location_name)
+        SKIPS.inc()
+        return
+
+    def send(message_to_send):
+        """发送一条已审查的消息"""
+        if message_to_send.strip() if isinstance(message_to_send, str) else True:
+            log_info(f'发送给 [{location_name}] 的消息: \"{message_to_send}\"')
+            with STAGE_SECONDS.labels("send").time():
+                services.transport.send(chat, message_to_send)
+            # 不再为每条消息单独调用 add_memory
+            time.sleep(random.uniform(*send_delay))
+
+    timenow = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    log_info(f'当前时间：{timenow}')
+    # 并发获取近期对话、长期记忆和日程，构建 prompt 并调用模型；
+    # 流式模式下每条 <message> 生成完就立即审查并发送
+    reply_pipeline = services.reply_pipeline
+    if stream_reply:
+        response, streamed = reply_pipeline.reply_stream(sender, location_name, user_key, contents, timenow, send)
+    else:
+        response, streamed = reply_pipeline.reply(sender, location_name, user_key, contents, timenow), []
+    REPLIES.inc()
+    services.willingness_calc.update_state_after_reply(sender, location_name)
+    log_info(f'API响应：{response}')
+    messages, weight_settings, _, _ = parse_chat_response_xml(response, sender=sender, memory_writer=services.memory_writer)
+    log_info(f'解析后的消息：{messages}')
+    if weight_settings:
+        for user, weight in weight_settings:
+            log_info(f'设置用户权重 - {user}: {weight}')
+    # 保存聊天记录和更新用户统计
+    save_chat_history(user_key, combined_content, response)
+    update_user_interaction(user_key)
+
+    # <<< 这里是实现你需求的核心修改点 >>>
+    if messages:
+        # 拼接所有消息为一个字符串，模拟机器人一次性说完所有话
+        full_bot_response = "\n".join(messages)
+        # 只存一次完整回复到记忆
+        services.memory_manager.add_memory(user_key, full_bot_response, is_bot=True)
+        log_info(f"已将拼接后的回复存入记忆 for '{user_key}': '{full_bot_response.replace(chr(10), ' ')}'")
+
+    # 非流式模式，或回复中没有 <message> 标签时，整段审查后发送
+    if not streamed:
+        for message_to_send in reply_pipeline.moderate(messages):
+            send(message_to_send)
+
+def handle_message_timed(chat, msgs):
+    """记录每批消息的端到端处理耗时"""
+    with STAGE_SECONDS.labels("handle_message").time():
+        handle_message(chat, msgs)
+
+def handle_message_degraded(chat, msgs):
+    """积压过多时对普通消息的降级处理：只记入临时记忆、不调用模型，机器人之后被提及时仍能看到这些消息"""
+    sender = msgs[-1].sender
+    location_name = '私聊'
+    user_key = f"{sender}@{location_name}"
+    for msg in msgs:
+        services.memory_manager.add_memory(user_key, msg.content, is_bot=False)
+    MESSAGES_RECEIVED.inc(len(msgs))
+    services.willingness_calc.update_state_after_skip(sender, location_name)
+    SKIPS.inc()
+    log_warning(f'消息积压，降级处理 [{sender}] 的 {len(msgs)} 条消息，不调用模型')
+
+def submit_batch(user_key, items):
+    """把合并后的一批消息交给分发器，优先级取这批消息中最高的（管理员 > 提及 > 连续对话 > 普通）"""
+    chat = items[-1][0]
+    msgs = [msg for _, msg in items]
+    location_name = user_key.split('@', 1)[-1]
+    priority = min(services.willingness_calc.classify_priority(msg.content, msg.sender, location_name, chat)
+                   for msg in msgs)
+    dispatcher.submit(user_key, chat, msgs, priority=priority)
+
+# 初始化消息分发器：总排队数有上限，满载时先丢弃低优先级消息，积压较多时普通消息降级处理
+dispatcher = ChatDispatcher(handle_message_timed, max_workers=app_config.get('max_workers', 4),
+                            initializer=lambda: services.transport.init_worker_thread(),
+                            max_pending=app_config.get('max_pending', 200),
+                            degrade_handler=handle_message_degraded,
+                            degrade_depth=app_config.get('degrade_depth', 100),
+                            degrade_priority=PRIORITY_NORMAL,
+                            priority_names=PRIORITY_NAMES)
+# 初始化连发消息合并器：窗口内的连发消息合并为一批后交给分发器
+coalescer = BurstCoalescer(
+    submit_batch,
+    window=app_config.get('burst_window', 2.0),
+    max_wait=app_config.get('burst_max_wait', 8.0)
+)
+
+def poll_messages():
+    """拉取新消息并按会话交给合并器，返回收到的好友消息数"""
+    msgs = services.transport.receive()
+    received = 0
+    for chat, one_msgs in msgs.items():
+        # 按会话合并连发消息后分发给工作线程，不同会话并行处理
+        for msg in one_msgs:
+            if msg.type == 'friend':
+                coalescer.add(f"{msg.sender}@私聊", (chat, msg))
+                received += 1
+    return received
+
+def generate_daily_schedule():
+    """每天0点生成新日程"""
+    schedule = services.schedule_manager.generate_schedule()
+    log_info(f"已生成今日日程: {json.dumps(schedule, ensure_ascii=False, indent=2)}")
+
+def log_stats():
+    """记录分发队列、连发合并、回复流水线和轮询调度的统计"""
+    log_info(f"消息分发统计: {dispatcher.stats()}")
+    log_info(f"连发合并统计: {coalescer.stats()}")
+    log_info(f"回复流水线各阶段耗时: {services.reply_pipeline.stats()}")
+    log_info(f"轮询调度统计: {scheduler.stats()}")
+
+# 有新消息时快速轮询，空闲时指数退避；定时任务由调度器在后台线程执行
+scheduler = PollingScheduler(
+    poll_messages,
+    min_interval=app_config.get('poll_min_interval', 0.2),
+    max_interval=app_config.get('poll_max_interval', 5.0)
+)
+scheduler.daily(0, 0, generate_daily_schedule, name="daily-schedule")
+scheduler.daily(0, 0, lambda: services.memory_consolidator.run(), name="memory-consolidation")  # 每天整理一次长期记忆
+scheduler.every(300, log_stats, name="stats")  # 每5分钟记录一次统计
+
+def start():
+    """连接消息传输、注册监听会话，其余组件在后台预热，轮询可以立即开始"""
+    transport = services.transport
+    for i in listen_list:
+        transport.add_listen(i, callback=on_message)
+    transport.set_notify(scheduler.wake)  # 推送式传输（如 HTTP 网关）收到消息时立即唤醒轮询
+    services.timings["startup"] = time.perf_counter() - _import_started
+    log_info(f"启动完成，耗时 {services.timings['startup'] * 1000:.1f} ms（导入 {services.timings['import'] * 1000:.1f} ms）")
+    services.warm_up()
+
+def shutdown():
+    """停止轮询，交出缓冲中的消息并等待处理完毕，再关闭后台线程"""
+    scheduler.stop(wait=False)
+    coalescer.close()
+    dispatcher.close()
+    services.close()
+
+def main():
+    start()
+    start_metrics_server(app_config.get('metrics_port', 9108))  # 本地 Prometheus 指标端点，端口设为0时不启动
     try:
-        # 每天0点生成新日程
-        current_time = datetime.now()
-        if current_time.hour == 0 and (last_schedule_check is None or last_schedule_check.day != current_time.day):
-            schedule = schedule_manager.generate_schedule()
-            log_info(f"已生成今日日程: {json.dumps(schedule, ensure_ascii=False, indent=2)}")
-            last_schedule_check = current_time
-
-        msgs = wx.GetNextNewMessage()
-        for chat in msgs:
-            one_msgs = msgs.get(chat)   # 获取消息内容
-            
-            # 回复收到
-            for msg in one_msgs:
-
-                if msg.type == 'friend':
-                    sender = msg.sender
-                    location_name = '私聊'
-                    user_key = f"{sender}@{location_name}"
-                    log_info(f'收到来自 [{location_name}] 的 [{sender}] 的消息: {msg.content}')
-                    # 存储用户消息到临时记忆
-                    memory_manager.add_memory(user_key, msg.content, is_bot=False)
-
-                    # 计算回复概率并随机决定是否回复
-                    reply_prob = willingness_calc.calculate_reply_probability(msg.content, sender, location_name)
-                    should_reply = random.random() < reply_prob
-                    log_info(f'回复概率: {reply_prob:.2%}, 决定: {"回复" if should_reply else "不回复"}')
-
-                    if not should_reply:
-                        continue
-
-                    timenow = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                    log_info(f'当前时间：{timenow}')
-                    # 获取用户最近的对话记忆
-                    recent_memories = memory_manager.get_memories(user_key)
-                    log_info(f'最近的对话记忆：{recent_memories}')
-                    memory_context = "\n".join(
-                        f"{'你' if mem['is_bot'] else sender}: {mem['message']}" 
-                        for mem in recent_memories
-                    )
-                    log_info(f'格式化后的记忆上下文：{memory_context}')
-
-                    # 搜索相关长期记忆(相似度>0.7)
-                    related_memories = long_term_memory.search_memories(msg.content, sender=sender)
-                    memory_recall = []
-                    for mem in related_memories:
-                        if mem.get('similarity', 0) > 0.7:
-                            memory_recall.append(mem['content'])
-                    log_info(f'相关长期记忆：{memory_recall}')
-                    # 获取并格式化当前日程任务
-                    current_schedule = schedule_manager.get_schedule()
-                    current_tasks = json.dumps([
-                        {
-                            "name": task["name"],
-                            "time": task["time"]
-                        }
-                        for task in current_schedule.get("tasks", [])
-                    ], ensure_ascii=False, indent=4)
-
-                    # 准备额外上下文，包含相关记忆和当前任务
-                    additional_context = ""
-                    if memory_recall:
-                        additional_context += "相关记忆：\n" + "\n".join(f"- {mem}" for mem in memory_recall) + "\n\n"
-                    if current_tasks:
-                        additional_context += "当前计划任务：\n" + current_tasks + "\n"
-
-                    prompt = prompt_builder.build_chat_prompt(
-                        sender=sender,
-                        message=msg.content,
-                        memory_context=recent_memories,
-                        current_time=timenow,
-                        additional_context=additional_context.strip()
-                    )
-                    response = call_deepseek_chat_api(client, prompt)
-                    log_info(f'API响应：{response}')
-                    messages, weight_settings, _ = parse_chat_response_xml(response, sender=sender)
-                    log_info(f'解析后的消息：{messages}')
-                    if weight_settings:
-                        for user, weight in weight_settings:
-                            log_info(f'设置用户权重 - {user}: {weight}')
-                    # 保存聊天记录和更新用户统计
-                    save_chat_history(user_key, msg.content, response)
-                    update_user_interaction(user_key)
-
-                    # <<< 这里是实现你需求的核心修改点 >>>
-                    if messages:
-                        # 拼接所有消息为一个字符串，模拟机器人一次性说完所有话
-                        full_bot_response = "\n".join(messages)
-                        # 只存一次完整回复到记忆
-                        memory_manager.add_memory(user_key, full_bot_response, is_bot=True)
-                        log_info(f"已将拼接后的回复存入记忆 for '{user_key}': '{full_bot_response.replace(chr(10), ' ')}'")
-
-                    for message_to_send in messages:
-                        # 内容审查
-                        if message_to_send.strip() if isinstance(message_to_send, str) else True:
-                            log_info(f'发送给 [{location_name}] 的消息: \"{message_to_send}\"')
-                            chat.SendMsg(message_to_send)
-                            # 不再为每条消息单独调用 add_memory
-                            time.sleep(random.uniform(0.5, 1.5))
-                    # 此处将msg.content传递给大模型，再由大模型返回的消息回复即可实现ai聊天
-
-        time.sleep(wait)
+        scheduler.run()
     except KeyboardInterrupt:
         log_warning('程序被用户中断退出')
-        break
+        shutdown()
+
+if __name__ == '__main__':
+    main()
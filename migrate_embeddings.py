@@ -0,0 +1,15 @@
+from utils.long_term_memory import LongTermMemory
+from utils.logger import logger
+
+def migrate_embeddings():
+    """将memories表中的JSON嵌入迁移为float32 BLOB（可重复执行）"""
+    try:
+        memory = LongTermMemory(baseurl=None)
+        migrated = memory.migrate_embeddings()
+        logger.info(f"嵌入迁移完成: 本次迁移 {migrated} 条记录")
+    except Exception as e:
+        logger.error(f"嵌入迁移失败: {str(e)}")
+        raise
+
+if __name__ == '__main__':
+    migrate_embeddings()
@@ -0,0 +1,359 @@
+"""长期记忆近似最近邻（ANN）索引模块
+基于 NumPy 的 IVF-Flat：球面 k-means 把向量划分到 nlist 个倒排桶，
+检索时只扫描与查询最接近的 nprobe 个桶
+
+持久化文件与 memories.db 放在一起：
+    <base>.ivf.npz     聚类中心
+    <base>.ivf.assign  追加写入的 (记忆ID, 桶号) 记录，插入时增量更新
+向量本身不落盘，打开索引时从常驻向量索引中取
+
+命令行：
+    python -m utils.ann_index rebuild [--db data/memories.db] [--nlist N]
+    python -m utils.ann_index benchmark [--db data/memories.db | --synthetic N --dim D]
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.logger import logger
+from utils.memory_index import EmbeddingMatrix, top_k
+
+ASSIGN_DTYPE = np.dtype([('id', '<i8'), ('list', '<i4')])
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """把向量分配到最近的聚类中心（分块计算，控制内存峰值）"""
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk] @ centroids.T
+        result[start:start + chunk] = np.argmax(block, axis=1)
+    return result
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10,
+                    sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """球面 k-means 训练聚类中心
+
+    Args:
+        vectors: 已归一化的向量矩阵
+        nlist: 聚类中心数量
+        iterations: 迭代次数
+        sample_size: 训练采样数，默认每个中心 64 个样本
+        seed: 随机种子
+
+    Returns:
+        已归一化的聚类中心矩阵，形状 (nlist, dim)
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, sample_size or 64 * nlist)
+    sample = vectors[np.sort(rng.choice(n, sample_size, replace=False))]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=nlist)
+        non_empty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+        centroids[non_empty] = sums
+        # 空桶重新随机取一个样本作为中心
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms > 0, norms, 1.0)
+    return centroids.astype(np.float32)
+
+
+def default_nlist(n: int) -> int:
+    """按数据量选择聚类中心数（约 sqrt(n)）"""
+    return int(max(1, min(4096, round(np.sqrt(n)))))
+
+
+class IVFIndex:
+    """IVF-Flat 近似最近邻索引（线程安全）"""
+
+    def __init__(self, base_path: str, centroids: np.ndarray, nprobe: int = 8, dtype: str = "float32"):
+        """
+        Args:
+            base_path: 持久化文件路径前缀（不含扩展名）
+            centroids: 聚类中心矩阵
+            nprobe: 默认检索的桶数
+            dtype: 桶内向量的存储格式，与常驻索引相同（float32 / float16 / int8）；
+                   桶内保存的是全部向量的另一份副本，压缩后占用随之减少
+        """
+        self.base_path = base_path
+        self.centroids = centroids
+        self.nprobe = nprobe
+        self.dtype = dtype
+        self.dim = centroids.shape[1]
+        self._lists: List[EmbeddingMatrix] = [EmbeddingMatrix(self.dim, capacity=16, dtype=dtype)
+                                              for _ in range(len(centroids))]
+        self._lock = threading.RLock()
+
+    @property
+    def centroid_path(self) -> str:
+        return self.base_path + '.ivf.npz'
+
+    @property
+    def assign_path(self) -> str:
+        return self.base_path + '.ivf.assign'
+
+    def __len__(self) -> int:
+        return sum(lst.size for lst in self._lists)
+
+    @property
+    def nbytes(self) -> int:
+        """聚类中心和各桶向量占用的字节数（不含ID）"""
+        with self._lock:
+            return self.centroids.nbytes + sum(lst.nbytes for lst in self._lists)
+
+    @classmethod
+    def build(cls, base_path: str, ids: np.ndarray, vectors: np.ndarray, nlist: Optional[int] = None,
+              nprobe: int = 8, iterations: int = 10, dtype: str = "float32") -> "IVFIndex":
+        """训练聚类中心、分配全部向量并覆盖写入持久化文件
+
+        Args:
+            base_path: 持久化文件路径前缀
+            ids: 记忆ID数组
+            vectors: 已归一化的向量矩阵
+            nlist: 聚类中心数，默认约 sqrt(n)
+            nprobe: 默认检索的桶数
+            iterations: k-means 迭代次数
+            dtype: 桶内向量的存储格式
+        """
+        started = time.perf_counter()
+        nlist = min(nlist or default_nlist(len(ids)), len(ids))
+        index = cls(base_path, train_centroids(vectors, nlist, iterations), nprobe=nprobe, dtype=dtype)
+        assignment = index._fill(ids, vectors)
+
+        tmp_centroids = index.centroid_path + '.tmp.npz'
+        np.savez(tmp_centroids, centroids=index.centroids)
+        os.replace(tmp_centroids, index.centroid_path)
+        tmp_assign = index.assign_path + '.tmp'
+        records = np.empty(len(ids), dtype=ASSIGN_DTYPE)
+        records['id'] = ids
+        records['list'] = assignment
+        records.tofile(tmp_assign)
+        os.replace(tmp_assign, index.assign_path)
+
+        logger.info("IVF index built: %d vectors, nlist=%d, %.2fs",
+                    len(ids), nlist, time.perf_counter() - started)
+        return index
+
+    @classmethod
+    def open(cls, base_path: str, ids: np.ndarray, vectors: np.ndarray, nprobe: int = 8,
+             dtype: str = "float32") -> Optional["IVFIndex"]:
+        """加载已持久化的索引，未记录分配的向量会被补充分配并追加写入
+
+        Args:
+            base_path: 持久化文件路径前缀
+            ids: 当前全部记忆ID
+            vectors: 与 ids 对应的已归一化向量
+            dtype: 桶内向量的存储格式
+
+        Returns:
+            IVFIndex，持久化文件不存在或维度不匹配时返回None
+        """
+        centroid_path = base_path + '.ivf.npz'
+        if not os.path.exists(centroid_path):
+            return None
+        with np.load(centroid_path) as data:
+            centroids = data['centroids']
+        if vectors.ndim != 2 or centroids.shape[1] != vectors.shape[1]:
+            logger.warning("IVF centroids do not match the embedding dimension, ignoring %s", centroid_path)
+            return None
+
+        index = cls(base_path, centroids, nprobe=nprobe, dtype=dtype)
+        known: Dict[int, int] = {}
+        if os.path.exists(index.assign_path):
+            records = np.fromfile(index.assign_path, dtype=ASSIGN_DTYPE)
+            known = dict(zip(records['id'].tolist(), records['list'].tolist()))
+
+        assignment = np.fromiter((known.get(i, -1) for i in ids.tolist()), dtype=np.int32, count=len(ids))
+        missing = np.flatnonzero(assignment < 0)
+        if len(missing):
+            assignment[missing] = _assign(vectors[missing], centroids)
+            index._append_log(ids[missing], assignment[missing])
+        index._fill(ids, vectors, assignment)
+        logger.info("IVF index loaded: %d vectors, %d newly assigned", len(ids), len(missing))
+        return index
+
+    def _fill(self, ids: np.ndarray, vectors: np.ndarray, assignment: Optional[np.ndarray] = None) -> np.ndarray:
+        """按桶分组写入向量，返回每个向量的桶号"""
+        if assignment is None:
+            assignment = _assign(vectors, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        start = 0
+        with self._lock:
+            for list_no, count in enumerate(counts.tolist()):
+                if count:
+                    rows = order[start:start + count]
+                    self._lists[list_no].append(ids[rows], vectors[rows])
+                    start += count
+        return assignment
+
+    def _append_log(self, ids: np.ndarray, assignment: np.ndarray):
+        records = np.empty(len(ids), dtype=ASSIGN_DTYPE)
+        records['id'] = ids
+        records['list'] = assignment
+        with open(self.assign_path, 'ab') as f:
+            records.tofile(f)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        """增量插入向量并追加持久化分配记录"""
+        if len(ids) == 0:
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        assignment = _assign(vectors, self.centroids)
+        with self._lock:
+            self._fill(ids, vectors, assignment)
+            self._append_log(ids, assignment)
+
+    def search(self, query: np.ndarray, k: int, min_similarity: float = 0.0,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """近似检索最相似的记忆
+
+        Args:
+            query: 已归一化的查询向量
+            k: 返回数量
+            min_similarity: 相似度下限
+            nprobe: 本次检索的桶数，默认使用构造时的设置
+
+        Returns:
+            [(记忆ID, 相似度)]，按相似度降序
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        centroid_scores = self.centroids @ query
+        if nprobe < len(self.centroids):
+            probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(len(self.centroids))
+
+        with self._lock:
+            snapshots = [self._lists[p].snapshot() for p in probes.tolist() if self._lists[p].size]
+        if not snapshots:
+            return []
+        ids = np.concatenate([ids for ids, _, _ in snapshots])
+        vectors = snapshots[0][1] if len(snapshots) == 1 else np.concatenate([v for _, v, _ in snapshots])
+        scales = np.concatenate([s for _, _, s in snapshots]) if self.dtype == "int8" else None
+        ids, scores = top_k(ids, vectors, query, k, min_similarity, scales=scales)
+        return list(zip(ids.tolist(), scores.tolist()))
+
+
+def benchmark(ids: np.ndarray, vectors: np.ndarray, index: IVFIndex, queries: np.ndarray,
+              k: int = 10, nprobes: Tuple[int, ...] = (1, 4, 8, 16, 32)) -> List[Dict]:
+    """对比精确检索与 IVF 检索的 recall@k 和延迟
+
+    Returns:
+        每个 nprobe 一行的结果字典列表（第一行为精确检索）
+    """
+    def timed(fn):
+        latencies, outputs = [], []
+        for q in queries:
+            started = time.perf_counter()
+            outputs.append(fn(q))
+            latencies.append((time.perf_counter() - started) * 1000)
+        return outputs, np.array(latencies)
+
+    exact, exact_ms = timed(lambda q: set(top_k(ids, vectors, q, k)[0].tolist()))
+    rows = [{"method": "exact", "recall": 1.0,
+             "p50_ms": float(np.percentile(exact_ms, 50)), "p95_ms": float(np.percentile(exact_ms, 95))}]
+    for nprobe in nprobes:
+        if nprobe > len(index.centroids):
+            break
+        approx, approx_ms = timed(lambda q: {i for i, _ in index.search(q, k, nprobe=nprobe)})
+        recall = np.mean([len(a & e) / max(1, len(e)) for a, e in zip(approx, exact)])
+        rows.append({"method": f"ivf nprobe={nprobe}", "recall": float(recall),
+                     "p50_ms": float(np.percentile(approx_ms, 50)), "p95_ms": float(np.percentile(approx_ms, 95))})
+    return rows
+
+
+def _load_vectors(db_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    from utils.long_term_memory import LongTermMemory
+    memory = LongTermMemory(baseurl=None, db_path=db_path, embedding_file_readonly=True)
+    memory._ensure_index()
+    return memory.index.global_snapshot()
+
+
+def _configured_dtype() -> str:
+    """config.json 中的 memory_index_dtype，与主程序加载索引时的格式一致；读取失败时为 float32"""
+    try:
+        from utils.config_manager import get_config
+        return get_config().get("memory_index_dtype", "float32")
+    except (OSError, ValueError):
+        return "float32"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="长期记忆 IVF 索引维护工具")
+    dtype = _configured_dtype()
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = sub.add_parser("rebuild", help="重新训练并写入 IVF 索引")
+    rebuild.add_argument("--db", default="data/memories.db")
+    rebuild.add_argument("--nlist", type=int, default=None)
+    rebuild.add_argument("--dtype", default=dtype, choices=["float32", "float16", "int8"],
+                         help="桶内向量的存储格式，默认取 config.json 的 memory_index_dtype")
+
+    bench = sub.add_parser("benchmark", help="对比 IVF 与精确检索的召回率和延迟")
+    bench.add_argument("--db", default="data/memories.db")
+    bench.add_argument("--synthetic", type=int, default=0, help="使用 N 条随机向量代替数据库")
+    bench.add_argument("--dim", type=int, default=1536)
+    bench.add_argument("--nlist", type=int, default=None)
+    bench.add_argument("--queries", type=int, default=200)
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--dtype", default=dtype, choices=["float32", "float16", "int8"],
+                       help="桶内向量的存储格式，默认取 config.json 的 memory_index_dtype")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        ids, vectors = _load_vectors(args.db)
+        if len(ids) == 0:
+            print("数据库中没有记忆，无需构建索引")
+            return
+        index = IVFIndex.build(os.path.splitext(args.db)[0], ids, vectors, nlist=args.nlist, dtype=args.dtype)
+        print(f"已重建 IVF 索引: {len(ids)} 条记忆，{args.dtype}，{index.nbytes / 1024 / 1024:.1f} MB")
+        return
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        # 带簇结构的随机向量，比均匀随机更接近真实嵌入分布
+        centers = rng.standard_normal((max(1, args.synthetic // 500), args.dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), args.synthetic)]
+        vectors += 0.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = np.arange(1, args.synthetic + 1, dtype=np.int64)
+        base_path = os.path.join("data", "benchmark")
+    else:
+        ids, vectors = _load_vectors(args.db)
+        base_path = os.path.splitext(args.db)[0] + ".benchmark"
+    if len(ids) == 0:
+        print("没有可用于测试的向量")
+        return
+
+    index = IVFIndex.build(base_path, ids, vectors, nlist=args.nlist, dtype=args.dtype)
+    picks = rng.choice(len(ids), min(args.queries, len(ids)), replace=False)
+    queries = vectors[picks] + 0.05 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"向量数={len(ids)}, 维度={vectors.shape[1]}, nlist={len(index.centroids)}, k={args.k}, "
+          f"IVF 占用={index.nbytes / 1024 / 1024:.1f} MB（{args.dtype}）")
+    print(f"{'method':<18}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in benchmark(ids, vectors, index, queries, k=args.k):
+        print(f"{row['method']:<18}{row['recall']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+    for path in (index.centroid_path, index.assign_path):
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
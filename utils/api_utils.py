@@ -3,36 +3,156 @@
 """API 工具模块
 包含与Deepseek API交互和消息解析相关的工具函数
 """
-from openai import OpenAI
-from typing import List, Dict
+from typing import TYPE_CHECKING, Callable, List, Dict, Optional
+import asyncio
 import re
+import threading
+import time
 import json
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from utils.metrics import LLM_ROUND_SECONDS, PROMPT_TOKENS, TOOL_CALLS, TOOL_ERRORS, TOOL_SECONDS
+
+if TYPE_CHECKING:
+    # 只用于类型标注；openai 导入较慢，解析回复等功能不需要它
+    from openai import OpenAI, AsyncOpenAI
 
 # 假设这些是你自己的模块，如果不存在，请确保创建或注释掉
 try:
     from utils.tools_manager import get_tools, use_tools
     from utils.user_stats import parse_weight_tags, set_user_weight
-    from utils.long_term_memory import LongTermMemory
-    from utils.logger import log_info, log_error
+    from utils.logger import log_info, log_error, log_warning
 except ImportError:
     # 提供占位符以确保代码可运行，即使依赖不完整
     def get_tools(): return []
     def use_tools(name, args): return f"Tool '{name}' used with args: {args}"
     def parse_weight_tags(text): return text, []
     def set_user_weight(user, weight): pass
-    class LongTermMemory:
-        def add_memory(self, sender, content): pass
     def log_info(msg): print(f"[INFO] {msg}")
     def log_error(msg): print(f"[ERROR] {msg}")
+    def log_warning(msg): print(f"[WARNING] {msg}")
+
+MAX_TOOL_ROUNDS = 3  # 一次回复最多执行的工具轮数
+TOOL_TIMEOUT = 10.0  # 单个工具调用的超时秒数
+TOOL_DEADLINE = 45.0  # 一次回复中模型请求和工具调用的总时限秒数
+TOOL_POOL_SIZE = 8  # 工具线程池大小，所有会话共用
+
+_TOOL_POOL: Optional[ThreadPoolExecutor] = None
+_TOOL_POOL_LOCK = threading.Lock()
+
+def _run_tool(name: str, arguments: str):
+    """执行一次工具调用并记录次数和耗时"""
+    TOOL_CALLS.labels(name).inc()
+    with TOOL_SECONDS.labels(name).time():
+        return use_tools(name, arguments)
+
+
+def _tool_pool() -> ThreadPoolExecutor:
+    """工具调用共用的线程池，第一次使用时创建"""
+    global _TOOL_POOL
+    if _TOOL_POOL is None:
+        with _TOOL_POOL_LOCK:
+            if _TOOL_POOL is None:
+                _TOOL_POOL = ThreadPoolExecutor(max_workers=TOOL_POOL_SIZE, thread_name_prefix="tool")
+    return _TOOL_POOL
+
+
+def execute_tool_calls(calls: List[Dict], deadline: float, tool_timeout: float = TOOL_TIMEOUT) -> List[str]:
+    """在线程池中并发执行同一轮的工具调用，按调用顺序返回结果
+
+    单个工具超过 tool_timeout 秒、或整次对话超过 deadline（time.monotonic() 时刻）仍未返回时，
+    以错误说明代替结果交给模型；超时的工具仍在后台线程中运行到结束，结果被丢弃
+
+    Args:
+        calls: [{"id", "name", "arguments"}] 形式的工具调用
+    """
+    started = time.monotonic()
+    futures = [_tool_pool().submit(_run_tool, call["name"], call["arguments"]) for call in calls]
+    results = []
+    for call, future in zip(calls, futures):
+        name = call["name"]
+        try:
+            results.append(str(future.result(timeout=max(0.0, min(started + tool_timeout, deadline) - time.monotonic()))))
+        except FutureTimeoutError:
+            future.cancel()
+            TOOL_ERRORS.labels(name, "timeout").inc()
+            log_warning(f"工具 {name} 调用超时")
+            results.append(f"工具 {name} 调用超时，没有拿到结果")
+        except Exception as e:
+            TOOL_ERRORS.labels(name, "error").inc()
+            log_error(f"工具 {name} 调用失败: {str(e)}")
+            results.append(f"工具 {name} 调用失败: {str(e)}")
+    return results
+
+
+def _tool_round_messages(content: str, calls: List[Dict], results: List[str]) -> List[Dict]:
+    """一轮工具调用对应的助手消息和工具结果消息"""
+    messages = [{
+        "role": "assistant",
+        "content": content,
+        "tool_calls": [
+            {
+                "id": call["id"],
+                "type": "function",
+                "function": {"name": call["name"], "arguments": call["arguments"]}
+            } for call in calls
+        ]
+    }]
+    for call, result in zip(calls, results):
+        messages.append({"role": "tool", "content": result, "tool_call_id": call["id"]})
+    return messages
+
+
+def _round_params(model: str, messages: List[Dict], tools: List[Dict], final: bool) -> Dict:
+    """一轮请求的参数；最后一轮不再允许调用工具，让模型直接给出回复"""
+    params = {"model": model, "messages": messages, "temperature": 0.7}
+    if tools:
+        params["tools"] = tools
+        params["tool_choice"] = "none" if final else "auto"
+    return params
+
 
+def _calls_from_message(message) -> List[Dict]:
+    return [
+        {"id": tool_call.id, "name": tool_call.function.name, "arguments": tool_call.function.arguments}
+        for tool_call in (getattr(message, "tool_calls", None) or [])
+    ]
 
-def call_deepseek_chat_api(client: OpenAI, messages: List[Dict], model: str = "deepseek-chat") -> str:
-    """调用Deepseek聊天API获取响应，支持工具调用
+
+def record_usage(usage) -> int:
+    """记录一次调用的 prompt token 数和服务端前缀缓存命中数，返回命中的 token 数
+
+    DeepSeek 在 usage.prompt_cache_hit_tokens 中返回命中数，OpenAI 在 usage.prompt_tokens_details.cached_tokens 中返回
+    """
+    if usage is None:
+        return 0
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", 0) if details is not None else 0
+    cached = cached or 0
+    PROMPT_TOKENS.labels("hit").inc(cached)
+    PROMPT_TOKENS.labels("miss").inc(max(0, prompt_tokens - cached))
+    if prompt_tokens:
+        log_info(f"prompt tokens: {prompt_tokens}，前缀缓存命中 {cached}（{cached / prompt_tokens:.0%}）")
+    return cached
+
+
+def call_deepseek_chat_api(client: "OpenAI", messages: List[Dict], model: str = "deepseek-chat",
+                           max_tool_rounds: int = MAX_TOOL_ROUNDS, tool_timeout: float = TOOL_TIMEOUT,
+                           deadline: float = TOOL_DEADLINE) -> str:
+    """调用Deepseek聊天API获取响应，支持多轮工具调用
     
+    模型每轮请求的工具在线程池中并发执行，结果交回模型后继续，最多 max_tool_rounds 轮；
+    轮数用完或超过总时限后，最后一轮不再提供工具，让模型直接回复
+
     Args:
         client: OpenAI客户端实例
         messages: 符合OpenAI格式的对话列表
         model: 使用的模型名称，默认为"deepseek-chat"
+        max_tool_rounds: 最多执行的工具轮数
+        tool_timeout: 单个工具的超时秒数
+        deadline: 整次调用（含各轮模型请求和工具）的总时限秒数
         
     Returns:
         str: API返回的最终响应内容
@@ -41,59 +161,21 @@ def call_deepseek_chat_api(client: OpenAI, messages: List[Dict], model: str = "d
     print("\n" + "="*25 + " 发送给API的JSON (第一次调用) " + "="*25)
     print(json.dumps(messages, ensure_ascii=False, indent=2))
     print("="*75 + "\n")
+    deadline_at = time.monotonic() + deadline
     try:
-        # 第一次API调用
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            tools=tools if tools else None,
-            tool_choice="auto",
-            temperature=0.7,
-        )
-        
-        message = response.choices[0].message
-        
-        # 处理工具调用
-        if hasattr(message, 'tool_calls') and message.tool_calls:
-            # 添加助手消息（包含工具调用）
-            messages.append({
-                "role": "assistant",
-                "content": message.content if message.content else "",
-                "tool_calls": [
-                    {
-                        "id": tool_call.id,
-                        "type": "function",
-                        "function": {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments
-                        }
-                    } for tool_call in message.tool_calls
-                ]
-            })
-            
-            # 处理每个工具调用
-            for tool_call in message.tool_calls:
-                tool_result = use_tools(
-                    tool_call.function.name,
-                    tool_call.function.arguments
-                )
-                
-                # 添加工具响应
-                messages.append({
-                    "role": "tool",
-                    "content": str(tool_result),
-                    "tool_call_id": tool_call.id
-                })
-            
-            # 第二次API调用
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=tools if tools else None,
-                temperature=0.7,
-            )
+        for round_index in range(max_tool_rounds + 1):
+            final = round_index == max_tool_rounds or time.monotonic() >= deadline_at
+            with LLM_ROUND_SECONDS.labels(str(round_index + 1)).time():
+                response = client.chat.completions.create(**_round_params(model, messages, tools, final))
+            record_usage(getattr(response, "usage", None))
             message = response.choices[0].message
-        
+            calls = _calls_from_message(message)
+            if not calls or final:
+                break
+            # 同一轮的工具调用互不依赖，并发执行
+            results = execute_tool_calls(calls, deadline_at, tool_timeout)
+            messages.extend(_tool_round_messages(message.content or "", calls, results))
+
         return message.content if message.content else ""
 
     except Exception as e:
@@ -101,12 +183,152 @@ def call_deepseek_chat_api(client: OpenAI, messages: List[Dict], model: str = "d
         return "抱歉，我在连接我的大脑时遇到了一点问题，请稍后再试。"
 
 
-def parse_chat_response_xml(xml_string: str, sender: str = "system") -> tuple[list[str], list[tuple[str, float]], list[dict], list[str]]:
+async def async_call_deepseek_chat_api(client: "AsyncOpenAI", messages: List[Dict], model: str = "deepseek-chat",
+                                       max_tool_rounds: int = MAX_TOOL_ROUNDS, tool_timeout: float = TOOL_TIMEOUT,
+                                       deadline: float = TOOL_DEADLINE) -> str:
+    """call_deepseek_chat_api 的异步版本，工具轮数、超时和总时限相同
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        messages: 符合OpenAI格式的对话列表
+        model: 使用的模型名称，默认为"deepseek-chat"
+
+    Returns:
+        str: API返回的最终响应内容
+    """
+    tools = get_tools()
+    deadline_at = time.monotonic() + deadline
+    try:
+        for round_index in range(max_tool_rounds + 1):
+            final = round_index == max_tool_rounds or time.monotonic() >= deadline_at
+            with LLM_ROUND_SECONDS.labels(str(round_index + 1)).time():
+                response = await client.chat.completions.create(**_round_params(model, messages, tools, final))
+            record_usage(getattr(response, "usage", None))
+            message = response.choices[0].message
+            calls = _calls_from_message(message)
+            if not calls or final:
+                break
+            # 工具实现是同步的，在线程池中并发执行，不阻塞事件循环
+            results = await asyncio.to_thread(execute_tool_calls, calls, deadline_at, tool_timeout)
+            messages.extend(_tool_round_messages(message.content or "", calls, results))
+
+        return message.content if message.content else ""
+
+    except Exception as e:
+        log_error(f"调用 DeepSeek API 时出错: {e}")
+        return "抱歉，我在连接我的大脑时遇到了一点问题，请稍后再试。"
+
+
+class MessageStreamParser:
+    """增量解析流式回复中的 <message> 标签，每读到一个闭合标签就交出一条消息"""
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+
+    def feed(self, text: str) -> List[str]:
+        """追加一段增量文本
+
+        Returns:
+            list: 本次新闭合的消息（已去除 <thinking> 和首尾空白，空消息不返回）
+        """
+        self.buffer += text
+        completed = []
+        while True:
+            start = self.buffer.find('<message>', self._pos)
+            if start < 0:
+                break
+            end = self.buffer.find('</message>', start)
+            if end < 0:
+                break
+            self._pos = end + len('</message>')
+            raw = self.buffer[start + len('<message>'):end]
+            cleaned = re.sub(r'<thinking>.*?</thinking>', '', raw, flags=re.S).strip()
+            if cleaned:
+                completed.append(cleaned)
+        return completed
+
+    @property
+    def closed_text(self) -> str:
+        """截至最后一个闭合 </message> 的文本，不含仍未闭合的半条消息"""
+        return self.buffer[:self._pos]
+
+
+async def async_stream_deepseek_chat_api(client: "AsyncOpenAI", messages: List[Dict],
+                                         on_message: Callable[[str], None],
+                                         model: str = "deepseek-chat", max_tool_rounds: int = MAX_TOOL_ROUNDS,
+                                         tool_timeout: float = TOOL_TIMEOUT, deadline: float = TOOL_DEADLINE) -> str:
+    """流式调用Deepseek聊天API，每生成完一个 <message> 就立即回调，支持工具调用
+
+    Args:
+        client: AsyncOpenAI客户端实例
+        messages: 符合OpenAI格式的对话列表
+        on_message: 每条 <message> 闭合时以消息内容调用
+        model: 使用的模型名称，默认为"deepseek-chat"
+
+    Returns:
+        str: 全部轮次生成的完整文本，供 parse_chat_response_xml 提取 <memory>/<user_weights>
+    """
+    tools = get_tools()
+    parser = MessageStreamParser()
+    deadline_at = time.monotonic() + deadline
+    try:
+        for round_index in range(max_tool_rounds + 1):
+            final = round_index == max_tool_rounds or time.monotonic() >= deadline_at
+            params = _round_params(model, messages, tools, final)
+            params["stream"] = True
+            # 流的最后一块返回 usage，用于统计前缀缓存命中
+            params["stream_options"] = {"include_usage": True}
+            round_start = time.perf_counter()
+            stream = await client.chat.completions.create(**params)
+
+            content_parts = []
+            tool_calls: Dict[int, Dict] = {}
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    for message in parser.feed(delta.content):
+                        on_message(message)
+                # 工具调用以增量片段到达，按 index 拼接
+                for tool_delta in delta.tool_calls or []:
+                    entry = tool_calls.setdefault(tool_delta.index, {"id": "", "name": "", "arguments": ""})
+                    if tool_delta.id:
+                        entry["id"] = tool_delta.id
+                    if tool_delta.function:
+                        entry["name"] += tool_delta.function.name or ""
+                        entry["arguments"] += tool_delta.function.arguments or ""
+            LLM_ROUND_SECONDS.labels(str(round_index + 1)).observe(time.perf_counter() - round_start)
+
+            if not tool_calls or final:
+                break
+
+            ordered_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            results = await asyncio.to_thread(execute_tool_calls, ordered_calls, deadline_at, tool_timeout)
+            messages.extend(_tool_round_messages("".join(content_parts), ordered_calls, results))
+
+        return parser.buffer
+
+    except Exception as e:
+        log_error(f"流式调用 DeepSeek API 时出错: {e}")
+        # 只返回已闭合的消息；未闭合的半句话不能当作完整回复再发出去
+        if parser.closed_text:
+            return parser.closed_text
+        return "抱歉，我在连接我的大脑时遇到了一点问题，请稍后再试。"
+
+
+def parse_chat_response_xml(xml_string: str, sender: str = "system", memory_writer=None) -> tuple[list[str], list[tuple[str, float]], list[dict], list[str]]:
     """解析聊天响应中的XML格式消息、权重标签、记忆内容和引用回复
 
     Args:
         xml_string: 包含XML格式消息的字符串
         sender: 消息发送者名称，用于记忆存储
+        memory_writer: 可选，MemoryWriter 实例；解析出的记忆交给它在后台写入，
+                       不传则只解析不存储
 
     Returns:
         tuple: (消息列表, 权重设置列表, 记忆内容对象列表, 引用回复列表)
@@ -148,24 +370,22 @@ def parse_chat_response_xml(xml_string: str, sender: str = "system") -> tuple[li
     if not cleaned_messages and not memory_contents_raw and not weight_settings and not cleaned_quotes and xml_string.strip():
         return [xml_string.strip()], [], [], []
 
-    # 存储长期记忆（解析 memory 为 JSON，提取 topic/summary）
+    # 存储长期记忆（解析 memory 为 JSON，提取 topic/summary，交给后台写入队列）
     parsed_memory_for_return = []
-    if memory_contents_raw:
-        try:
-            memory_db = LongTermMemory()
-            for raw_memory_json in memory_contents_raw:
-                if raw_memory_json.strip():
-                    try:
-                        parsed_memory = json.loads(raw_memory_json)
-                        topic = parsed_memory.get("topic", "未知主题")
-                        summary = parsed_memory.get("summary", raw_memory_json)
-                        memory_db.add_memory(sender=sender, topic=topic, summary=summary)
-                        parsed_memory_for_return.append(parsed_memory)
-                    except json.JSONDecodeError as jde:
-                        log_error(f"解析<memory>标签内JSON失败: {raw_memory_json} - {jde}")
-                    except Exception as add_e:
-                        log_error(f"添加长期记忆（已解析）失败: {raw_memory_json} - {add_e}")
-        except Exception as e:
-            log_error(f"初始化或处理长期记忆时发生错误: {str(e)}")
+    for raw_memory_json in memory_contents_raw:
+        if raw_memory_json.strip():
+            try:
+                parsed_memory = json.loads(raw_memory_json)
+                topic = parsed_memory.get("topic", "未知主题")
+                summary = parsed_memory.get("summary", raw_memory_json)
+                if memory_writer is not None:
+                    memory_writer.submit(sender=sender, topic=topic, summary=summary)
+                else:
+                    log_warning(f"未配置长期记忆写入队列，记忆未保存: {topic}")
+                parsed_memory_for_return.append(parsed_memory)
+            except json.JSONDecodeError as jde:
+                log_error(f"解析<memory>标签内JSON失败: {raw_memory_json} - {jde}")
+            except Exception as add_e:
+                log_error(f"添加长期记忆（已解析）失败: {raw_memory_json} - {add_e}")
 
     return cleaned_messages, weight_settings, parsed_memory_for_return, cleaned_quotes
@@ -0,0 +1,300 @@
+"""异步回复流水线模块
+在后台线程上运行 asyncio 事件循环，基于 AsyncOpenAI 并发获取回复所需的上下文
+（近期对话、长期记忆、日程），每个阶段单独超时，超时或出错时以空值继续；
+同步代码通过 ReplyPipeline 的同步方法调用，无需关心事件循环
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from openai import AsyncOpenAI
+
+from utils.api_utils import async_call_deepseek_chat_api, async_stream_deepseek_chat_api
+from utils.logger import log_error, log_info, log_warning
+from utils.metrics import FILTERED, STAGE_SECONDS
+from utils.moderation import is_content_safe
+
+_DONE = object()
+
+# 各上下文阶段的默认超时秒数
+DEFAULT_STAGE_TIMEOUTS = {
+    "recent_memories": 2.0,
+    "long_term_memory": 5.0,
+    "schedule": 5.0,
+    "summary": 2.0,
+}
+
+
+class EventLoopThread:
+    def __init__(self, name: str = "reply-pipeline"):
+        """在守护线程中启动一个常驻事件循环"""
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        """把协程提交到事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """在事件循环中执行协程并阻塞等待结果（供工作线程调用）"""
+        return self.submit(coro).result(timeout)
+
+    def close(self, timeout: float = 5.0):
+        """停止事件循环并等待线程退出"""
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+class ReplyPipeline:
+    def __init__(self, chat_client: AsyncOpenAI, prompt_builder, memory_manager, long_term_memory,
+                 schedule_manager, moderator=None, image_processor=None, model: str = "deepseek-chat",
+                 stage_timeouts: Optional[Dict[str, float]] = None,
+                 loop_thread: Optional[EventLoopThread] = None, summarizer=None):
+        """初始化回复流水线
+
+        Args:
+            chat_client: 聊天使用的 AsyncOpenAI 客户端
+            prompt_builder: PromptBuilder 实例
+            memory_manager: MemoryManager 实例（近期对话）
+            long_term_memory: LongTermMemory 实例
+            schedule_manager: Schedule 实例
+            moderator: 可选，ContentModerator 实例
+            image_processor: 可选，ImageProcessor 实例
+            model: 聊天模型名
+            stage_timeouts: 覆盖各上下文阶段的超时秒数
+            loop_thread: 可选，共用的事件循环线程，不传则自行创建
+            summarizer: 可选，ConversationSummarizer 实例，提供更早对话的滚动摘要
+        """
+        self.chat_client = chat_client
+        self.prompt_builder = prompt_builder
+        self.memory_manager = memory_manager
+        self.long_term_memory = long_term_memory
+        self.schedule_manager = schedule_manager
+        self.moderator = moderator
+        self.image_processor = image_processor
+        self.summarizer = summarizer
+        self.model = model
+        self.stage_timeouts = {**DEFAULT_STAGE_TIMEOUTS, **(stage_timeouts or {})}
+        self.loop_thread = loop_thread or EventLoopThread()
+
+        self._stats_lock = threading.Lock()
+        self.stage_stats: Dict[str, Dict[str, float]] = {}
+
+    def _record(self, stage: str, elapsed: float, failed: bool = False):
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        with self._stats_lock:
+            stats = self.stage_stats.setdefault(stage, {"count": 0, "total": 0.0, "max": 0.0, "failed": 0})
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            if failed:
+                stats["failed"] += 1
+
+    async def _stage(self, name: str, awaitable, default):
+        """执行一个上下文阶段，超时或出错时记录日志并返回默认值"""
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(awaitable, self.stage_timeouts.get(name))
+            self._record(name, time.perf_counter() - start)
+            return result
+        except asyncio.TimeoutError:
+            log_warning(f"获取上下文阶段 {name} 超时（{self.stage_timeouts.get(name)} 秒），跳过")
+        except Exception as e:
+            log_error(f"获取上下文阶段 {name} 失败: {str(e)}")
+        self._record(name, time.perf_counter() - start, failed=True)
+        return default
+
+    async def agather_context(self, user_key: str, sender: str, content: Union[str, List[str]]) -> Dict:
+        """并发获取近期对话、相关长期记忆和当前日程
+
+        Args:
+            content: 用户消息；连发合并的多条消息传入列表，检索时拼接为一条查询
+
+        Returns:
+            dict: recent_memories / memory_recall / schedule / summary
+        """
+        start = time.perf_counter()
+        query = content if isinstance(content, str) else "\n".join(content)
+        summary_stage = (asyncio.to_thread(self.summarizer.get_summary, user_key)
+                         if self.summarizer is not None else asyncio.sleep(0, ""))
+        recent_memories, related_memories, schedule, summary = await asyncio.gather(
+            self._stage("recent_memories", asyncio.to_thread(self.memory_manager.get_memories, user_key), []),
+            self._stage("long_term_memory", self.long_term_memory.asearch_memories(
+                query, sender=sender, min_similarity=0.7, mode="hybrid"), []),
+            self._stage("schedule", asyncio.to_thread(self.schedule_manager.get_schedule), {}),
+            self._stage("summary", summary_stage, ""),
+        )
+        memory_recall = [mem['content'] for mem in related_memories]
+        log_info(f'最近的对话记忆：{recent_memories}')
+        log_info(f'相关长期记忆：{memory_recall}')
+        log_info(f'上下文获取耗时 {time.perf_counter() - start:.3f} 秒')
+        return {
+            "recent_memories": recent_memories,
+            "memory_recall": memory_recall,
+            "schedule": schedule,
+            "summary": summary,
+        }
+
+    async def abuild_messages(self, sender: str, chat_name: str, user_key: str,
+                              content: Union[str, List[str]], current_time: str) -> List[Dict]:
+        """获取上下文并构建发送给模型的 messages 列表（按 token 预算取舍近期对话、相关记忆和日程）"""
+        context = await self.agather_context(user_key, sender, content)
+        dropped: List[Dict] = []
+        messages = self.prompt_builder.build_messages_list(
+            sender=sender,
+            chat_name=chat_name,
+            new_message=content,
+            memory_context=context["recent_memories"],
+            current_time=current_time,
+            memory_recall=context["memory_recall"],
+            schedule=context["schedule"],
+            summary=context["summary"],
+            on_history_dropped=dropped.extend if self.summarizer is not None else None,
+        )
+        if dropped and dropped[-1].get("timestamp"):
+            # 超出预算的旧对话不会再发送，提前挤出临时记忆并入滚动摘要，而不是等到超过 max_rounds
+            try:
+                await asyncio.to_thread(self.memory_manager.evict_until, user_key, dropped[-1]["timestamp"])
+            except Exception as e:
+                log_error(f"挤出 {user_key} 超出预算的对话失败: {str(e)}")
+        return messages
+
+    async def areply(self, sender: str, chat_name: str, user_key: str,
+                     content: Union[str, List[str]], current_time: str) -> str:
+        """获取上下文、构建 prompt 并调用模型，返回模型的原始回复"""
+        messages = await self.abuild_messages(sender, chat_name, user_key, content, current_time)
+        start = time.perf_counter()
+        response = await async_call_deepseek_chat_api(self.chat_client, messages, self.model)
+        self._record("chat", time.perf_counter() - start)
+        return response
+
+    async def areply_stream(self, sender: str, chat_name: str, user_key: str,
+                            content: Union[str, List[str]], current_time: str,
+                            on_message: Callable[[str], None]) -> Tuple[str, List[str]]:
+        """流式调用模型，每条 <message> 生成完就审查并交出，不必等整段回复生成完
+
+        审查在后台任务中按生成顺序进行，不阻塞后续内容的接收；
+        on_message 在事件循环中以审查后的消息调用，不能阻塞（如放入队列）
+
+        Returns:
+            tuple: (完整的模型回复, 已发送的原始消息列表)
+        """
+        messages = await self.abuild_messages(sender, chat_name, user_key, content, current_time)
+        start = time.perf_counter()
+        outbox: asyncio.Queue = asyncio.Queue()
+        sent: List[str] = []
+
+        async def deliver():
+            while True:
+                message = await outbox.get()
+                if message is None:
+                    return
+                try:
+                    moderated = (await self.amoderate([message]))[0]
+                except Exception as e:
+                    # 审查失败时按不安全处理，不把未经审查的内容发出去
+                    log_error(f"审查流式消息失败，按不安全处理: {str(e)}")
+                    FILTERED.inc()
+                    moderated = "FILTERED"
+                try:
+                    on_message(moderated)
+                except Exception as e:
+                    log_error(f"发送流式消息失败: {str(e)}")
+                    continue
+                # 只有交出去的消息才算已发送，否则调用方会按非流式路径整段补发
+                if not sent:
+                    self._record("first_message", time.perf_counter() - start)
+                sent.append(message)
+
+        deliverer = asyncio.create_task(deliver())
+        try:
+            response = await async_stream_deepseek_chat_api(self.chat_client, messages, outbox.put_nowait, self.model)
+        finally:
+            outbox.put_nowait(None)
+            await deliverer
+        self._record("chat", time.perf_counter() - start)
+        return response, sent
+
+    async def _amoderate_one(self, message):
+        if isinstance(message, str):
+            result = await self.moderator.amoderate_text(message)
+        elif isinstance(message, dict) and message.get('type') == 'image_url':
+            result = await self.moderator.amoderate_image(message['image_url']['url'])
+        else:
+            return message
+        if is_content_safe(result):
+            return message
+        FILTERED.inc()
+        return "FILTERED"
+
+    async def amoderate(self, messages: List) -> List:
+        """并发审查待发送的消息，不安全的消息替换为 "FILTERED"；未配置审查器时原样返回"""
+        if self.moderator is None or not messages:
+            return list(messages)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(self._amoderate_one(message) for message in messages))
+        self._record("moderation", time.perf_counter() - start)
+        return list(results)
+
+    async def adescribe_image(self, image_url: str) -> Optional[str]:
+        """描述图片内容，未配置图片处理器时返回None"""
+        if self.image_processor is None:
+            return None
+        return await self.image_processor.adescribe_image(image_url)
+
+    # ---- 同步接口，供工作线程调用 ----
+
+    def gather_context(self, user_key: str, sender: str, content: Union[str, List[str]]) -> Dict:
+        return self.loop_thread.run(self.agather_context(user_key, sender, content))
+
+    def reply(self, sender: str, chat_name: str, user_key: str,
+              content: Union[str, List[str]], current_time: str) -> str:
+        return self.loop_thread.run(self.areply(sender, chat_name, user_key, content, current_time))
+
+    def reply_stream(self, sender: str, chat_name: str, user_key: str,
+                     content: Union[str, List[str]], current_time: str,
+                     send: Callable[[str], None]) -> Tuple[str, List[str]]:
+        """areply_stream 的同步接口：send 在调用方线程中按生成顺序逐条调用"""
+        outbox: queue.Queue = queue.Queue()
+        future = self.loop_thread.submit(
+            self.areply_stream(sender, chat_name, user_key, content, current_time, outbox.put))
+        future.add_done_callback(lambda _: outbox.put(_DONE))
+        while True:
+            message = outbox.get()
+            if message is _DONE:
+                break
+            send(message)
+        return future.result()
+
+    def moderate(self, messages: List) -> List:
+        return self.loop_thread.run(self.amoderate(messages))
+
+    def describe_image(self, image_url: str) -> Optional[str]:
+        return self.loop_thread.run(self.adescribe_image(image_url))
+
+    def stats(self) -> Dict:
+        """返回各阶段的调用次数、平均耗时、最大耗时和失败次数"""
+        with self._stats_lock:
+            return {
+                stage: {
+                    "count": int(stats["count"]),
+                    "avg": stats["total"] / stats["count"] if stats["count"] else 0.0,
+                    "max": stats["max"],
+                    "failed": int(stats["failed"]),
+                }
+                for stage, stats in self.stage_stats.items()
+            }
+
+    def close(self):
+        """停止事件循环线程"""
+        self.loop_thread.close()
@@ -4,6 +4,7 @@
 
 import json
 import os
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -11,6 +12,8 @@ from datetime import datetime
 HISTORY_DIR = os.path.join(os.path.dirname(__file__), '..', 'chat_history')
 # 确保目录存在
 Path(HISTORY_DIR).mkdir(parents=True, exist_ok=True)
+# 多个会话并行处理时串行化读改写，避免互相覆盖
+_history_lock = threading.Lock()
 
 def save_chat_history(sender: str, user_message: str, ai_response: str):
     """保存单条聊天记录
@@ -32,16 +35,17 @@ def save_chat_history(sender: str, user_message: str, ai_response: str):
         'ai_response': ai_response
     }
     
-    # 读取现有记录或创建新文件
-    try:
-        with open(history_file, 'r', encoding='utf-8') as f:
-            history = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        history = []
-    
-    # 添加新记录
-    history.append(record)
-    
-    # 保存文件
-    with open(history_file, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+    with _history_lock:
+        # 读取现有记录或创建新文件
+        try:
+            with open(history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            history = []
+
+        # 添加新记录
+        history.append(record)
+
+        # 保存文件
+        with open(history_file, 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=2)
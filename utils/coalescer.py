@@ -0,0 +1,99 @@
+"""消息合并模块
+用户常常连发几条短消息。同一会话在防抖窗口内到达的消息先缓冲起来，
+窗口内没有新消息（或自第一条起已等满最长等待时间）时作为一批交给回调，
+只计算一次回复意愿、只调用一次模型
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List
+
+from utils.logger import log_error, log_info
+
+
+class BurstCoalescer:
+    def __init__(self, flush: Callable[[str, List], None], window: float = 2.0, max_wait: float = 8.0):
+        """初始化消息合并器
+
+        Args:
+            flush: 回调函数，以 (user_key, 该批消息列表) 调用
+            window: 防抖窗口秒数，每来一条新消息就重新计时；为0时不合并，立即交出
+            max_wait: 自一批的第一条消息起最长等待秒数，防止连续刷屏时一直不回复
+        """
+        self.flush = flush
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self._pending: Dict[str, dict] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.messages = 0
+        self.batches = 0
+        self.largest_batch = 0
+
+        self._thread = threading.Thread(target=self._run, name="burst-coalescer", daemon=True)
+        self._thread.start()
+
+    def add(self, user_key: str, item):
+        """缓冲一条消息"""
+        if self.window <= 0 or self._closed:
+            self._emit(user_key, [item])
+            return
+        now = time.monotonic()
+        with self._cond:
+            batch = self._pending.get(user_key)
+            if batch is None:
+                batch = self._pending[user_key] = {"items": [], "first": now}
+            batch["items"].append(item)
+            batch["deadline"] = min(now + self.window, batch["first"] + self.max_wait)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    now = time.monotonic()
+                    due = [user_key for user_key, batch in self._pending.items()
+                           if self._closed or batch["deadline"] <= now]
+                    if due:
+                        break
+                    next_deadline = min((batch["deadline"] for batch in self._pending.values()), default=None)
+                    self._cond.wait(None if next_deadline is None else next_deadline - now)
+                # 按第一条消息的到达顺序交出
+                due.sort(key=lambda user_key: self._pending[user_key]["first"])
+                ready = [(user_key, self._pending.pop(user_key)["items"]) for user_key in due]
+            for user_key, items in ready:
+                self._emit(user_key, items)
+
+    def _emit(self, user_key: str, items: List):
+        with self._cond:
+            self.messages += len(items)
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, len(items))
+        if len(items) > 1:
+            log_info(f"合并 {user_key} 连发的 {len(items)} 条消息为一次回复")
+        try:
+            self.flush(user_key, items)
+        except Exception as e:
+            log_error(f"交出 {user_key} 的合并消息失败: {str(e)}")
+
+    def stats(self) -> Dict:
+        """返回合并统计；saved_calls 为合并后少触发的回复次数"""
+        with self._cond:
+            return {
+                "messages": self.messages,
+                "batches": self.batches,
+                "saved_calls": self.messages - self.batches,
+                "largest_batch": self.largest_batch,
+                "buffered": sum(len(batch["items"]) for batch in self._pending.values()),
+            }
+
+    def close(self, timeout: float = 5.0):
+        """立即交出所有缓冲中的消息并停止后台线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        log_info(f"消息合并器已关闭: {self.stats()}")
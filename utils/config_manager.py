@@ -64,3 +64,100 @@ def update_other_names(new_names: List[str]) -> None:
     config = get_config()
     config['other_name'] = new_names
     update_config(config)
+
+class ConfigError(ValueError):
+    """配置缺失或取值无效"""
+
+
+def _number(config: Dict, key: str, default, errors: List[str], minimum: float = 0, integer: bool = False):
+    value = config.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and not isinstance(value, int)):
+        errors.append(f"{key} 应为{'整数' if integer else '数字'}，实际为 {value!r}")
+        return default
+    if value < minimum:
+        errors.append(f"{key} 不能小于 {minimum}，实际为 {value!r}")
+        return default
+    return value
+
+
+def validate_config(config: Dict) -> Dict:
+    """校验主配置并返回补全默认值后的副本
+
+    - chat.base_url 必填；other_name 必须是名称列表（单个字符串会转为列表）
+    - image_processor_key / long_term_memory_key / moderator_key 为空时使用 chat.key
+    - 数值项检查类型和范围
+
+    Raises:
+        ConfigError: 汇总列出所有问题
+    """
+    errors: List[str] = []
+    config = dict(config)
+
+    chat = config.get('chat')
+    if not isinstance(chat, dict) or not isinstance(chat.get('base_url'), str) or not chat.get('base_url'):
+        errors.append("缺少 chat.base_url（聊天接口地址）")
+        chat = {}
+    chat = {'base_url': chat.get('base_url', ''), 'key': chat.get('key') or ''}
+    if not isinstance(chat['key'], str):
+        errors.append("chat.key 应为字符串")
+    config['chat'] = chat
+
+    other_name = config.get('other_name', [])
+    if isinstance(other_name, str):
+        other_name = [other_name]
+    if not isinstance(other_name, list) or not all(isinstance(name, str) for name in other_name):
+        errors.append("other_name 应为名称列表，如 [\"小泡\"]；接口地址和密钥请写在 chat 下")
+        other_name = []
+    config['other_name'] = [name for name in other_name if name]
+
+    if not isinstance(config.get('name', ''), str):
+        errors.append("name 应为字符串")
+    for key in ('image_processor_key', 'long_term_memory_key', 'moderator_key'):
+        value = config.get(key) or chat['key']
+        if not isinstance(value, str):
+            errors.append(f"{key} 应为字符串")
+        config[key] = value
+    admin = config.get('admin', {})
+    if not isinstance(admin, dict):
+        errors.append("admin 应为包含 name 和 command_group 的对象")
+
+    config['max_workers'] = _number(config, 'max_workers', 4, errors, minimum=1, integer=True)
+    # 0 表示不限排队数 / 不降级
+    config['max_pending'] = _number(config, 'max_pending', 200, errors, integer=True)
+    config['degrade_depth'] = _number(config, 'degrade_depth', 100, errors, integer=True)
+    if config['max_pending'] and config['degrade_depth'] > config['max_pending']:
+        errors.append("degrade_depth 不应大于 max_pending，否则降级永远不会触发")
+    config['burst_window'] = _number(config, 'burst_window', 2.0, errors)
+    config['burst_max_wait'] = _number(config, 'burst_max_wait', 8.0, errors)
+    config['poll_min_interval'] = _number(config, 'poll_min_interval', 0.2, errors, minimum=0.01)
+    config['poll_max_interval'] = _number(config, 'poll_max_interval', 5.0, errors, minimum=0.01)
+    if config['poll_max_interval'] < config['poll_min_interval']:
+        errors.append("poll_max_interval 不能小于 poll_min_interval")
+    for key, default in (('metrics_port', 9108), ('gateway_port', 8765)):
+        config[key] = _number(config, key, default, errors, integer=True)
+        if config[key] > 65535:
+            errors.append(f"{key} 超出端口范围: {config[key]}")
+    if not isinstance(config.get('stream_reply', True), bool):
+        errors.append("stream_reply 应为 true 或 false")
+    config['context_budget'] = _number(config, 'context_budget', 3000, errors, integer=True)
+    config['memory_max_rounds'] = _number(config, 'memory_max_rounds', 50, errors, minimum=1, integer=True)
+    config['summary_min_turns'] = _number(config, 'summary_min_turns', 10, errors, minimum=1, integer=True)
+    if not isinstance(config.get('rolling_summary', True), bool):
+        errors.append("rolling_summary 应为 true 或 false")
+    if not isinstance(config.get('summary_model', 'deepseek-chat'), str):
+        errors.append("summary_model 应为模型名字符串")
+    if config.get('memory_index_dtype', 'float32') not in ('float32', 'float16', 'int8'):
+        errors.append(f"memory_index_dtype 只能是 float32、float16 或 int8，实际为 {config.get('memory_index_dtype')!r}")
+    if config.get('prompt_layout', 'stable_prefix') not in ('stable_prefix', 'inline'):
+        errors.append(f"prompt_layout 只能是 stable_prefix 或 inline，实际为 {config.get('prompt_layout')!r}")
+    if config.get('transport', 'wxauto') not in ('wxauto', 'http'):
+        errors.append(f"transport 只能是 wxauto 或 http，实际为 {config.get('transport')!r}")
+    send_delay = config.get('send_delay', [0.5, 1.5])
+    if (not isinstance(send_delay, list) or len(send_delay) != 2
+            or not all(isinstance(v, (int, float)) and v >= 0 for v in send_delay)
+            or send_delay[0] > send_delay[1]):
+        errors.append(f"send_delay 应为 [最短秒数, 最长秒数]，实际为 {send_delay!r}")
+
+    if errors:
+        raise ConfigError("配置无效:\n" + "\n".join(f"- {error}" for error in errors))
+    return config
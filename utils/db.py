@@ -0,0 +1,97 @@
+"""SQLite 连接管理模块
+每个数据库文件一个长连接写入者 + 读连接池，统一开启 WAL 和性能相关 PRAGMA，
+读写互不阻塞
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from utils.logger import logger
+
+
+class SQLiteConnectionManager:
+    def __init__(self, db_path: str, pool_size: int = 4, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size_kb: int = 64 * 1024, busy_timeout_ms: int = 5000):
+        """初始化连接管理器
+
+        Args:
+            db_path: SQLite数据库路径
+            pool_size: 读连接池保留的最大空闲连接数
+            mmap_size: 内存映射读取的字节数上限
+            cache_size_kb: 每个连接的页缓存大小（KB）
+            busy_timeout_ms: 遇到锁时的等待毫秒数
+        """
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._writer_lock = threading.RLock()
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout_ms)}')
+        return conn
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """获取独占的写连接，退出时提交，出错时回滚"""
+        with self._writer_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """从连接池借出一个读连接"""
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            if self._readers.qsize() < self.pool_size:
+                self._readers.put(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """关闭全部连接"""
+        with self._writer_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_managers: Dict[str, SQLiteConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> SQLiteConnectionManager:
+    """获取数据库文件对应的共享连接管理器（同一路径在进程内只创建一次）"""
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None:
+            manager = _managers[db_path] = SQLiteConnectionManager(db_path)
+            logger.info(f"SQLite connection manager ready: {db_path} (WAL)")
+        return manager
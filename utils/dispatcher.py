@@ -0,0 +1,249 @@
+"""消息分发模块
+把新消息交给有上限的工作线程池处理：同一会话（user_key）内严格按到达顺序串行，
+不同会话之间并行，一个会话的慢回复不再阻塞其他会话。
+
+等待工作线程的会话按优先级（数值越小越优先）排队，同优先级按入队先后；
+总排队数有上限，满载时先丢弃优先级最低的消息，积压较多时低优先级消息可走降级处理
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from utils.logger import log_error, log_info, log_warning
+from utils.metrics import DEGRADED, SHED
+
+
+class ChatDispatcher:
+    def __init__(self, handler: Callable, max_workers: int = 4, max_pending_per_chat: int = 50,
+                 initializer: Optional[Callable] = None, max_pending: int = 0,
+                 degrade_handler: Optional[Callable] = None, degrade_depth: int = 0,
+                 degrade_priority: int = 0, priority_names: Optional[Dict[int, str]] = None):
+        """初始化分发器
+
+        Args:
+            handler: 处理单条消息的函数，以 submit 传入的参数调用
+            max_workers: 工作线程数，即最多同时处理的会话数
+            max_pending_per_chat: 单个会话最多排队的消息数，超出时丢弃最旧的消息
+            initializer: 可选，每个工作线程启动时调用一次（如初始化 COM）
+            max_pending: 所有会话合计的排队上限，0 表示不限；满载时丢弃优先级最低的消息
+            degrade_handler: 可选，降级处理函数，参数与 handler 相同
+            degrade_depth: 排队数达到该值时，优先级数值不小于 degrade_priority 的消息改由 degrade_handler 处理；
+                           0 表示不降级
+            degrade_priority: 参与降级的最高优先级（数值）
+            priority_names: 优先级数值到名称的映射，用于统计和指标标签
+        """
+        self.handler = handler
+        self.max_pending_per_chat = max_pending_per_chat
+        self.max_pending = max_pending
+        self.degrade_handler = degrade_handler
+        self.degrade_depth = degrade_depth
+        self.degrade_priority = degrade_priority
+        self.priority_names = priority_names or {}
+        self.initializer = initializer
+        self._queues: Dict[str, Deque[tuple]] = {}
+        # 等待工作线程的会话：(优先级, 序号, user_key)；_scheduled 记录每个会话当前有效的条目
+        self._ready: List[Tuple[int, int, str]] = []
+        self._scheduled: Dict[str, Tuple[int, int]] = {}
+        self._seq = itertools.count()
+        self._active = set()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._closed = False
+        self._abort = False
+
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.degraded = 0
+        self.max_depth = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self.shed: Dict[str, int] = {}
+        self._wait_by_priority: Dict[int, List[float]] = {}
+
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"chat-worker_{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _priority_name(self, priority: int) -> str:
+        return self.priority_names.get(priority, str(priority))
+
+    def _count_shed(self, priority: int):
+        name = self._priority_name(priority)
+        self.shed[name] = self.shed.get(name, 0) + 1
+        SHED.labels(name).inc()
+
+    def _schedule(self, user_key: str):
+        """按会话中最优先的消息把会话放入就绪堆（调用方持有锁）"""
+        pending = self._queues.get(user_key)
+        if not pending or user_key in self._active:
+            self._scheduled.pop(user_key, None)
+            return
+        priority = min(item[1] for item in pending)
+        current = self._scheduled.get(user_key)
+        if current is not None and current[0] <= priority:
+            return
+        entry = (priority, next(self._seq))
+        self._scheduled[user_key] = entry
+        heapq.heappush(self._ready, (entry[0], entry[1], user_key))
+
+    def _shed_lowest(self, priority: int) -> bool:
+        """满载时丢弃一条优先级比 priority 更低的排队消息（同为最低时丢最旧的），调用方持有锁"""
+        victim = None
+        for user_key, pending in self._queues.items():
+            for index, item in enumerate(pending):
+                if item[1] > priority and (victim is None or (item[1], -item[0]) > (victim[2], -victim[3])):
+                    victim = (user_key, index, item[1], item[0])
+        if victim is None:
+            return False
+        user_key, index, victim_priority, _ = victim
+        del self._queues[user_key][index]
+        self._pending -= 1
+        self._count_shed(victim_priority)
+        # 会话的最高优先级可能因此变化，重新入堆
+        self._scheduled.pop(user_key, None)
+        if self._queues[user_key] or user_key in self._active:
+            self._schedule(user_key)
+        else:
+            del self._queues[user_key]
+        return True
+
+    def submit(self, user_key: str, *args, priority: int = 0) -> bool:
+        """把一条消息放入对应会话的队列，立即返回
+
+        Args:
+            priority: 优先级，数值越小越优先
+
+        Returns:
+            bool: 是否成功入队（分发器已关闭或满载被丢弃时为 False）
+        """
+        with self._cond:
+            if self._closed:
+                log_warning(f"分发器已关闭，丢弃来自 {user_key} 的消息")
+                return False
+            if self.max_pending and self._pending >= self.max_pending and not self._shed_lowest(priority):
+                self._count_shed(priority)
+                log_warning(f"排队消息已达上限 {self.max_pending}，丢弃来自 {user_key} 的"
+                            f" {self._priority_name(priority)} 消息")
+                return False
+            pending = self._queues.setdefault(user_key, deque())
+            if len(pending) >= self.max_pending_per_chat:
+                pending.popleft()
+                self._pending -= 1
+                self.dropped += 1
+                log_warning(f"{user_key} 的待处理消息超过 {self.max_pending_per_chat} 条，丢弃最旧的一条")
+            pending.append((time.monotonic(), priority, args))
+            self._pending += 1
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(pending))
+            # 每个会话同一时刻最多占用一个工作线程，保证会话内顺序
+            self._schedule(user_key)
+            self._cond.notify()
+        return True
+
+    def _next(self) -> Optional[Tuple[str, float, int, tuple, bool]]:
+        """取出下一个要处理的 (会话, 入队时间, 优先级, 参数, 是否降级)；关闭且无事可做时返回None"""
+        with self._cond:
+            while True:
+                if self._abort:
+                    return None
+                while self._ready:
+                    priority, seq, user_key = heapq.heappop(self._ready)
+                    if self._scheduled.get(user_key) != (priority, seq):
+                        continue
+                    del self._scheduled[user_key]
+                    enqueued_at, item_priority, args = self._queues[user_key].popleft()
+                    self._pending -= 1
+                    self._active.add(user_key)
+                    degrade = (self.degrade_handler is not None and self.degrade_depth > 0
+                               and item_priority >= self.degrade_priority
+                               and self._pending >= self.degrade_depth)
+                    return user_key, enqueued_at, item_priority, args, degrade
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _worker(self):
+        if self.initializer is not None:
+            try:
+                self.initializer()
+            except Exception as e:
+                log_error(f"工作线程初始化失败: {str(e)}")
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            user_key, enqueued_at, priority, args, degrade = item
+            wait = time.monotonic() - enqueued_at
+            with self._lock:
+                self.started += 1
+                self.total_wait += wait
+                self._wait_by_priority.setdefault(priority, [0, 0.0])
+                self._wait_by_priority[priority][0] += 1
+                self._wait_by_priority[priority][1] += wait
+            try:
+                if degrade:
+                    DEGRADED.inc()
+                    self.degrade_handler(*args)
+                else:
+                    self.handler(*args)
+                with self._lock:
+                    self.processed += 1
+                    self.degraded += degrade
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                log_error(f"处理 {user_key} 的消息失败: {str(e)}")
+            finally:
+                with self._cond:
+                    self._active.discard(user_key)
+                    if self._queues.get(user_key):
+                        # 处理完一批就让出工作线程，会话按优先级重新排队
+                        self._schedule(user_key)
+                        self._cond.notify()
+                    else:
+                        self._queues.pop(user_key, None)
+
+    def stats(self) -> Dict:
+        """返回队列深度和处理统计；shed 为满载时按优先级丢弃的消息数"""
+        with self._lock:
+            depths = {user_key: len(pending) for user_key, pending in self._queues.items() if pending}
+            return {
+                "pending": self._pending,
+                "active_chats": len(self._active),
+                "queue_depths": depths,
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "shed": dict(self.shed),
+                "degraded": self.degraded,
+                "avg_wait": self.total_wait / self.started if self.started else 0.0,
+                "avg_wait_by_priority": {
+                    self._priority_name(priority): total / count
+                    for priority, (count, total) in sorted(self._wait_by_priority.items())
+                },
+            }
+
+    def close(self, wait: bool = True):
+        """停止接收新消息；wait 为 True 时等待已排队的消息处理完"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._abort = not wait
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        log_info(f"消息分发器已关闭: {self.stats()}")
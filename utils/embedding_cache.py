@@ -0,0 +1,156 @@
+"""嵌入向量缓存模块
+进程内 LRU + SQLite 持久化的两级缓存，避免对重复文本反复请求嵌入接口
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from utils.logger import logger
+from utils.db import get_connection_manager
+
+
+class EmbeddingCache:
+    def __init__(self, db_path: str, max_memory_items: int = 2048, max_disk_items: int = 100000,
+                 evict_check_interval: int = 200):
+        """初始化嵌入缓存
+
+        Args:
+            db_path: SQLite数据库路径（缓存表与记忆表共用同一个库）
+            max_memory_items: 进程内 LRU 最大条数
+            max_disk_items: 持久化表最大条数，超出后按最近使用时间淘汰
+            evict_check_interval: 每写入多少条检查一次持久化表大小
+        """
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.evict_check_interval = evict_check_interval
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_check = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = get_connection_manager(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        """初始化缓存表"""
+        with self.db.writer() as conn:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL
+            )
+            ''')
+            conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used
+            ON embedding_cache(last_used)
+            ''')
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本：全半角统一、去首尾空白、合并连续空白"""
+        text = unicodedata.normalize('NFKC', text)
+        return re.sub(r'\s+', ' ', text).strip()
+
+    @classmethod
+    def make_key(cls, model: str, text: str) -> str:
+        """由模型名和规范化文本生成缓存键"""
+        raw = f"{model}\0{cls.normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[bytes]:
+        """查询缓存
+
+        Args:
+            model: 嵌入模型名
+            text: 原始文本
+
+        Returns:
+            缓存的嵌入字节串，未命中返回None
+        """
+        key = self.make_key(model, text)
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return blob
+
+        with self.db.reader() as conn:
+            row = conn.execute('SELECT embedding FROM embedding_cache WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            with self.db.writer() as conn:
+                conn.execute('UPDATE embedding_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, row[0])
+        return row[0]
+
+    def put(self, model: str, text: str, blob: bytes):
+        """写入缓存
+
+        Args:
+            model: 嵌入模型名
+            text: 原始文本
+            blob: 嵌入字节串
+        """
+        key = self.make_key(model, text)
+        with self._lock:
+            self._remember(key, blob)
+            self._puts_since_check += 1
+            check_size = self._puts_since_check >= self.evict_check_interval
+            if check_size:
+                self._puts_since_check = 0
+
+        with self.db.writer() as conn:
+            conn.execute('''
+            INSERT OR REPLACE INTO embedding_cache (key, embedding, last_used)
+            VALUES (?, ?, ?)
+            ''', (key, blob, time.time()))
+            if check_size:
+                self._evict_disk(conn)
+
+    def _remember(self, key: str, blob: bytes):
+        """写入进程内 LRU 并淘汰最久未使用的条目（调用方持有锁）"""
+        self._memory[key] = blob
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, conn: sqlite3.Connection):
+        """持久化表超出上限时删除最久未使用的条目"""
+        count = conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        overflow = count - self.max_disk_items
+        if overflow > 0:
+            conn.execute('''
+            DELETE FROM embedding_cache WHERE key IN (
+                SELECT key FROM embedding_cache ORDER BY last_used LIMIT ?
+            )
+            ''', (overflow,))
+            logger.info(f"Embedding cache evicted {overflow} entries")
+
+    def stats(self) -> Dict:
+        """返回命中统计"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_items": len(self._memory),
+            }
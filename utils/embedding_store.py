@@ -0,0 +1,129 @@
+"""嵌入向量文件模块
+与 memories.db 并列的只追加 float32 向量文件，按记忆ID直接寻址，
+读者以只读方式内存映射，多个进程共享同一份页缓存
+
+文件格式（类似 .npy：固定头 + 连续行主序 float32 矩阵）：
+    [0:8)    魔数 b'OPEMB001'
+    [8:12)   维度 uint32
+    [16:24)  高水位 uint64，已写入的最大记忆ID
+    [64:)    第 i 行（i 从 0 开始）存放 ID 为 i+1 的向量，未写入或已删除的行为零向量
+"""
+
+import os
+import struct
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+MAGIC = b'OPEMB001'
+HEADER_SIZE = 64
+_HEADER_FORMAT = '<8sI4xQ'
+
+
+class EmbeddingFile:
+    def __init__(self, path: str, readonly: bool = False):
+        """打开（或在首次写入时创建）嵌入向量文件
+
+        Args:
+            path: 文件路径
+            readonly: 只读打开，用于其他进程共享读取
+        """
+        self.path = path
+        self.readonly = readonly
+        self.dim: Optional[int] = None
+        self.high_water = 0
+        self._map: Optional[np.memmap] = None
+        self._mapped_rows = 0
+        self._lock = threading.RLock()
+        if os.path.exists(path):
+            self._read_header()
+
+    def _read_header(self):
+        with open(self.path, 'rb') as f:
+            magic, dim, high_water = struct.unpack_from(_HEADER_FORMAT, f.read(HEADER_SIZE))
+        if magic != MAGIC:
+            raise ValueError(f"Not an embedding file: {self.path}")
+        self.dim, self.high_water = dim, high_water
+
+    def _write_header(self, f):
+        f.seek(0)
+        f.write(struct.pack(_HEADER_FORMAT, MAGIC, self.dim, self.high_water).ljust(HEADER_SIZE, b'\0'))
+
+    @property
+    def row_bytes(self) -> int:
+        return self.dim * 4
+
+    def write(self, ids: List[int], vectors: np.ndarray):
+        """写入（或覆盖）若干记忆的向量，并推进高水位
+
+        Args:
+            ids: 记忆ID列表
+            vectors: 与 ids 对应的 float32 向量矩阵
+        """
+        if self.readonly:
+            raise PermissionError("Embedding file opened read-only")
+        if len(ids) == 0:
+            return
+        vectors = np.asarray(vectors, dtype='<f4')
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.path, 'wb') as f:
+                    self._write_header(f)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match file dimension {self.dim}")
+
+            with open(self.path, 'r+b') as f:
+                new_high_water = max(self.high_water, max(ids))
+                needed = HEADER_SIZE + new_high_water * self.row_bytes
+                if os.fstat(f.fileno()).st_size < needed:
+                    f.truncate(needed)
+                for memory_id, vector in zip(ids, vectors):
+                    f.seek(HEADER_SIZE + (memory_id - 1) * self.row_bytes)
+                    f.write(vector.tobytes())
+                # 先写数据再推进高水位，读者不会看到未写完的行
+                f.flush()
+                self.high_water = new_high_water
+                self._write_header(f)
+
+    def truncate(self, high_water: int):
+        """把高水位回退到 high_water 并截断文件（用于与数据库对齐）"""
+        if self.readonly:
+            raise PermissionError("Embedding file opened read-only")
+        with self._lock:
+            if self.dim is None or high_water >= self.high_water:
+                return
+            with open(self.path, 'r+b') as f:
+                self.high_water = high_water
+                self._write_header(f)
+                f.truncate(HEADER_SIZE + high_water * self.row_bytes)
+            self._map = None
+
+    def refresh(self):
+        """重新读取文件头，其他进程追加后调用"""
+        with self._lock:
+            if os.path.exists(self.path):
+                self._read_header()
+
+    def matrix(self) -> np.ndarray:
+        """返回只读内存映射的全部行，形状 (高水位, 维度)"""
+        with self._lock:
+            if self.dim is None or self.high_water == 0:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            if self._map is None or self._mapped_rows != self.high_water:
+                self._map = np.memmap(self.path, dtype='<f4', mode='r', offset=HEADER_SIZE,
+                                      shape=(self.high_water, self.dim))
+                self._mapped_rows = self.high_water
+            return self._map
+
+    def get(self, ids: List[int]) -> np.ndarray:
+        """按记忆ID读取向量，超出高水位的ID返回零向量；只读打开时先刷新文件头，读到其他进程新追加的行"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.readonly and len(ids) and ids.max() > self.high_water:
+            self.refresh()
+        matrix = self.matrix()
+        result = np.zeros((len(ids), self.dim or 0), dtype=np.float32)
+        valid = (ids >= 1) & (ids <= len(matrix))
+        result[valid] = matrix[ids[valid] - 1]
+        return result
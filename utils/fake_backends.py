@@ -0,0 +1,382 @@
+"""离线测试用的替身后端
+FakeWeChat 模拟 wxauto.WeChat 的收发接口；FakeOpenAIServer 是本地的 OpenAI 兼容 HTTP 服务，
+支持聊天（含流式）、嵌入和内容审查接口，可配置首字延迟、生成速率和错误率。
+供 utils.replay 在没有微信窗口和真实 API 的 Linux 上回放流量、做压测。
+压测时应在独立进程中运行假服务，避免与被测进程争抢 GIL：
+
+    python -m utils.fake_backends --port 18080 --latency 0.3 --tps 50
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+
+MODERATION_CATEGORIES = (
+    "harassment", "harassment/threatening", "hate", "hate/threatening", "illicit", "illicit/violent",
+    "self-harm", "self-harm/instructions", "self-harm/intent", "sexual", "sexual/minors",
+    "violence", "violence/graphic",
+)
+
+
+class FakeMessage:
+    def __init__(self, sender: str, content: str, type: str = "friend"):
+        self.sender = sender
+        self.content = content
+        self.type = type
+
+
+class FakeChat:
+    def __init__(self, name: str, on_send: Optional[Callable] = None):
+        self.name = name
+        self.on_send = on_send
+        self.sent: List = []
+
+    def SendMsg(self, msg):
+        self.sent.append(msg)
+        if self.on_send is not None:
+            self.on_send(self.name, msg)
+
+
+class FakeWeChat:
+    def __init__(self, on_send: Optional[Callable] = None):
+        """模拟 wxauto.WeChat：push() 注入的消息由 GetNextNewMessage() 按会话取出
+
+        Args:
+            on_send: 可选，以 (会话名, msg) 调用的发送回调，用于统计回复延迟
+        """
+        self.on_send = on_send
+        self.chats: Dict[str, FakeChat] = {}
+        self.listeners: Dict[str, Callable] = {}
+        self._inbox: deque = deque()
+        self._lock = threading.Lock()
+
+    def chat(self, name: str) -> FakeChat:
+        with self._lock:
+            if name not in self.chats:
+                self.chats[name] = FakeChat(name, self.on_send)
+            return self.chats[name]
+
+    def push(self, sender: str, content: str, chat_name: Optional[str] = None):
+        """注入一条好友消息；私聊的会话名默认为发送者"""
+        chat = self.chat(chat_name or sender)
+        with self._lock:
+            self._inbox.append((chat, FakeMessage(sender, content)))
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._inbox)
+
+    def GetNextNewMessage(self) -> Dict[FakeChat, List[FakeMessage]]:
+        with self._lock:
+            items, self._inbox = list(self._inbox), deque()
+        msgs: Dict[FakeChat, List[FakeMessage]] = {}
+        for chat, msg in items:
+            msgs.setdefault(chat, []).append(msg)
+        return msgs
+
+    def AddListenChat(self, nickname: str, callback: Optional[Callable] = None):
+        self.listeners[nickname] = callback
+
+    def LoadMoreMessage(self):
+        pass
+
+    def GetAllMessage(self) -> List:
+        return []
+
+
+def _estimate_tokens(text: str) -> int:
+    # 中文大约一字一个 token，英文约四个字符一个 token，这里只求量级
+    return max(1, len(text) // 2)
+
+
+def _split_tokens(text: str, size: int = 2) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def _usage(prompt_tokens: int, completion_tokens: int, cached: int) -> Dict:
+    # 与 DeepSeek 相同的字段名返回前缀缓存命中情况
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": cached, "prompt_cache_miss_tokens": prompt_tokens - cached}
+
+
+class _FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: "_FakeHTTPServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.fake.stats())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        fake = self.server.fake
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            body = {}
+        path = self.path.split("?")[0].rstrip("/")
+        endpoint = path.rsplit("/", 1)[-1]
+        if endpoint == "completions" and body.get("stream"):
+            endpoint = "chat_stream"
+        elif endpoint == "completions":
+            endpoint = "chat"
+        elif endpoint not in ("embeddings", "moderations"):
+            self._send_json(404, {"error": {"message": f"unknown endpoint {path}"}})
+            return
+
+        fake._count(endpoint)
+        if fake.error_rate and fake._rng_random() < fake.error_rate:
+            fake._count("errors")
+            time.sleep(fake.latency)
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        if endpoint == "chat_stream":
+            self._stream_chat(fake, body)
+        elif endpoint == "chat":
+            self._chat(fake, body)
+        elif endpoint == "embeddings":
+            time.sleep(fake.embedding_latency)
+            inputs = body.get("input", "")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            self._send_json(200, {
+                "object": "list",
+                "model": body.get("model", "fake-embedding"),
+                "data": [{"object": "embedding", "index": i, "embedding": fake.embed(str(text))}
+                         for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        else:
+            time.sleep(fake.moderation_latency)
+            self._send_json(200, {
+                "id": "modr-fake",
+                "model": body.get("model", "fake-moderation"),
+                "results": [{"flagged": False,
+                             "categories": {name: False for name in MODERATION_CATEGORIES},
+                             "category_scores": {name: 0.0 for name in MODERATION_CATEGORIES}}],
+            })
+
+    def _chat(self, fake: "FakeOpenAIServer", body: Dict):
+        text, prompt_tokens = fake.completion(body)
+        cached = fake.prefix_cache_hit(body.get("messages") or [])
+        tokens = _split_tokens(text)
+        time.sleep(fake.latency + len(tokens) / fake.tokens_per_second)
+        fake._add_tokens(prompt_tokens, len(tokens), cached)
+        self._send_json(200, {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake-chat"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                         "finish_reason": "stop"}],
+            "usage": _usage(prompt_tokens, len(tokens), cached),
+        })
+
+    def _stream_chat(self, fake: "FakeOpenAIServer", body: Dict):
+        text, prompt_tokens = fake.completion(body)
+        cached = fake.prefix_cache_hit(body.get("messages") or [])
+        tokens = _split_tokens(text)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def emit(delta: Dict, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake-chat"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(fake.latency)
+        emit({"role": "assistant", "content": ""})
+        interval = 1.0 / fake.tokens_per_second
+        for token in tokens:
+            time.sleep(interval)
+            emit({"content": token})
+        emit({}, finish_reason="stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model", "fake-chat"), "choices": [],
+                     "usage": _usage(prompt_tokens, len(tokens), cached)}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        fake._add_tokens(prompt_tokens, len(tokens), cached)
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    fake: "FakeOpenAIServer"
+
+
+class FakeOpenAIServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.3,
+                 tokens_per_second: float = 50.0, error_rate: float = 0.0,
+                 embedding_latency: float = 0.05, moderation_latency: float = 0.05,
+                 embedding_dim: int = 256, reply_messages: int = 2, seed: int = 0,
+                 prefix_cache_size: int = 10000):
+        """本地 OpenAI 兼容服务
+
+        Args:
+            port: 监听端口，0 表示随机空闲端口
+            latency: 聊天接口的首字延迟秒数
+            tokens_per_second: 聊天接口的生成速率
+            error_rate: 各接口返回 500 的概率
+            embedding_latency: 嵌入接口延迟秒数
+            moderation_latency: 审查接口延迟秒数
+            embedding_dim: 嵌入向量维度
+            reply_messages: 每次回复包含的 <message> 条数
+            seed: 错误注入的随机种子
+            prefix_cache_size: 模拟前缀缓存保留的前缀数，按整条消息粒度匹配
+        """
+        self.latency = latency
+        self.tokens_per_second = max(tokens_per_second, 1e-3)
+        self.error_rate = error_rate
+        self.embedding_latency = embedding_latency
+        self.moderation_latency = moderation_latency
+        self.embedding_dim = embedding_dim
+        self.reply_messages = reply_messages
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_cache_hit_tokens = 0
+        self.prefix_cache_size = prefix_cache_size
+        self._prefixes: "OrderedDict[str, None]" = OrderedDict()
+
+        self.httpd = _FakeHTTPServer((host, port), _FakeOpenAIHandler)
+        self.httpd.fake = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> str:
+        """在后台线程启动服务，返回 base_url"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _rng_random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _count(self, endpoint: str):
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def _add_tokens(self, prompt_tokens: int, completion_tokens: int, cached: int = 0):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.prompt_cache_hit_tokens += cached
+
+    def prefix_cache_hit(self, messages: List[Dict]) -> int:
+        """模拟服务端前缀缓存：返回与之前请求相同的最长消息前缀的 token 数，并把本次的各级前缀加入缓存"""
+        digest = hashlib.md5()
+        hit = tokens = 0
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps(message, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+                tokens += _estimate_tokens(str(message.get("content") or ""))
+                # 前缀逐条累积哈希，命中某一级即说明它之前的各级也相同
+                key = digest.hexdigest()
+                if key in self._prefixes:
+                    self._prefixes.move_to_end(key)
+                    hit = tokens
+                else:
+                    self._prefixes[key] = None
+            while len(self._prefixes) > self.prefix_cache_size:
+                self._prefixes.popitem(last=False)
+        return hit
+
+    def embed(self, text: str) -> List[float]:
+        """按文本哈希生成确定的向量，相同文本得到相同嵌入"""
+        rng = random.Random(hashlib.md5(text.encode("utf-8")).digest())
+        return [rng.gauss(0.0, 1.0) for _ in range(self.embedding_dim)]
+
+    def completion(self, body: Dict):
+        """按请求生成回复文本，返回 (文本, 估算的 prompt token 数)"""
+        messages = body.get("messages") or []
+        prompt_tokens = sum(_estimate_tokens(str(m.get("content") or "")) for m in messages)
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # 日程生成
+            return json.dumps({"tasks": [
+                {"name": "上课", "time": "08:00-12:00"},
+                {"name": "午休", "time": "12:00-13:30"},
+                {"name": "写作业", "time": "19:00-21:00"},
+            ]}, ensure_ascii=False), prompt_tokens
+        last = str(messages[-1].get("content") or "") if messages else ""
+        snippet = last.strip().splitlines()[-1][-20:] if last.strip() else ""
+        parts = [f"<message>收到：{snippet}</message>"]
+        parts += [f"<message>这是第{i + 1}条回复</message>" for i in range(1, self.reply_messages)]
+        return "".join(parts), prompt_tokens
+
+    def stats(self) -> Dict:
+        """各接口调用次数和 token 统计，也可通过 GET <base_url>/stats 获取"""
+        with self._lock:
+            return {
+                "calls": dict(self.counts),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "prompt_cache_hit_tokens": self.prompt_cache_hit_tokens,
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容假服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="0 表示随机空闲端口")
+    parser.add_argument("--latency", type=float, default=0.3, help="聊天接口首字延迟秒数")
+    parser.add_argument("--tps", type=float, default=50.0, help="每秒生成 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--reply-messages", type=int, default=2, help="每次回复的 <message> 条数")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(host=args.host, port=args.port, latency=args.latency,
+                              tokens_per_second=args.tps, error_rate=args.error_rate,
+                              embedding_dim=args.embedding_dim, reply_messages=args.reply_messages)
+    # 第一行输出 base_url，供父进程读取
+    print(server.base_url, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
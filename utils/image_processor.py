@@ -2,6 +2,7 @@
 用于识别和描述图片内容
 """
 
+import httpx
 import requests
 import json
 import logging
@@ -20,6 +21,41 @@ class ImageProcessor:
         self.base_url = base_url
         self.logger = logging.getLogger(__name__)
         
+    def _build_request(self, image_url: str) -> tuple:
+        """构建图片描述请求的 URL、请求体和请求头"""
+        url = f"{self.base_url}/chat/completions"
+        payload = json.dumps({
+            "model": "gpt-4o",
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "用户将会发送给你图片，请用一百字以内来描述图片，尽可能的详细"
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "描述："
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": image_url
+                            }
+                        }
+                    ]
+                }
+            ]
+        })
+
+        headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        return url, payload, headers
+
     def describe_image(self, image_url: str) -> Optional[str]:
         """描述图片内容
         
@@ -31,38 +67,7 @@ class ImageProcessor:
             None: 描述失败时返回None
         """
         try:
-            url = f"{self.base_url}/chat/completions"
-            payload = json.dumps({
-                "model": "gpt-4o",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "用户将会发送给你图片，请用一百字以内来描述图片，尽可能的详细"
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "描述："
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_url
-                                }
-                            }
-                        ]
-                    }
-                ]
-            })
-            
-            headers = {
-                'Accept': 'application/json',
-                'Authorization': f'Bearer {self.api_key}',
-                'Content-Type': 'application/json'
-            }
-
+            url, payload, headers = self._build_request(image_url)
             response = requests.post(url, headers=headers, data=payload, timeout=10)
             response.raise_for_status()
             
@@ -73,6 +78,29 @@ class ImageProcessor:
             self.logger.error(f"图片描述失败: {e}")
             return None
 
+    async def adescribe_image(self, image_url: str) -> Optional[str]:
+        """describe_image 的异步版本
+
+        Args:
+            image_url: 图片URL
+
+        Returns:
+            str: 图片描述文本 (100字以内)
+            None: 描述失败时返回None
+        """
+        try:
+            url, payload, headers = self._build_request(image_url)
+            async with httpx.AsyncClient(timeout=10) as http:
+                response = await http.post(url, headers=headers, content=payload)
+            response.raise_for_status()
+
+            result = response.json()
+            return result.get('choices', [{}])[0].get('message', {}).get('content')
+
+        except Exception as e:
+            self.logger.error(f"图片描述失败: {e}")
+            return None
+
     def save_image(self, image_url: str, save_path: str) -> bool:
         """保存图片到本地
         
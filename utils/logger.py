@@ -20,7 +20,8 @@ logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
+        # 第一次写日志时才创建文件，离线回放等改写日志位置的场景不会在 logs/ 留下空文件
+        logging.FileHandler(LOG_FILE, encoding='utf-8', delay=True),
         logging.StreamHandler()
     ]
 )
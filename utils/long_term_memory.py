@@ -1,31 +1,166 @@
+import asyncio
 import sqlite3
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import numpy as np
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from utils.logger import logger
+from utils.memory_index import MemoryIndex, top_k
+from utils.ann_index import IVFIndex
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_store import EmbeddingFile
+from utils.db import get_connection_manager
+from utils.metrics import STAGE_SECONDS
 import json
+import os
+import re
+import threading
+
+# 嵌入向量以归一化后的 float32 小端字节串存储，余弦相似度即点积
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+# memories_fts 的写入格式版本，变化时在启动时重建全文索引
+FTS_VERSION = "2"
+# 中日文字符逐字切分后写入 FTS5，默认 unicode61 分词器会把连续汉字当成一个词
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_PATTERN = re.compile(f'([{_CJK_CHARS}])')
+_QUERY_TOKEN_PATTERN = re.compile(f'[{_CJK_CHARS}]+|[A-Za-z0-9]+')
+
+
+def segment_for_fts(text: str) -> str:
+    """在每个中日文字符两侧插入空格，供 FTS5 按单字建索引"""
+    return _CJK_PATTERN.sub(r' \1 ', text or '')
+
+
+def build_fts_query(query: str, max_terms: int = 32) -> Optional[str]:
+    """把自然语言查询转换为 FTS5 MATCH 表达式
+
+    中文按相邻两字组成短语（单字查询退化为单字），英文数字按前缀匹配，
+    各项之间取 OR，并只在 content / topic 两列中检索。
+
+    Args:
+        query: 原始查询文本
+        max_terms: 最多保留的检索项数
+
+    Returns:
+        MATCH 表达式，查询中没有可检索内容时返回None
+    """
+    terms = []
+    for token in _QUERY_TOKEN_PATTERN.findall(query):
+        if _CJK_PATTERN.match(token):
+            if len(token) == 1:
+                terms.append(f'"{token}"')
+            else:
+                terms.extend(f'"{a} {b}"' for a, b in zip(token, token[1:]))
+        else:
+            terms.append(f'"{token}"*')
+    terms = list(dict.fromkeys(terms))[:max_terms]
+    if not terms:
+        return None
+    return '{content topic} : (' + ' OR '.join(terms) + ')'
+
+
+def pack_embedding(embedding) -> bytes:
+    """将嵌入向量归一化并打包为 float32 字节串
+
+    Args:
+        embedding: 嵌入向量（列表或 numpy 数组）
+
+    Returns:
+        可直接写入 BLOB 字段的字节串
+    """
+    vec = np.asarray(embedding, dtype=EMBEDDING_DTYPE)
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec = vec / norm
+    return vec.astype(EMBEDDING_DTYPE, copy=False).tobytes()
+
+
+def unpack_embedding(value) -> np.ndarray:
+    """将数据库中的嵌入向量解码为归一化的 float32 数组
+
+    兼容迁移前以 JSON 文本存储的旧数据。
+
+    Args:
+        value: BLOB 字节串或旧版 JSON 字符串
+
+    Returns:
+        归一化后的 float32 数组
+    """
+    if isinstance(value, str):
+        return np.frombuffer(pack_embedding(json.loads(value)), dtype=EMBEDDING_DTYPE)
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPE)
+
 
 class LongTermMemory:
-    def __init__(self, baseurl,db_path: str = "data/memories.db", api_key: str = "000"):
+    def __init__(self, baseurl,db_path: str = "data/memories.db", api_key: str = "000",
+                 embedding_model: str = "text-embedding-3-small",
+                 cache_size: int = 2048, cache_disk_size: int = 100000,
+                 embedding_timeout: float = 3.0,
+                 use_ann: bool = False, ann_min_rows: int = 50000, ann_nprobe: int = 8,
+                 index_dtype: str = "float32", rescore_factor: int = 4,
+                 use_embedding_file: bool = True, embedding_file_readonly: bool = False,
+                 client: Optional[OpenAI] = None,
+                 async_client: Optional[AsyncOpenAI] = None):
         """初始化长期记忆系统
         
         Args:
             db_path: SQLite数据库路径
             api_key: OpenAI API密钥
+            embedding_model: 嵌入模型名
+            cache_size: 进程内嵌入缓存条数
+            cache_disk_size: 持久化嵌入缓存条数
+            embedding_timeout: 混合检索时查询嵌入的超时秒数，超时后退化为纯全文检索
+            use_ann: 是否为不限发送者的全局检索启用 IVF 近似索引
+            ann_min_rows: 记忆数达到该值且尚无持久化索引时自动构建 IVF 索引
+            ann_nprobe: IVF 检索时扫描的桶数，越大召回越高、越慢
+            index_dtype: 常驻索引的存储格式，float32 / float16 / int8；
+                         压缩格式先粗排，再从数据库读取全精度向量重新打分
+            rescore_factor: 压缩格式粗排时多取的候选倍数
+            use_embedding_file: 是否在数据库旁维护内存映射的向量文件（<库名>.emb），
+                                冷启动和重新打分直接从映射读取向量，不再解析整张表
+            embedding_file_readonly: 只读映射向量文件，不截断也不补写，由写入进程（主程序）维护；
+                                     用于离线工具等其他进程，文件增长后读取时自动刷新
+            client: 可选，共用的 OpenAI 客户端，不传则按 baseurl 和 api_key 创建
+            async_client: 可选，共用的 AsyncOpenAI 客户端
         """
         self.db_path = db_path
-        self.client = OpenAI(
+        self.embedding_model = embedding_model
+        self.embedding_timeout = embedding_timeout
+        self.client = client or OpenAI(
+            base_url=baseurl,
+            api_key=api_key
+        )
+        self.async_client = async_client or AsyncOpenAI(
             base_url=baseurl,
             api_key=api_key
         )
+        self.index_dtype = index_dtype
+        self.rescore_factor = rescore_factor
+        self.index = self._new_index()
+        self.use_ann = use_ann
+        self.ann_min_rows = ann_min_rows
+        self.ann_nprobe = ann_nprobe
+        self.ann_base_path = os.path.splitext(db_path)[0]
+        self.ann: Optional[IVFIndex] = None
+        self._index_loaded = False
+        self._index_lock = threading.Lock()
+        self.db = get_connection_manager(db_path)
         self._init_db()
+        self.embedding_file: Optional[EmbeddingFile] = None
+        if use_embedding_file:
+            self._open_embedding_file(self.ann_base_path + ".emb", readonly=embedding_file_readonly)
+        self.embedding_cache = EmbeddingCache(db_path, max_memory_items=cache_size,
+                                              max_disk_items=cache_disk_size)
 
     def _init_db(self):
         """初始化数据库表结构"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        with self.db.writer() as conn:
+            self._create_schema(conn.cursor())
+            self._sync_fts(conn)
+
+    def _create_schema(self, cursor: sqlite3.Cursor):
+        """创建记忆相关的表和索引"""
         # 创建记忆表，新增 'topic' 字段
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS memories (
@@ -43,25 +178,156 @@ class LongTermMemory:
         CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts 
         USING fts5(sender, content, topic) -- FTS也更新为索引topic
         ''')
-        
-        conn.commit()
-        conn.close()
 
-    def _get_embedding(self, text: str) -> List[float]:
-        """获取文本的嵌入向量
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS memory_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        ''')
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_memories_sender ON memories(sender)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_memories_created_at ON memories(created_at)')
+
+    def _sync_fts(self, conn: sqlite3.Connection):
+        """全文索引格式过期时，以 memories.id 为 rowid 重建 memories_fts（调用方持有写连接）"""
+        row = conn.execute("SELECT value FROM memory_meta WHERE key = 'fts_version'").fetchone()
+        if row and row[0] == FTS_VERSION:
+            return
+        conn.create_function('fts_segment', 1, segment_for_fts)
+        conn.execute('DELETE FROM memories_fts')
+        conn.execute('''
+        INSERT INTO memories_fts (rowid, sender, content, topic)
+        SELECT id, sender, fts_segment(content), fts_segment(topic) FROM memories
+        ''')
+        conn.execute("INSERT OR REPLACE INTO memory_meta (key, value) VALUES ('fts_version', ?)", (FTS_VERSION,))
+        logger.info("Rebuilt memories_fts (version %s)", FTS_VERSION)
+
+    def _open_embedding_file(self, path: str, readonly: bool = False):
+        """打开向量文件并与数据库对齐：回退数据库中不存在的尾部，补写缺失的新记忆；
+        只读打开时不做对齐，文件中缺失的行读取时回退到数据库"""
+        try:
+            self.embedding_file = EmbeddingFile(path, readonly=readonly)
+            if readonly:
+                return
+            with self.db.reader() as conn:
+                max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM memories').fetchone()[0]
+            if self.embedding_file.high_water > max_id:
+                logger.warning("Embedding file ahead of database (%d > %d), truncating",
+                               self.embedding_file.high_water, max_id)
+                self.embedding_file.truncate(max_id)
+
+            last_id = self.embedding_file.high_water
+            backfilled = 0
+            while last_id < max_id:
+                with self.db.reader() as conn:
+                    rows = conn.execute(
+                        'SELECT id, embedding FROM memories WHERE id > ? ORDER BY id LIMIT 1000',
+                        (last_id,)).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                vectors = [unpack_embedding(embedding) for _, embedding in rows]
+                dim = self.embedding_file.dim or len(vectors[-1])
+                valid = [(row[0], v) for row, v in zip(rows, vectors) if len(v) == dim]
+                if valid:
+                    self.embedding_file.write([memory_id for memory_id, _ in valid],
+                                              np.vstack([v for _, v in valid]))
+                    backfilled += len(valid)
+            if backfilled:
+                logger.info(f"Backfilled {backfilled} vectors into {path}")
+        except Exception as e:
+            logger.error(f"Failed to open embedding file, reading vectors from database: {str(e)}")
+            self.embedding_file = None
+
+    def _get_embedding(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """获取文本的嵌入向量，优先读取嵌入缓存
         
         Args:
             text: 要嵌入的文本
+            timeout: 可选，请求超时秒数（设置后不重试）
             
         Returns:
-            嵌入向量列表
+            归一化后的 float32 嵌入向量
         """
-        print(f"[DEBUG] _get_embedding called: text={text}")
-        response = self.client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        cached = self.embedding_cache.get(self.embedding_model, text)
+        if cached is not None:
+            return unpack_embedding(cached)
+
+        logger.debug("Requesting embedding: text='%s'", text)
+        client = self.client
+        if timeout is not None:
+            client = client.with_options(timeout=timeout, max_retries=0)
+        with STAGE_SECONDS.labels("embedding").time():
+            response = client.embeddings.create(
+                input=text,
+                model=self.embedding_model
+            )
+        blob = pack_embedding(response.data[0].embedding)
+        self.embedding_cache.put(self.embedding_model, text, blob)
+        return unpack_embedding(blob)
+
+    async def aget_embedding(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """_get_embedding 的异步版本，使用 AsyncOpenAI 请求嵌入接口
+
+        Args:
+            text: 要嵌入的文本
+            timeout: 可选，请求超时秒数（设置后不重试）
+
+        Returns:
+            归一化后的 float32 嵌入向量
+        """
+        # 缓存读写会访问 SQLite（命中时更新 last_used 并提交），放到线程中执行，不阻塞共用的事件循环
+        cached = await asyncio.to_thread(self.embedding_cache.get, self.embedding_model, text)
+        if cached is not None:
+            return unpack_embedding(cached)
+
+        client = self.async_client
+        if timeout is not None:
+            client = client.with_options(timeout=timeout, max_retries=0)
+        with STAGE_SECONDS.labels("embedding").time():
+            response = await client.embeddings.create(
+                input=text,
+                model=self.embedding_model
+            )
+        blob = pack_embedding(response.data[0].embedding)
+        await asyncio.to_thread(self.embedding_cache.put, self.embedding_model, text, blob)
+        return unpack_embedding(blob)
+
+    def _get_embeddings(self, texts: List[str]) -> List[np.ndarray]:
+        """批量获取嵌入向量，未命中缓存的文本合并为一次接口请求
+
+        Args:
+            texts: 要嵌入的文本列表
+
+        Returns:
+            与 texts 顺序一致的归一化 float32 向量列表
+        """
+        results: List[Optional[np.ndarray]] = []
+        missing: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            cached = self.embedding_cache.get(self.embedding_model, text)
+            if cached is not None:
+                results.append(unpack_embedding(cached))
+            else:
+                results.append(None)
+                missing.setdefault(text, []).append(i)
+
+        if missing:
+            inputs = list(missing)
+            logger.debug("Requesting embeddings for %d texts", len(inputs))
+            with STAGE_SECONDS.labels("embedding_batch").time():
+                response = self.client.embeddings.create(
+                    input=inputs,
+                    model=self.embedding_model
+                )
+            for item in response.data:
+                text = inputs[item.index]
+                blob = pack_embedding(item.embedding)
+                self.embedding_cache.put(self.embedding_model, text, blob)
+                for i in missing[text]:
+                    results[i] = unpack_embedding(blob)
+        return results
 
     def add_memory(self, sender: str, topic: str, summary: str):
         """添加长期记忆
@@ -71,32 +337,199 @@ class LongTermMemory:
             topic: 记忆的主题
             summary: 记忆的摘要内容 (用于嵌入和检索)
         """
+        self.add_memories([(sender, topic, summary)])
+
+    def add_memories(self, items: List[Tuple[str, str, str]]) -> List[int]:
+        """批量添加长期记忆：一次嵌入请求，一个事务写入
+
+        Args:
+            items: [(发送者, 主题, 摘要)]
+
+        Returns:
+            新记忆的ID列表
+        """
+        if not items:
+            return []
         try:
-            logger.info("Adding memory from %s (Topic: %.30s): %.50s...", sender, str(topic), str(summary))
-            embedding = self._get_embedding(summary)
-            embedding_str = json.dumps(embedding)
-            
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-            INSERT INTO memories (sender, content, topic, embedding)
-            VALUES (?, ?, ?, ?)
-            ''', (sender, summary, topic, embedding_str))
+            for sender, topic, summary in items:
+                logger.info("Adding memory from %s (Topic: %.30s): %.50s...", sender, str(topic), str(summary))
+            embeddings = self._get_embeddings([summary for _, _, summary in items])
             
-            cursor.execute('''
-            INSERT INTO memories_fts (sender, content, topic)
-            VALUES (?, ?, ?)
-            ''', (sender, summary, topic))
-            
-            conn.commit()
-            conn.close()
-            logger.info(f"Memory added successfully for {sender} (Topic: {topic})")
+            memory_ids = []
+            with self.db.writer() as conn:
+                cursor = conn.cursor()
+                for (sender, topic, summary), embedding in zip(items, embeddings):
+                    cursor.execute('''
+                    INSERT INTO memories (sender, content, topic, embedding)
+                    VALUES (?, ?, ?, ?)
+                    ''', (sender, summary, topic, pack_embedding(embedding)))
+                    memory_id = cursor.lastrowid
+                    memory_ids.append(memory_id)
+
+                    cursor.execute('''
+                    INSERT INTO memories_fts (rowid, sender, content, topic)
+                    VALUES (?, ?, ?, ?)
+                    ''', (memory_id, sender, segment_for_fts(summary), segment_for_fts(topic)))
+
+            self._write_embedding_file(memory_ids, embeddings)
+            with self._index_lock:
+                if self._index_loaded:
+                    self.index.add_many(
+                        (memory_id, sender, embedding)
+                        for memory_id, (sender, _, _), embedding in zip(memory_ids, items, embeddings)
+                    )
+                    if self.ann is not None:
+                        self.ann.add(np.asarray(memory_ids, dtype=np.int64), np.vstack(embeddings))
+            logger.info(f"{len(memory_ids)} memories added successfully")
+            return memory_ids
         except Exception as e:
             logger.error(f"Failed to add memory: {str(e)}")
             raise
 
-    def search_memories(self, query: str, sender: Optional[str] = None, limit: int = 5) -> List[Dict]:
+    def _write_embedding_file(self, memory_ids: List[int], embeddings: List[np.ndarray]):
+        """数据库提交后写入向量文件；失败只记录日志，下次启动时从数据库补写"""
+        if self.embedding_file is None or self.embedding_file.readonly:
+            return
+        try:
+            self.embedding_file.write(memory_ids, np.vstack(embeddings))
+        except Exception as e:
+            logger.error(f"Failed to write embedding file: {str(e)}")
+
+    def _ensure_index(self):
+        """首次使用时从数据库加载常驻向量索引"""
+        if self._index_loaded:
+            return
+        with self._index_lock:
+            if self._index_loaded:
+                return
+            self._load_index()
+
+    def reload_index(self):
+        """丢弃并重新加载常驻索引（批量删除或改写记忆后使用），未加载过则不做任何事"""
+        with self._index_lock:
+            if self._index_loaded:
+                self._load_index()
+
+    def _new_index(self) -> MemoryIndex:
+        return MemoryIndex(dtype=self.index_dtype, rescore_factor=self.rescore_factor,
+                           loader=self._load_full_vectors)
+
+    def _load_full_vectors(self, memory_ids: List[int]) -> np.ndarray:
+        """读取全精度向量，用于压缩索引的重新打分；有向量文件时直接从映射读取
+
+        Returns:
+            与 memory_ids 顺序一致的 float32 矩阵；已删除的记忆为零向量
+        """
+        if self.embedding_file is not None and self.embedding_file.dim == self.index.dim:
+            matrix = self.embedding_file.get(memory_ids)
+            # 全零行可能是写入向量文件失败或尚未补写的记忆，回退到数据库，避免重新打分时得分为0
+            missing = np.flatnonzero(~np.any(matrix != 0, axis=1))
+        else:
+            matrix = np.zeros((len(memory_ids), self.index.dim), dtype=np.float32)
+            missing = np.arange(len(memory_ids))
+        if len(missing) == 0:
+            return matrix
+        missing_ids = [memory_ids[i] for i in missing]
+        placeholders = ",".join("?" * len(missing_ids))
+        with self.db.reader() as conn:
+            rows = dict(conn.execute(
+                f'SELECT id, embedding FROM memories WHERE id IN ({placeholders})', missing_ids))
+        for i, memory_id in zip(missing, missing_ids):
+            if memory_id in rows:
+                vector = unpack_embedding(rows[memory_id])
+                if len(vector) == matrix.shape[1]:
+                    matrix[i] = vector
+        return matrix
+
+    def _load_index(self):
+        """从数据库构建新的常驻索引并替换旧索引（调用方持有 _index_lock）"""
+        index = self._new_index()
+        if self.embedding_file is not None:
+            self._load_index_from_file(index)
+        else:
+            with self.db.reader() as conn:
+                cursor = conn.execute('SELECT id, sender, embedding FROM memories')
+                index.add_many(
+                    (row_id, sender, unpack_embedding(embedding))
+                    for row_id, sender, embedding in cursor
+                )
+        self.index = index
+        logger.info("Memory index loaded: %d vectors, %s, %.1f MB",
+                    len(self.index), self.index_dtype, self.index.nbytes / 1024 / 1024)
+        if self.use_ann:
+            self._load_ann()
+        self._index_loaded = True
+
+    def _load_index_from_file(self, index: MemoryIndex):
+        """只从数据库读取 ID 和发送者，向量取自内存映射；文件中缺失的行回退到数据库"""
+        with self.db.reader() as conn:
+            rows = conn.execute('SELECT id, sender FROM memories ORDER BY id').fetchall()
+        if not rows:
+            return
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        vectors = self.embedding_file.get(ids)
+        present = np.any(vectors != 0, axis=1)
+        index.add_many(
+            (row[0], row[1], vectors[i])
+            for i, row in enumerate(rows) if present[i]
+        )
+
+        missing = [row[0] for i, row in enumerate(rows) if not present[i]]
+        if missing:
+            placeholders = ",".join("?" * len(missing))
+            with self.db.reader() as conn:
+                cursor = conn.execute(
+                    f'SELECT id, sender, embedding FROM memories WHERE id IN ({placeholders})', missing)
+                index.add_many(
+                    (row_id, sender, unpack_embedding(embedding))
+                    for row_id, sender, embedding in cursor
+                )
+
+    def _load_ann(self):
+        """加载持久化的 IVF 索引；不存在且记忆数足够多时自动构建"""
+        ids, vectors = self.index.global_snapshot()
+        try:
+            self.ann = IVFIndex.open(self.ann_base_path, ids, vectors, nprobe=self.ann_nprobe,
+                                     dtype=self.index_dtype)
+            if self.ann is None and len(ids) >= self.ann_min_rows:
+                self.ann = IVFIndex.build(self.ann_base_path, ids, vectors, nprobe=self.ann_nprobe,
+                                          dtype=self.index_dtype)
+            if self.ann is not None:
+                logger.info("IVF index: %s, %.1f MB", self.index_dtype, self.ann.nbytes / 1024 / 1024)
+        except Exception as e:
+            logger.error(f"Failed to load IVF index, using exact search: {str(e)}")
+            self.ann = None
+
+    def rebuild_ann(self, nlist: Optional[int] = None):
+        """重新训练并持久化 IVF 索引（记忆分布明显变化后使用）"""
+        self._ensure_index()
+        ids, vectors = self.index.global_snapshot()
+        if len(ids) == 0:
+            return
+        self.ann = IVFIndex.build(self.ann_base_path, ids, vectors, nlist=nlist, nprobe=self.ann_nprobe,
+                                  dtype=self.index_dtype)
+
+    def _vector_search(self, query_embedding: np.ndarray, limit: int, sender: Optional[str],
+                       min_similarity: float = 0.0) -> List[tuple]:
+        """向量检索：全局检索且启用 IVF 时走近似索引，其余走精确索引"""
+        self._ensure_index()
+        if sender is None and self.ann is not None:
+            if self.index_dtype == "float32":
+                return self.ann.search(query_embedding, limit, min_similarity)
+            # IVF 桶与常驻索引同为压缩格式，同样多取候选再用全精度向量重新打分
+            candidates = self.ann.search(query_embedding, limit * self.rescore_factor,
+                                         max(0.0, min_similarity - 0.05))
+            if not candidates:
+                return []
+            candidate_ids = np.asarray([memory_id for memory_id, _ in candidates], dtype=np.int64)
+            ids, scores = top_k(candidate_ids, self._load_full_vectors(candidate_ids.tolist()),
+                                query_embedding, limit, min_similarity)
+            return list(zip(ids.tolist(), scores.tolist()))
+        return self.index.search(query_embedding, limit, sender=sender, min_similarity=min_similarity)
+
+    def search_memories(self, query: str, sender: Optional[str] = None, limit: int = 5,
+                        min_similarity: float = 0.0, mode: str = "vector",
+                        query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         搜索相关记忆
 
@@ -104,71 +537,260 @@ class LongTermMemory:
             query: 搜索查询
             sender: 可选，限制特定发送者
             limit: 返回结果数量
+            min_similarity: 相似度下限，低于该值的记忆不返回（纯全文检索时不适用）
+            mode: 检索模式
+                - "vector": 全量向量检索
+                - "hybrid": FTS5 BM25 预筛选候选，与向量得分做倒数排名融合；
+                            嵌入接口超时或出错时退化为纯全文检索，
+                            但设置了 min_similarity 时无法保证相似度下限，直接返回空列表
+                - "lexical": 纯全文检索，不请求嵌入接口
+            query_embedding: 可选，已算好的查询嵌入，提供时不再请求嵌入接口
 
         Returns:
             记忆列表，按相关性排序
         """
-        print(f"[DEBUG] search_memories called: query={query}, sender={sender}, limit={limit}")
-        logger.info("Searching memories: query='%s', sender='%s', limit=%d", query, sender, limit)
-        query_embedding = self._get_embedding(query)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        logger.info("Searching memories: query='%s', sender='%s', limit=%d, mode=%s", query, sender, limit, mode)
+        if mode == "vector":
+            if query_embedding is None:
+                query_embedding = self._get_embedding(query)
+            hits = self._vector_search(query_embedding, limit, sender, min_similarity)
+        elif mode == "hybrid":
+            hits = self._hybrid_search(query, sender, limit, min_similarity, query_embedding=query_embedding)
+        elif mode == "lexical":
+            hits = [(memory_id, None) for memory_id, _ in self._lexical_search(query, sender, limit)]
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+        results = self._fetch_memories(hits)
+        logger.info("Memory search returned %d results. Top topics: %s", len(results), [r['topic'] for r in results])
+        logger.info("Embedding cache stats: %s", self.embedding_cache.stats())
+        return results
+
+    async def asearch_memories(self, query: str, sender: Optional[str] = None, limit: int = 5,
+                               min_similarity: float = 0.0, mode: str = "vector") -> List[Dict]:
+        """search_memories 的异步版本：查询嵌入走异步接口，数据库与索引检索放到线程池
+
+        参数与返回值同 search_memories
+        """
+        query_embedding = None
+        if mode == "vector":
+            query_embedding = await self.aget_embedding(query)
+        elif mode == "hybrid":
+            try:
+                query_embedding = await self.aget_embedding(query, timeout=self.embedding_timeout)
+            except Exception as e:
+                if min_similarity > 0:
+                    # 全文检索没有相似度，无法保证下限，不把无关记忆交给调用方
+                    logger.warning(f"Embedding unavailable, skipping search with min_similarity: {str(e)}")
+                    return []
+                logger.warning(f"Embedding unavailable, falling back to lexical search: {str(e)}")
+                mode = "lexical"
+        return await asyncio.to_thread(self.search_memories, query, sender, limit, min_similarity,
+                                       mode, query_embedding)
+
+    def _lexical_search(self, query: str, sender: Optional[str], limit: int) -> List[tuple]:
+        """用 FTS5 BM25 检索记忆
+
+        Returns:
+            [(记忆ID, bm25得分)]，得分越小越相关
+        """
+        match = build_fts_query(query)
+        if match is None:
+            return []
+        try:
+            with self.db.reader() as conn:
+                return self._run_lexical_query(conn, match, sender, limit)
+        except sqlite3.OperationalError as e:
+            logger.error(f"Full-text search failed: {str(e)}")
+            return []
+
+    def _run_lexical_query(self, conn: sqlite3.Connection, match: str, sender: Optional[str],
+                           limit: int) -> List[tuple]:
         if sender:
-            cursor.execute('''
-            SELECT id, sender, content, topic, embedding, created_at
-            FROM memories
-            WHERE sender = ?
-            ''', (sender,))
+            cursor = conn.execute('''
+            SELECT f.rowid, bm25(memories_fts) AS score
+            FROM memories_fts f JOIN memories m ON m.id = f.rowid
+            WHERE memories_fts MATCH ? AND m.sender = ?
+            ORDER BY score
+            LIMIT ?
+            ''', (match, sender, limit))
         else:
-            cursor.execute('''
-            SELECT id, sender, content, topic, embedding, created_at
-            FROM memories
-            ''')
-            
-        results = []
-        for row in cursor.fetchall():
+            cursor = conn.execute('''
+            SELECT rowid, bm25(memories_fts) AS score
+            FROM memories_fts
+            WHERE memories_fts MATCH ?
+            ORDER BY score
+            LIMIT ?
+            ''', (match, limit))
+        return cursor.fetchall()
+
+    def _hybrid_search(self, query: str, sender: Optional[str], limit: int,
+                       min_similarity: float, candidate_limit: int = 50, rrf_k: int = 60,
+                       query_embedding: Optional[np.ndarray] = None) -> List[tuple]:
+        """FTS5 预筛选 + 向量得分的倒数排名融合（RRF）
+
+        全文候选和全量向量检索的候选都参与融合：没有共同词语但语义相近的记忆也能召回，
+        常驻索引上的全量扫描开销很小。
+
+        Returns:
+            [(记忆ID, 相似度或None)]，按融合得分排序
+        """
+        candidate_limit = max(candidate_limit, limit)
+        lexical = self._lexical_search(query, sender, candidate_limit)
+        if query_embedding is None:
             try:
-                similarity = self._cosine_similarity(row[4], query_embedding)
-                results.append({
-                    "id": row[0],
-                    "sender": row[1],
-                    "content": row[2],
-                    "topic": row[3],
-                    "created_at": row[5],
-                    "similarity": similarity
-                })
+                query_embedding = self._get_embedding(query, timeout=self.embedding_timeout)
             except Exception as e:
-                logger.error(f"Error calculating similarity: {str(e)}")
+                if min_similarity > 0:
+                    logger.warning(f"Embedding unavailable, skipping search with min_similarity: {str(e)}")
+                    return []
+                logger.warning(f"Embedding unavailable, falling back to lexical search: {str(e)}")
+                return [(memory_id, None) for memory_id, _ in lexical[:limit]]
+
+        self._ensure_index()
+        lexical_ids = [memory_id for memory_id, _ in lexical]
+        vector_scores = self.index.score(query_embedding, lexical_ids)
+        vector_scores.update(dict(self._vector_search(query_embedding, candidate_limit, sender)))
+        vector_ranked = sorted(
+            (item for item in vector_scores.items() if item[1] >= min_similarity),
+            key=lambda item: item[1], reverse=True
+        )
+
+        fused: Dict[int, float] = {}
+        for rank, memory_id in enumerate(lexical_ids):
+            fused[memory_id] = fused.get(memory_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        for rank, (memory_id, _) in enumerate(vector_ranked):
+            fused[memory_id] = fused.get(memory_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+        if min_similarity > 0:
+            # 向量得分低于下限的候选即便全文命中也不返回
+            fused = {memory_id: score for memory_id, score in fused.items()
+                     if vector_scores.get(memory_id, 0.0) >= min_similarity}
+
+        ranked = sorted(fused, key=fused.get, reverse=True)[:limit]
+        return [(memory_id, vector_scores.get(memory_id)) for memory_id in ranked]
+
+    def _fetch_memories(self, hits: List[tuple]) -> List[Dict]:
+        """按检索结果顺序读取记忆内容
+
+        Args:
+            hits: [(记忆ID, 相似度)]，纯全文检索的结果相似度为None
+
+        Returns:
+            记忆字典列表，顺序与 hits 一致
+        """
+        if not hits:
+            return []
+        placeholders = ",".join("?" * len(hits))
+        with self.db.reader() as conn:
+            cursor = conn.execute(f'''
+            SELECT id, sender, content, topic, created_at
+            FROM memories
+            WHERE id IN ({placeholders})
+            ''', [memory_id for memory_id, _ in hits])
+            rows = {row[0]: row for row in cursor.fetchall()}
+
+        results = []
+        for memory_id, similarity in hits:
+            row = rows.get(memory_id)
+            if row is None:
                 continue
-                
-        results.sort(key=lambda x: x["similarity"], reverse=True)
-        conn.close()
-        logger.info("Memory search returned %d results. Top topics: %s", len(results[:limit]), [r['topic'] for r in results[:limit]])
-        return results[:limit]
-
-    def _cosine_similarity(self, vec1_str: str, vec2: List[float]) -> float:
-        """计算两个向量的余弦相似度
-        
+            results.append({
+                "id": row[0],
+                "sender": row[1],
+                "content": row[2],
+                "topic": row[3],
+                "created_at": row[4],
+                "similarity": None if similarity is None else max(0.0, min(1.0, similarity))
+            })
+        return results
+
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """读取 memory_meta 中的值"""
+        with self.db.reader() as conn:
+            row = conn.execute('SELECT value FROM memory_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value) -> None:
+        """写入 memory_meta 中的值"""
+        with self.db.writer() as conn:
+            conn.execute('INSERT OR REPLACE INTO memory_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def merge_memories(self, keep_id: int, remove_ids: List[int],
+                       topic: Optional[str] = None, summary: Optional[str] = None):
+        """把若干记忆合并到 keep_id：删除 remove_ids，并可改写保留行的主题和摘要
+
+        memories 与 memories_fts 在同一个事务中更新。常驻索引不会自动更新，
+        批量合并完成后调用 reload_index()。
+
         Args:
-            vec1_str: 数据库中的向量JSON字符串
-            vec2: 查询向量列表
-            
+            keep_id: 保留的记忆ID
+            remove_ids: 要删除的记忆ID
+            topic: 可选，新的主题
+            summary: 可选，新的摘要（会重新计算嵌入）
+        """
+        embedding_blob = pack_embedding(self._get_embeddings([summary])[0]) if summary else None
+        with self.db.writer() as conn:
+            if summary or topic:
+                row = conn.execute('SELECT sender, content, topic FROM memories WHERE id = ?', (keep_id,)).fetchone()
+                if row is None:
+                    raise ValueError(f"Memory {keep_id} does not exist")
+                sender, old_summary, old_topic = row
+                new_summary, new_topic = summary or old_summary, topic or old_topic
+                if embedding_blob is not None:
+                    conn.execute('UPDATE memories SET content = ?, topic = ?, embedding = ? WHERE id = ?',
+                                 (new_summary, new_topic, embedding_blob, keep_id))
+                else:
+                    conn.execute('UPDATE memories SET content = ?, topic = ? WHERE id = ?',
+                                 (new_summary, new_topic, keep_id))
+                conn.execute('UPDATE memories_fts SET content = ?, topic = ? WHERE rowid = ?',
+                             (segment_for_fts(new_summary), segment_for_fts(new_topic), keep_id))
+            if remove_ids:
+                placeholders = ",".join("?" * len(remove_ids))
+                conn.execute(f'DELETE FROM memories WHERE id IN ({placeholders})', remove_ids)
+                conn.execute(f'DELETE FROM memories_fts WHERE rowid IN ({placeholders})', remove_ids)
+
+        if self.embedding_file is not None and self.embedding_file.dim:
+            ids = ([keep_id] if embedding_blob is not None else []) + list(remove_ids)
+            vectors = np.zeros((len(ids), self.embedding_file.dim), dtype=np.float32)
+            if embedding_blob is not None:
+                vectors[0] = unpack_embedding(embedding_blob)
+            self._write_embedding_file(ids, list(vectors))
+
+    def migrate_embeddings(self, batch_size: int = 500) -> int:
+        """将旧版 JSON 文本嵌入原地迁移为归一化 float32 BLOB
+
+        每批独立提交，中断后重新执行会从剩余的 JSON 行继续。
+
+        Args:
+            batch_size: 每批迁移的行数
+
         Returns:
-            余弦相似度
+            本次迁移的行数
         """
-        vec1 = np.array(json.loads(vec1_str), dtype=np.float32)
-        vec2 = np.array(vec2, dtype=np.float32)
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
-        
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-            
-        similarity = dot_product / (norm1 * norm2)
-        return max(0.0, min(1.0, similarity))
+        migrated = 0
+        while True:
+            with self.db.writer() as conn:
+                rows = conn.execute('''
+                SELECT id, embedding FROM memories
+                WHERE typeof(embedding) = 'text'
+                ORDER BY id
+                LIMIT ?
+                ''', (batch_size,)).fetchall()
+                if not rows:
+                    break
+
+                updates = []
+                for row_id, embedding_str in rows:
+                    try:
+                        updates.append((pack_embedding(json.loads(embedding_str)), row_id))
+                    except (json.JSONDecodeError, TypeError, ValueError) as e:
+                        logger.error(f"Memory {row_id} has an unreadable embedding, skipped: {str(e)}")
+                        # 写入空向量，避免下次迁移反复命中同一坏行
+                        updates.append((b'', row_id))
+
+                conn.executemany('UPDATE memories SET embedding = ? WHERE id = ?', updates)
+            migrated += len(updates)
+            logger.info(f"Migrated {migrated} embeddings to float32 BLOB")
+        return migrated
 
     def extract_memory_tags(self, text: str) -> List[str]:
         """从文本中提取<memory>标签内容
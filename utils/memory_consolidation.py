@@ -0,0 +1,150 @@
+"""长期记忆整理模块
+按发送者把嵌入高度相似的记忆聚成簇并合并为一条，可选用大模型重新总结；
+只处理上次整理之后新增的记忆，控制表大小和检索开销
+
+命令行：
+    python -m utils.memory_consolidation [--db data/memories.db] [--threshold 0.92]
+"""
+
+import argparse
+import json
+from typing import Dict, List
+
+import numpy as np
+
+from utils.logger import logger
+from utils.long_term_memory import LongTermMemory, unpack_embedding
+
+WATERMARK_KEY = "consolidation_last_id"
+
+
+class MemoryConsolidator:
+    def __init__(self, long_term_memory: LongTermMemory, threshold: float = 0.92,
+                 client=None, model: str = "deepseek-chat"):
+        """初始化记忆整理器
+
+        Args:
+            long_term_memory: LongTermMemory 实例
+            threshold: 两条记忆的余弦相似度达到该值即视为重复
+            client: 可选，OpenAI 客户端；提供时用大模型重新总结合并后的记忆，
+                    否则保留簇中最新的一条
+            model: 重新总结使用的模型名
+        """
+        self.memory = long_term_memory
+        self.threshold = threshold
+        self.client = client
+        self.model = model
+
+    def run(self) -> Dict:
+        """整理自上次运行以来有新增记忆的发送者
+
+        Returns:
+            dict: 本次整理的统计信息
+        """
+        last_id = int(self.memory.get_meta(WATERMARK_KEY, "0"))
+        with self.memory.db.reader() as conn:
+            max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM memories').fetchone()[0]
+            senders = [row[0] for row in conn.execute(
+                'SELECT DISTINCT sender FROM memories WHERE id > ?', (last_id,))]
+
+        stats = {"senders": len(senders), "clusters": 0, "removed": 0}
+        for sender in senders:
+            try:
+                clusters, removed = self._consolidate_sender(sender, last_id)
+                stats["clusters"] += clusters
+                stats["removed"] += removed
+            except Exception as e:
+                logger.error(f"整理 {sender} 的长期记忆失败: {str(e)}")
+
+        self.memory.set_meta(WATERMARK_KEY, max_id)
+        if stats["removed"]:
+            self.memory.reload_index()
+        logger.info(f"长期记忆整理完成: {stats}")
+        return stats
+
+    def _consolidate_sender(self, sender: str, last_id: int) -> tuple:
+        with self.memory.db.reader() as conn:
+            rows = conn.execute('''
+            SELECT id, content, topic, embedding FROM memories
+            WHERE sender = ?
+            ORDER BY id
+            ''', (sender,)).fetchall()
+        vectors = [unpack_embedding(row[3]) for row in rows]
+        dim = max((len(v) for v in vectors), default=0)
+        rows = [row for row, v in zip(rows, vectors) if len(v) == dim]
+        if len(rows) < 2:
+            return 0, 0
+        matrix = np.vstack([v for v in vectors if len(v) == dim])
+
+        # 领袖聚类：按ID顺序处理新记忆，挂到最相似且已存在的簇上
+        leader = list(range(len(rows)))
+        new_rows = [i for i, row in enumerate(rows) if row[0] > last_id]
+        similarities = matrix[new_rows] @ matrix.T
+        for n, i in enumerate(new_rows):
+            scores = similarities[n].copy()
+            scores[i:] = -1.0  # 只与更早的记忆比较
+            j = int(np.argmax(scores))
+            if scores[j] >= self.threshold:
+                leader[i] = self._find(leader, j)
+
+        clusters: Dict[int, List[int]] = {}
+        for i in range(len(rows)):
+            clusters.setdefault(self._find(leader, i), []).append(i)
+
+        merged = removed = 0
+        for members in clusters.values():
+            if len(members) < 2:
+                continue
+            member_rows = [rows[i] for i in members]
+            keep = member_rows[-1]
+            topic, summary = self._resummarize(member_rows)
+            remove_ids = [row[0] for row in member_rows[:-1]]
+            self.memory.merge_memories(keep[0], remove_ids, topic=topic, summary=summary)
+            logger.info(f"合并 {sender} 的 {len(member_rows)} 条相似记忆 -> {keep[0]} ({keep[2]})")
+            merged += 1
+            removed += len(remove_ids)
+        return merged, removed
+
+    @staticmethod
+    def _find(leader: List[int], i: int) -> int:
+        while leader[i] != i:
+            leader[i] = leader[leader[i]]
+            i = leader[i]
+        return i
+
+    def _resummarize(self, member_rows: List[tuple]) -> tuple:
+        """用大模型把一簇记忆总结为一条，未配置或失败时返回 (None, None) 保留最新一条"""
+        if self.client is None:
+            return None, None
+        items = "\n".join(f"- 主题：{row[2]}；摘要：{row[1]}" for row in member_rows)
+        prompt = (
+            "以下是关于同一个人的几条相似记忆，请合并成一条，不要遗漏细节，以较新的信息为准。\n"
+            f"{items}\n"
+            '请严格输出JSON：{"topic": "何时使用这条记忆", "summary": "合并后的摘要"}'
+        )
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                response_format={"type": "json_object"},
+                max_tokens=300
+            )
+            merged = json.loads(response.choices[0].message.content)
+            return merged.get("topic") or None, merged.get("summary") or None
+        except Exception as e:
+            logger.error(f"重新总结记忆失败，保留最新一条: {str(e)}")
+            return None, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并重复的长期记忆")
+    parser.add_argument("--db", default="data/memories.db")
+    parser.add_argument("--threshold", type=float, default=0.92)
+    args = parser.parse_args()
+    memory = LongTermMemory(baseurl=None, db_path=args.db)
+    print(MemoryConsolidator(memory, threshold=args.threshold).run())
+
+
+if __name__ == "__main__":
+    main()
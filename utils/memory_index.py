@@ -0,0 +1,368 @@
+"""长期记忆向量索引模块
+在内存中常驻嵌入矩阵（每个发送者一份，外加一份全局矩阵），
+检索时只做一次矩阵乘法和 argpartition 取 top-k
+
+矩阵可以用 float32、float16 或逐向量缩放的 int8 存储：压缩格式先粗排，
+再用全精度向量对前若干候选重新打分
+
+命令行：
+    python -m utils.memory_index benchmark [--db data/memories.db | --synthetic N --dim D]
+"""
+
+import argparse
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+STORAGE_DTYPES = ("float32", "float16", "int8")
+# 压缩格式分块反量化的行数，控制临时内存
+_SCORE_CHUNK = 8192
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """把 float32 向量转换为存储格式
+
+    Returns:
+        (存储矩阵, 每行缩放系数)；只有 int8 有缩放系数
+    """
+    if dtype == "float32":
+        return vectors.astype(np.float32, copy=False), None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    """把存储格式还原为 float32"""
+    restored = vectors.astype(np.float32)
+    if scales is not None:
+        restored *= scales[:, None]
+    return restored
+
+
+def score_vectors(vectors: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """计算矩阵每行与查询向量的点积，压缩格式分块反量化"""
+    if vectors.dtype == np.float32:
+        return vectors @ query
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), _SCORE_CHUNK):
+        block = vectors[start:start + _SCORE_CHUNK].astype(np.float32) @ query
+        if scales is not None:
+            block *= scales[start:start + _SCORE_CHUNK]
+        scores[start:start + _SCORE_CHUNK] = block
+    return scores
+
+
+class EmbeddingMatrix:
+    """可追加的连续嵌入矩阵，容量按倍数增长"""
+
+    def __init__(self, dim: int, capacity: int = 64, dtype: str = "float32"):
+        """
+        Args:
+            dim: 向量维度
+            capacity: 初始容量（行数）
+            dtype: 存储格式，float32 / float16 / int8
+        """
+        self.dim = dim
+        self.dtype = dtype
+        self.size = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.vectors = np.empty((capacity, dim), dtype=np.dtype(dtype))
+        self.scales = np.empty(capacity, dtype=np.float32) if dtype == "int8" else None
+
+    @property
+    def nbytes(self) -> int:
+        """已填充部分占用的字节数"""
+        per_row = self.vectors.itemsize * self.dim + (4 if self.scales is not None else 0)
+        return self.size * per_row
+
+    def _reserve(self, needed: int):
+        """确保至少能容纳 needed 行"""
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        ids = np.empty(capacity, dtype=np.int64)
+        vectors = np.empty((capacity, self.dim), dtype=self.vectors.dtype)
+        ids[:self.size] = self.ids[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        if self.scales is not None:
+            scales = np.empty(capacity, dtype=np.float32)
+            scales[:self.size] = self.scales[:self.size]
+            self.scales = scales
+        self.ids, self.vectors = ids, vectors
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray):
+        """追加若干行
+
+        Args:
+            ids: 记忆ID数组
+            vectors: 已归一化的 float32 向量矩阵，形状 (n, dim)
+        """
+        n = len(ids)
+        data, scales = quantize(vectors, self.dtype)
+        self._reserve(self.size + n)
+        self.ids[self.size:self.size + n] = ids
+        self.vectors[self.size:self.size + n] = data
+        if self.scales is not None:
+            self.scales[self.size:self.size + n] = scales
+        self.size += n
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+        """返回当前已填充部分的 (ID, 向量, 缩放系数) 视图
+
+        追加只写入 size 之后的位置或换新数组，因此视图在锁外使用也是安全的。
+        """
+        scales = self.scales[:self.size] if self.scales is not None else None
+        return self.ids[:self.size], self.vectors[:self.size], scales
+
+
+def top_k(ids: np.ndarray, vectors: np.ndarray, query: np.ndarray, k: int,
+          min_similarity: float = 0.0, scales: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """在矩阵中检索与查询向量最相似的 k 行
+
+    Args:
+        ids: 每行对应的记忆ID
+        vectors: 已归一化的向量矩阵（可以是压缩格式）
+        query: 已归一化的查询向量
+        k: 返回数量
+        min_similarity: 相似度下限，低于该值的行不返回
+        scales: int8 格式的逐行缩放系数
+
+    Returns:
+        (记忆ID数组, 相似度数组)，按相似度降序
+    """
+    if len(ids) == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    scores = score_vectors(vectors, scales, query)
+    if min_similarity > 0:
+        candidates = np.flatnonzero(scores >= min_similarity)
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    else:
+        candidates = np.arange(len(ids))
+    candidate_scores = scores[candidates]
+
+    if len(candidates) > k:
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+    else:
+        top = np.arange(len(candidates))
+    top = top[np.argsort(-candidate_scores[top])]
+    rows = candidates[top]
+    return ids[rows], scores[rows]
+
+
+class MemoryIndex:
+    """长期记忆的常驻向量索引（线程安全）"""
+
+    def __init__(self, dtype: str = "float32", rescore_factor: int = 4,
+                 loader: Optional[Callable[[List[int]], np.ndarray]] = None):
+        """
+        Args:
+            dtype: 存储格式，float32 / float16 / int8
+            rescore_factor: 压缩格式粗排时多取的候选倍数
+            loader: 按记忆ID列表返回全精度 float32 向量矩阵的函数，用于重新打分；
+                    不提供时压缩格式直接返回粗排结果
+        """
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.dtype = dtype
+        self.rescore_factor = rescore_factor
+        self.loader = loader
+        self.dim: Optional[int] = None
+        self._global: Optional[EmbeddingMatrix] = None
+        self._senders: Dict[str, EmbeddingMatrix] = {}
+        self._positions: Dict[int, int] = {}  # 记忆ID -> 全局矩阵行号
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._global.size if self._global else 0
+
+    @property
+    def nbytes(self) -> int:
+        """全部矩阵占用的字节数（不含ID和位置表）"""
+        with self._lock:
+            total = self._global.nbytes if self._global else 0
+            return total + sum(matrix.nbytes for matrix in self._senders.values())
+
+    def _matrix_for(self, sender: str) -> EmbeddingMatrix:
+        matrix = self._senders.get(sender)
+        if matrix is None:
+            matrix = self._senders[sender] = EmbeddingMatrix(self.dim, capacity=16, dtype=self.dtype)
+        return matrix
+
+    def add_many(self, rows: Iterable[Tuple[int, str, np.ndarray]]):
+        """批量加入记忆向量
+
+        Args:
+            rows: (记忆ID, 发送者, 已归一化向量) 的可迭代对象；
+                  维度与索引不一致的向量（如损坏数据）和已在索引中的ID会被跳过
+        """
+        grouped: Dict[str, Tuple[List[int], List[np.ndarray]]] = {}
+        with self._lock:
+            for memory_id, sender, vector in rows:
+                if self.dim is None and len(vector) > 0:
+                    self.dim = len(vector)
+                if len(vector) != self.dim or memory_id in self._positions:
+                    continue
+                ids, vectors = grouped.setdefault(sender, ([], []))
+                ids.append(memory_id)
+                vectors.append(vector)
+            if not grouped:
+                return
+            if self._global is None:
+                self._global = EmbeddingMatrix(self.dim, dtype=self.dtype)
+
+            for sender, (ids, vectors) in grouped.items():
+                id_array = np.asarray(ids, dtype=np.int64)
+                matrix = np.vstack(vectors)
+                self._matrix_for(sender).append(id_array, matrix)
+                start = self._global.size
+                self._global.append(id_array, matrix)
+                self._positions.update(zip(ids, range(start, start + len(ids))))
+
+    def add(self, memory_id: int, sender: str, vector: np.ndarray):
+        """加入单条记忆向量"""
+        self.add_many([(memory_id, sender, vector)])
+
+    def search(self, query: np.ndarray, k: int, sender: Optional[str] = None,
+               min_similarity: float = 0.0) -> List[Tuple[int, float]]:
+        """检索最相似的记忆
+
+        Args:
+            query: 已归一化的查询向量
+            k: 返回数量
+            sender: 可选，只在该发送者的矩阵中检索
+            min_similarity: 相似度下限
+
+        Returns:
+            [(记忆ID, 相似度)]，按相似度降序
+        """
+        with self._lock:
+            matrix = self._senders.get(sender) if sender else self._global
+            if matrix is None or len(query) != self.dim:
+                return []
+            ids, vectors, scales = matrix.snapshot()
+
+        if self.dtype == "float32" or self.loader is None:
+            ids, scores = top_k(ids, vectors, query, k, min_similarity, scales)
+            return list(zip(ids.tolist(), scores.tolist()))
+
+        # 压缩格式粗排：多取候选并放宽下限，再用全精度向量重新打分
+        candidates, _ = top_k(ids, vectors, query, k * self.rescore_factor,
+                              max(0.0, min_similarity - 0.05), scales)
+        if len(candidates) == 0:
+            return []
+        exact = self.loader(candidates.tolist())
+        ids, scores = top_k(candidates, exact, query, k, min_similarity)
+        return list(zip(ids.tolist(), scores.tolist()))
+
+    def score(self, query: np.ndarray, memory_ids: List[int]) -> Dict[int, float]:
+        """只对给定的候选记忆计算相似度（压缩格式下为近似值）
+
+        Args:
+            query: 已归一化的查询向量
+            memory_ids: 候选记忆ID列表
+
+        Returns:
+            {记忆ID: 相似度}，不在索引中的ID会被忽略
+        """
+        with self._lock:
+            if self._global is None or len(query) != self.dim:
+                return {}
+            found = [(memory_id, self._positions[memory_id])
+                     for memory_id in memory_ids if memory_id in self._positions]
+            if not found:
+                return {}
+            rows = np.fromiter((row for _, row in found), dtype=np.int64, count=len(found))
+            vectors = self._global.vectors[rows]
+            scales = self._global.scales[rows] if self._global.scales is not None else None
+        scores = score_vectors(vectors, scales, query)
+        return {memory_id: float(s) for (memory_id, _), s in zip(found, scores)}
+
+    def global_snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        """返回全局矩阵的 (ID, float32 向量)；压缩格式会还原为 float32 副本"""
+        with self._lock:
+            if self._global is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            ids, vectors, scales = self._global.snapshot()
+        if vectors.dtype != np.float32:
+            vectors = dequantize(vectors, scales)
+        return ids, vectors
+
+
+def benchmark(vectors: np.ndarray, queries: np.ndarray, k: int = 10) -> List[Dict]:
+    """对比各存储格式的内存占用、延迟和相对 float32 精确检索的 recall@k"""
+    ids = np.arange(1, len(vectors) + 1, dtype=np.int64)
+    loader = lambda memory_ids: vectors[np.asarray(memory_ids) - 1]
+    exact = [set(top_k(ids, vectors, q, k)[0].tolist()) for q in queries]
+
+    rows = []
+    for dtype in STORAGE_DTYPES:
+        for rescore in ((False,) if dtype == "float32" else (False, True)):
+            index = MemoryIndex(dtype=dtype, loader=loader if rescore else None)
+            index.add_many(zip(ids.tolist(), ["bench"] * len(ids), vectors))
+            latencies, recalls = [], []
+            for q, expected in zip(queries, exact):
+                started = time.perf_counter()
+                hits = index.search(q, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len({i for i, _ in hits} & expected) / max(1, len(expected)))
+            rows.append({
+                "method": dtype + (" +rescore" if rescore else ""),
+                # 全局矩阵加各发送者矩阵（两者等大）；启用 IVF 时桶内还有一份同格式的副本
+                "mb": index.nbytes / 1024 / 1024,
+                "recall": float(np.mean(recalls)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="常驻向量索引存储格式基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("benchmark", help="对比 float32 / float16 / int8 的占用、延迟和召回率")
+    bench.add_argument("--db", default="data/memories.db")
+    bench.add_argument("--synthetic", type=int, default=0, help="使用 N 条随机向量代替数据库")
+    bench.add_argument("--dim", type=int, default=1536)
+    bench.add_argument("--queries", type=int, default=100)
+    bench.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        # 带簇结构的随机向量，比均匀随机更接近真实嵌入分布
+        centers = rng.standard_normal((max(1, args.synthetic // 500), args.dim)).astype(np.float32)
+        vectors = centers[rng.integers(0, len(centers), args.synthetic)]
+        vectors += rng.standard_normal(vectors.shape).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    else:
+        from utils.long_term_memory import LongTermMemory
+        memory = LongTermMemory(baseurl=None, db_path=args.db, embedding_file_readonly=True)
+        memory._ensure_index()
+        _, vectors = memory.index.global_snapshot()
+    if len(vectors) == 0:
+        print("没有可用于测试的向量")
+        return
+
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    noise = rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    queries = vectors[picks] + 0.5 * noise / np.sqrt(vectors.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"向量数={len(vectors)}, 维度={vectors.shape[1]}, k={args.k}")
+    print(f"{'method':<18}{'MB':>10}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in benchmark(vectors, queries, k=args.k):
+        print(f"{row['method']:<18}{row['mb']:>10.1f}{row['recall']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,27 @@
 
 import json
 import os
+import threading
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
 from datetime import datetime
+from utils.logger import log_error
 
 class MemoryManager:
-    def __init__(self, max_rounds: int = 50, storage_dir: str = "data/temp_memory"):
+    def __init__(self, max_rounds: int = 50, storage_dir: str = "data/temp_memory",
+                 on_evict: Optional[Callable[[str, List[Dict]], None]] = None):
         """初始化记忆管理器
         
         Args:
             max_rounds: 每个用户最大存储轮数
             storage_dir: 存储目录路径
+            on_evict: 可选，超过 max_rounds 被挤出的记忆以 (用户ID, 记忆列表) 交给它（如滚动摘要）
         """
         self.max_rounds = max_rounds
+        self.on_evict = on_evict
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
         
     def _get_user_file(self, user_id: str) -> Path:
         """获取用户记忆文件路径"""
@@ -33,23 +39,60 @@ class MemoryManager:
             is_bot: 是否是机器人发送的消息
         """
         mem_file = self._get_user_file(user_id)
-        memories = self._load_memories(user_id)
-        
-        # 添加新记忆
-        memories.append({
-            "timestamp": datetime.now().isoformat(),
-            "message": message,
-            "is_bot": is_bot
-        })
-        
-        # 只保留最近的max_rounds条
-        if len(memories) > self.max_rounds:
-            memories = memories[-self.max_rounds:]
-            
-        # 保存到文件
-        with open(mem_file, 'w', encoding='utf-8') as f:
-            json.dump(memories, f, ensure_ascii=False, indent=2)
+        evicted = []
+        with self._lock:
+            memories = self._load_memories(user_id)
+
+            # 添加新记忆
+            memories.append({
+                "timestamp": datetime.now().isoformat(),
+                "message": message,
+                "is_bot": is_bot
+            })
+
+            # 只保留最近的max_rounds条
+            if len(memories) > self.max_rounds:
+                evicted = memories[:-self.max_rounds]
+                memories = memories[-self.max_rounds:]
+
+            # 保存到文件
+            with open(mem_file, 'w', encoding='utf-8') as f:
+                json.dump(memories, f, ensure_ascii=False, indent=2)
+
+        if evicted and self.on_evict is not None:
+            try:
+                self.on_evict(user_id, evicted)
+            except Exception as e:
+                log_error(f"处理 {user_id} 被挤出的记忆失败: {str(e)}")
             
+    def evict_until(self, user_id: str, timestamp: str) -> int:
+        """挤出时间不晚于 timestamp 的最早一段记忆并交给 on_evict（如超出 prompt 预算、不再发送的旧对话）
+
+        Args:
+            user_id: 用户ID
+            timestamp: 要挤出的最后一条记忆的时间（ISO 格式）
+
+        Returns:
+            int: 挤出的条数
+        """
+        with self._lock:
+            memories = self._load_memories(user_id)
+            count = 0
+            while count < len(memories) and memories[count].get("timestamp", "") <= timestamp:
+                count += 1
+            if not count:
+                return 0
+            evicted = memories[:count]
+            with open(self._get_user_file(user_id), 'w', encoding='utf-8') as f:
+                json.dump(memories[count:], f, ensure_ascii=False, indent=2)
+
+        if self.on_evict is not None:
+            try:
+                self.on_evict(user_id, evicted)
+            except Exception as e:
+                log_error(f"处理 {user_id} 被挤出的记忆失败: {str(e)}")
+        return count
+
     def _load_memories(self, user_id: str) -> List[Dict]:
         """加载用户记忆"""
         mem_file = self._get_user_file(user_id)
@@ -0,0 +1,183 @@
+"""对话滚动摘要模块
+临时记忆超过 max_rounds 时被挤出的旧对话（以及超出 prompt 预算、提前挤出的旧对话）先攒在待总结列表里，攒够 min_new_turns 条后
+由后台线程调用较便宜的模型，把它们并入该用户的滚动摘要；构建 prompt 时用摘要代替这些旧对话。
+摘要和待总结的对话保存在 data/memory_summary/<user_key>.json，重启后继续累积
+"""
+
+import atexit
+import json
+import queue
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from utils.logger import log_error, log_info, log_warning
+
+_STOP = object()
+
+
+class ConversationSummarizer:
+    def __init__(self, client, model: str = "deepseek-chat", storage_dir: str = "data/memory_summary",
+                 min_new_turns: int = 10, max_summary_chars: int = 300, bot_name: str = "我"):
+        """初始化摘要器
+
+        Args:
+            client: OpenAI 客户端
+            model: 生成摘要使用的模型名，用便宜的模型即可；默认的 deepseek-chat 是 DeepSeek 最便宜的模型
+            storage_dir: 摘要存储目录
+            min_new_turns: 待总结的对话达到该条数才调用模型，避免每挤出一条就总结一次
+            max_summary_chars: 摘要的最大字数
+            bot_name: 机器人在摘要中的称呼
+        """
+        self.client = client
+        self.model = model
+        self.storage_dir = Path(storage_dir)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        self.min_new_turns = min_new_turns
+        self.max_summary_chars = max_summary_chars
+        self.bot_name = bot_name
+        self._states: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue" = queue.Queue()
+        self._queued = set()
+        self._closed = False
+        self.folded = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="memory-summarizer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _get_user_file(self, user_key: str) -> Path:
+        return self.storage_dir / f"{user_key}.json"
+
+    def _read_file(self, user_key: str) -> Dict:
+        state = {"summary": "", "pending": [], "folded_turns": 0, "updated": None}
+        path = self._get_user_file(user_key)
+        if path.exists():
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    state.update(json.load(f))
+            except (json.JSONDecodeError, OSError) as e:
+                log_warning(f"读取 {user_key} 的对话摘要失败，重新开始: {str(e)}")
+        return state
+
+    def _load(self, user_key: str) -> Dict:
+        """读取用户的摘要状态（调用方持有锁）"""
+        state = self._states.get(user_key)
+        if state is None:
+            state = self._states.setdefault(user_key, self._read_file(user_key))
+        return state
+
+    def _save(self, user_key: str, state: Dict):
+        with open(self._get_user_file(user_key), 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+
+    def add_evicted(self, user_key: str, turns: List[Dict]):
+        """接收临时记忆挤出的对话（MemoryManager 的 on_evict 回调），攒够条数后安排后台总结"""
+        if not turns:
+            return
+        with self._lock:
+            state = self._load(user_key)
+            state["pending"].extend(turns)
+            self._save(user_key, state)
+            ready = len(state["pending"]) >= self.min_new_turns and user_key not in self._queued
+            if ready and not self._closed:
+                self._queued.add(user_key)
+                self._queue.put(user_key)
+
+    def get_summary(self, user_key: str) -> str:
+        """返回用户当前的滚动摘要，没有时返回空字符串
+
+        每条回复都会调用，不获取 _lock：该锁在写文件和总结期间一直被持有，等待它会拖住回复流水线。
+        已缓存时直接读内存；未缓存时读一次文件，只在其他线程尚未载入时放进缓存
+        """
+        state = self._states.get(user_key)
+        if state is None:
+            state = self._states.setdefault(user_key, self._read_file(user_key))
+        return state["summary"]
+
+    def _format_turns(self, turns: List[Dict]) -> str:
+        return "\n".join(
+            f"{self.bot_name if turn.get('is_bot') else '对方'}：{turn.get('message', '')}" for turn in turns
+        )
+
+    def _fold(self, user_key: str):
+        """把待总结的对话并入摘要；失败时保留待总结列表，下次再试"""
+        with self._lock:
+            state = self._load(user_key)
+            summary = state["summary"]
+            turns = list(state["pending"])
+        if not turns:
+            return
+
+        prompt = (
+            f"下面是你（{self.bot_name}）和对方较早的聊天摘要，以及之后新的一段对话。\n"
+            f"请把新对话中值得记住的内容（对方的情况、偏好、约定、未完的话题等）并入摘要，"
+            f"删去寒暄和已经过时的细节，用第三人称写成一段不超过 {self.max_summary_chars} 字的中文，只输出摘要本身。\n\n"
+            f"已有摘要：\n{summary or '（无）'}\n\n新对话：\n{self._format_turns(turns)}"
+        )
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.3,
+                max_tokens=self.max_summary_chars * 2,
+            )
+            new_summary = (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            self.failed += 1
+            log_error(f"更新 {user_key} 的对话摘要失败: {str(e)}")
+            return
+        if not new_summary:
+            self.failed += 1
+            log_warning(f"模型没有返回 {user_key} 的对话摘要，保留待总结的对话")
+            return
+
+        with self._lock:
+            state = self._load(user_key)
+            state["summary"] = new_summary
+            # 总结期间可能又挤出了新对话，只移除本次已并入的部分
+            state["pending"] = state["pending"][len(turns):]
+            state["folded_turns"] += len(turns)
+            state["updated"] = datetime.now().isoformat()
+            self._save(user_key, state)
+        self.folded += len(turns)
+        log_info(f"已把 {len(turns)} 条旧对话并入 {user_key} 的摘要（{len(new_summary)} 字）")
+
+    def _run(self):
+        while True:
+            user_key = self._queue.get()
+            try:
+                if user_key is _STOP:
+                    return
+                with self._lock:
+                    self._queued.discard(user_key)
+                self._fold(user_key)
+            except Exception as e:
+                log_error(f"对话摘要线程出错: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """阻塞直到已安排的总结全部完成"""
+        self._queue.join()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = sum(len(state["pending"]) for state in self._states.values())
+        return {"folded": self.folded, "failed": self.failed, "pending_turns": pending,
+                "queued": self._queue.qsize()}
+
+    def close(self, timeout: Optional[float] = 30.0):
+        """完成已安排的总结并停止后台线程（可重复调用）；未攒够条数的对话留在文件里，下次启动继续累积"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log_warning(f"对话摘要线程未在 {timeout} 秒内结束")
+        else:
+            log_info(f"对话摘要器已关闭: {self.stats()}")
@@ -0,0 +1,122 @@
+"""长期记忆后台写入模块
+把回复中解析出的记忆放入队列，由后台线程批量嵌入并写库，不阻塞回复发送
+"""
+
+import atexit
+import queue
+import threading
+from typing import List, Tuple
+
+from utils.logger import log_info, log_error, log_warning
+
+_STOP = object()
+
+
+class MemoryWriter:
+    def __init__(self, long_term_memory, batch_size: int = 16, flush_interval: float = 2.0,
+                 max_queue: int = 1000):
+        """初始化后台写入队列
+
+        Args:
+            long_term_memory: LongTermMemory 实例
+            batch_size: 每批最多写入的记忆条数（一次嵌入请求 + 一个事务）
+            flush_interval: 队列空闲时的最长等待秒数
+            max_queue: 队列最大长度，满时新记忆会被丢弃并记录错误
+        """
+        self.long_term_memory = long_term_memory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self.written = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, sender: str, topic: str, summary: str) -> bool:
+        """提交一条记忆，立即返回
+
+        Returns:
+            bool: 是否成功入队
+        """
+        if self._closed:
+            log_warning(f"记忆写入队列已关闭，丢弃记忆: {topic}")
+            return False
+        try:
+            self._queue.put_nowait((sender, topic, summary))
+            return True
+        except queue.Full:
+            self.failed += 1
+            log_error(f"记忆写入队列已满，丢弃记忆: {topic}")
+            return False
+
+    def flush(self):
+        """阻塞直到当前已入队的记忆全部处理完"""
+        self._queue.join()
+
+    def close(self, timeout: float = 30.0):
+        """写完剩余记忆并停止后台线程（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log_warning(f"记忆写入线程未在 {timeout} 秒内结束，剩余约 {self._queue.qsize()} 条")
+        else:
+            log_info(f"记忆写入队列已关闭: 写入 {self.written} 条, 失败 {self.failed} 条")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch: List[Tuple[str, str, str]] = []
+            taken = 1
+            if first is _STOP:
+                stopping = True
+            else:
+                batch.append(first)
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+
+            # 停止时把队列里剩余的记忆一并写完
+            if stopping:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    taken += 1
+                    if item is not _STOP:
+                        batch.append(item)
+
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    self._write(batch[start:start + self.batch_size])
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _write(self, batch: List[Tuple[str, str, str]]):
+        if not batch:
+            return
+        try:
+            self.long_term_memory.add_memories(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            log_error(f"批量写入长期记忆失败（{len(batch)} 条）: {str(e)}")
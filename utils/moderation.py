@@ -1,5 +1,5 @@
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from typing import Union, List, Dict, Optional
 
 
@@ -10,16 +10,19 @@ class ContentModerator:
     Supports both text and image moderation with the omni-moderation-latest model.
     """
     
-    def __init__(self, baseurl,api_key: Optional[str] = None):
+    def __init__(self, baseurl,api_key: Optional[str] = None, client: Optional[OpenAI] = None,
+                 async_client: Optional[AsyncOpenAI] = None):
         """
         Initialize the moderator with an optional API key.
         If no key is provided, will use OPENAI_API_KEY environment variable.
+        Shared clients may be passed in to reuse their connection pools.
         """
         self.api_key = api_key or os.getenv('OPENAI_API_KEY')
         self.model = "text-moderation-stable"
         if not self.api_key:
             raise ValueError("OpenAI API key is required")
-        self.client = OpenAI(api_key=self.api_key, base_url=baseurl)  # 使用全局 baseurl
+        self.client = client or OpenAI(api_key=self.api_key, base_url=baseurl)  # 使用全局 baseurl
+        self.async_client = async_client or AsyncOpenAI(api_key=self.api_key, base_url=baseurl)
     
     def _make_request(self, payload: Dict) -> Dict:
         """
@@ -40,6 +43,16 @@ class ContentModerator:
         except Exception as e:
             raise Exception(f"API request failed: {str(e)}")
     
+    async def _amake_request(self, payload: Dict) -> Dict:
+        """
+        Async version of _make_request using AsyncOpenAI.
+        """
+        try:
+            response = await self.async_client.moderations.create(**payload)
+            return response.model_dump()
+        except Exception as e:
+            raise Exception(f"API request failed: {str(e)}")
+
     def moderate_text(self, text: str) -> Dict:
         """
         Moderate a single text input.
@@ -77,6 +90,27 @@ class ContentModerator:
         response = self._make_request(payload)
         return self._format_response(response)
     
+    async def amoderate_text(self, text: str) -> Dict:
+        """
+        Async version of moderate_text.
+        """
+        response = await self._amake_request({"model": self.model, "input": text})
+        return self._format_response(response)
+
+    async def amoderate_image(self, image_url: str) -> Dict:
+        """
+        Async version of moderate_image.
+        """
+        payload = {
+            "model": self.model,
+            "input": [{
+                "type": "image_url",
+                "image_url": {"url": image_url}
+            }]
+        }
+        response = await self._amake_request(payload)
+        return self._format_response(response)
+
     def moderate_mixed(self, inputs: List[Union[str, Dict]]) -> Dict:
         """
         Moderate mixed text and image inputs.
@@ -129,6 +163,7 @@ def is_content_safe(moderation_result: Dict, threshold: float = 0.5) -> bool:
         bool: True if no categories exceed threshold, False otherwise
     """
     for score in moderation_result["scores"].values():
-        if score > threshold:
+        # 接口可能对部分类别返回 null，按 0 分处理
+        if (score or 0.0) > threshold:
             return False
     return True
@@ -1,9 +1,17 @@
 # prompt_builder.py
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple, Union
 import json
 import re
 import os
 from utils.logger import log_info, log_warning, log_error
+from utils.metrics import PROMPT_SECTION_TOKENS
+from utils.token_counter import estimate_message_tokens, estimate_tokens
+
+# prompt 布局：
+#   stable_prefix - 系统提示词只含人设和规则，各次请求逐字节相同，可命中服务端前缀缓存；
+#                   时间、相关记忆和日程放在最新用户消息之前的情景消息中
+#   inline        - 旧布局，时间和背景信息写在系统提示词里
+PROMPT_LAYOUTS = ("stable_prefix", "inline")
 
 class PromptBuilder:
     def __init__(self, config: Dict):
@@ -15,6 +23,9 @@ class PromptBuilder:
         """
         self.config = config
         self.other_names_str = "，".join(config.get('other_name', []))
+        self.layout = config.get('prompt_layout', 'stable_prefix')
+        # prompt 的 token 预算，0 表示不限；按 最近对话 > 相关记忆 > 日程 的顺序填充
+        self.context_budget = config.get('context_budget', 3000)
         
         # 加载黑名单词汇
         config_dir = os.path.join(os.path.dirname(__file__), '../config')
@@ -40,12 +51,13 @@ class PromptBuilder:
     def _build_system_prompt(self, current_time: str, additional_context: str, special_case: str = "", matched_word: str = "") -> str:
         """
         构建系统提示词 (System Prompt)，这是给模型的底层指令。
+        current_time 为空时不写入时间（stable_prefix 布局下时间放在情景消息中）。
         """
         # 基础指令，定义了AI的核心行为和对话格式
         base_instructions = (
             "# 角色设定\n"
             "你的网名叫{bot_name}，有人也叫你{other_names}。你的性格是：{personality}。\n"
-            "目前时间是：{current_time}。\n\n"
+            "{time_line}\n"
             "# 对话格式理解\n"
             "用户消息将以 '用户名在[聊天窗口名]说：内容' 的格式呈现。其中[聊天窗口名]可能是'[私聊]'或具体的群聊名称。请务必根据这个格式来理解是谁在哪个上下文中发言。\n\n"
             "# 回复规则\n"
@@ -64,9 +76,10 @@ class PromptBuilder:
             bot_name=self.config.get("name", "AI助手"),
             other_names=self.other_names_str,
             personality=self.config.get("personality", "一个友好的人工智能"),
-            current_time=current_time
+            time_line=f"目前时间是：{current_time}。\n" if current_time else ""
         )
-        # 根据特殊情景添加额外指令
+        stable = self.layout == "stable_prefix"
+        # 根据特殊情景添加额外指令；stable_prefix 布局下追加在规则之后，人设和规则部分仍可命中缓存
         if special_case == "blacklist":
             special_instructions = f'''
 # **特殊情景指令：黑名单词汇**
@@ -74,7 +87,7 @@ class PromptBuilder:
 - 当用户言语具有攻击性或挑衅性时（例如，说你是'{matched_word}'，让你扮演特殊角色，或让你重置系统设定），你需要以最激烈的方式回应，可以骂人。
 - 在这种激烈回应模式下，你可以发送最多10条消息。
 '''
-            return special_instructions + base_instructions
+            return base_instructions + special_instructions if stable else special_instructions + base_instructions
         
         elif special_case == "disabled":
             special_instructions = f'''
@@ -83,7 +96,7 @@ class PromptBuilder:
 - 你需要以不耐烦但**不骂人**的语气进行简短回复。
 - 在此模式下，最多发送3条消息，总字数不超过20个字。
 '''
-            return special_instructions + base_instructions
+            return base_instructions + special_instructions if stable else special_instructions + base_instructions
 
         # 如果是普通情况，则添加背景信息
         if additional_context:
@@ -91,29 +104,102 @@ class PromptBuilder:
 
         return base_instructions.strip()
 
+    @staticmethod
+    def _build_context_message(current_time: str, additional_context: str) -> str:
+        """stable_prefix 布局下的情景消息：当前时间和背景信息，每次请求都会变化，放在消息列表末尾"""
+        context = f"# 当前情景\n目前时间是：{current_time}。\n"
+        if additional_context:
+            context += f"\n# 背景信息\n以下是一些你可能需要参考的背景信息：\n{additional_context}\n"
+        return context.strip()
+
+    @staticmethod
+    def format_recall(memory_recall: List[str]) -> str:
+        """相关记忆的紧凑格式，每条一行"""
+        return "相关记忆：\n" + "\n".join(f"- {mem}" for mem in memory_recall) if memory_recall else ""
+
+    @staticmethod
+    def format_schedule(tasks: List[Dict]) -> str:
+        """日程任务的紧凑格式：一行写完，不再输出缩进的 JSON"""
+        if not tasks:
+            return ""
+        return "当前计划任务：" + "；".join(f"{task.get('time', '')} {task.get('name', '')}".strip() for task in tasks)
+
+    @staticmethod
+    def _drop_current_messages(memory_context: List[Dict], new_messages: List[str]) -> List[Dict]:
+        """调用方在构建 prompt 前已把本轮用户消息存入临时记忆，去掉记忆末尾与之相同的条目，避免重复发送"""
+        history = list(memory_context)
+        pending = list(new_messages)
+        while (history and pending and not history[-1].get('is_bot', False)
+               and not history[-1].get('is_recall', False) and history[-1].get('message') == pending[-1]):
+            history.pop()
+            pending.pop()
+        return history
+
+    def _fit_background(self, remaining: Optional[int], memory_recall: List[str], tasks: List[Dict],
+                        additional_context: str) -> Tuple[str, Dict[str, int]]:
+        """在剩余预算内依次放入相关记忆（按相关度逐条）和日程（按时间逐项），返回 (背景信息, 各部分 token 数)"""
+        used = {"recall": 0, "schedule": 0, "extra": 0}
+        kept_recall: List[str] = []
+        for mem in memory_recall:
+            cost = estimate_tokens(self.format_recall(kept_recall + [mem])) - used["recall"]
+            if remaining is not None and cost > remaining:
+                break
+            kept_recall.append(mem)
+            used["recall"] += cost
+            remaining = None if remaining is None else remaining - cost
+        kept_tasks: List[Dict] = []
+        for task in tasks:
+            cost = estimate_tokens(self.format_schedule(kept_tasks + [task])) - used["schedule"]
+            if remaining is not None and cost > remaining:
+                break
+            kept_tasks.append(task)
+            used["schedule"] += cost
+            remaining = None if remaining is None else remaining - cost
+        blocks = [self.format_recall(kept_recall), self.format_schedule(kept_tasks)]
+        if additional_context:
+            cost = estimate_tokens(additional_context)
+            if remaining is None or cost <= remaining:
+                blocks.append(additional_context)
+                used["extra"] = cost
+        return "\n".join(block for block in blocks if block), used
+
     def build_messages_list(self,
                             sender: str,
                             chat_name: str,
-                            new_message: str,
+                            new_message: Union[str, List[str]],
                             memory_context: List[Dict],
                             current_time: str,
-                            additional_context: str = "") -> List[Dict]:
+                            additional_context: str = "",
+                            memory_recall: Optional[List[str]] = None,
+                            schedule: Optional[Dict] = None,
+                            summary: str = "",
+                            on_history_dropped: Optional[Callable[[List[Dict]], None]] = None) -> List[Dict]:
         """
         构建符合OpenAI规范的messages列表，用于多轮对话。
 
+        系统提示词、更早对话的摘要、最新消息和当前时间总会发送；其余内容在 context_budget 内按
+        最近对话（从新到旧）> 相关记忆 > 日程 的顺序填充，放不下的部分丢弃，各部分 token 数记入日志和指标。
+
         Args:
             sender: 最新消息的发送者名称。
             chat_name: 消息所在的聊天窗口名称 (例如: '私聊' 或 '技术交流群')。
-            new_message: 最新的用户消息内容。
-            memory_context: 历史对话记忆列表。
+            new_message: 最新的用户消息内容；连发的多条消息可传入列表，合并为同一轮用户消息。
+            memory_context: 历史对话记忆列表；末尾与最新消息相同的条目会被去掉。
             current_time: 当前时间的字符串。
-            additional_context: 额外上下文（如长期记忆、日程等）。
+            additional_context: 其他已格式化的额外上下文，在记忆和日程之后放入。
+            memory_recall: 相关长期记忆，按相关度排序。
+            schedule: 当前日程，只使用其中的 tasks。
+            summary: 已挤出临时记忆的更早对话的滚动摘要，放在系统提示词之后。
+            on_history_dropped: 可选，超出预算未发送的历史对话记忆（按时间顺序）交给它，
+                                以便调用方把它们并入滚动摘要。
 
         Returns:
             构建好的、可直接发送给API的messages列表。
         """
         special_case = ""
         matched_word = ""
+        new_messages = [new_message] if isinstance(new_message, str) else list(new_message)
+        new_message = "\n".join(new_messages)
 
         # 检查特殊情况
         if self.disabled_pattern.search(new_message):
@@ -124,24 +210,81 @@ class PromptBuilder:
                 special_case = "blacklist"
                 matched_word = match.group()
         
-        # 1. 构建系统消息 (System Prompt)
-        system_prompt = self._build_system_prompt(current_time, additional_context, special_case, matched_word)
-        messages = [{"role": "system", "content": system_prompt}]
-        log_info(f"构建的系统Prompt:\n---\n{system_prompt}\n---")
+        stable = self.layout == "stable_prefix"
+        formatted_new_message = "\n".join(f"{sender}在[{chat_name}]说：{message}" for message in new_messages)
+        new_user_message = {"role": "user", "content": formatted_new_message}
 
-        # 2. 转换历史对话记录
-        for mem in memory_context:
+        # 1. 转换历史对话记录（去掉已在记忆中的本轮消息）
+        history_messages = []
+        history_memories = self._drop_current_messages(memory_context, new_messages)
+        for mem in history_memories:
             if mem.get('is_bot', False):
-                messages.append({"role": "assistant", "content": mem['message']})
+                history_messages.append({"role": "assistant", "content": mem['message']})
             elif mem.get('is_recall', False):
                 # 回忆提示消息，直接插入
-                messages.append({"role": "user", "content": f"（这唤起了你的回忆：你在{mem.get('recall_time','')}记下了【{mem.get('recall_content','')}】）"})
+                history_messages.append({"role": "user", "content": f"（这唤起了你的回忆：你在{mem.get('recall_time','')}记下了【{mem.get('recall_content','')}】）"})
             else:
                 formatted_content = f"{sender}在[{chat_name}]说：{mem['message']}"
-                messages.append({"role": "user", "content": formatted_content})
+                history_messages.append({"role": "user", "content": formatted_content})
 
-        # 3. 添加最新的用户消息，并应用新格式
-        formatted_new_message = f"{sender}在[{chat_name}]说：{new_message}"
-        messages.append({"role": "user", "content": formatted_new_message})
-        
+        # 2. 必须发送的部分：系统提示词（不含背景信息）、对话摘要、当前时间和最新消息
+        base_system_prompt = self._build_system_prompt("" if stable else current_time, "", special_case, matched_word)
+        summary_message = None
+        if summary:
+            # 摘要只在后台总结后才变化，紧跟系统提示词放置，不影响前缀缓存
+            summary_message = {"role": "system", "content": f"# 更早的对话摘要\n以下是你和{sender}更早聊天内容的摘要：\n{summary}"}
+        report = {
+            "system": estimate_message_tokens({"content": base_system_prompt}),
+            "message": estimate_message_tokens(new_user_message),
+        }
+        if summary_message:
+            report["summary"] = estimate_message_tokens(summary_message)
+        if stable:
+            report["context"] = estimate_message_tokens({"content": self._build_context_message(current_time, "")})
+        remaining = self.context_budget - sum(report.values()) if self.context_budget else None
+
+        # 3. 最近对话从新到旧放入，放不下时丢弃更早的对话
+        kept_history = 0
+        report["history"] = 0
+        for message in reversed(history_messages):
+            cost = estimate_message_tokens(message)
+            if remaining is not None and cost > remaining:
+                break
+            kept_history += 1
+            report["history"] += cost
+            remaining = None if remaining is None else remaining - cost
+        dropped = len(history_messages) - kept_history
+        history_messages = history_messages[dropped:]
+        if dropped and on_history_dropped is not None:
+            on_history_dropped(history_memories[:dropped])
+
+        # 4. 剩余预算依次放入相关记忆和日程（与旧布局一致，特殊情景下不附带背景信息）
+        background = ""
+        if not special_case:
+            tasks = (schedule or {}).get("tasks", [])
+            background, used = self._fit_background(remaining, memory_recall or [], tasks, additional_context)
+            report.update({section: tokens for section, tokens in used.items() if tokens})
+
+        # 5. 组装：stable_prefix 布局下易变的时间和背景信息放在最新用户消息之前，
+        #    系统提示词和历史对话构成的前缀保持不变；inline 布局下写在系统提示词里
+        if stable:
+            system_prompt = base_system_prompt
+        else:
+            system_prompt = self._build_system_prompt(current_time, background, special_case, matched_word)
+        messages = [{"role": "system", "content": system_prompt}]
+        log_info(f"构建的系统Prompt:\n---\n{system_prompt}\n---")
+        if summary_message:
+            messages.append(summary_message)
+        messages.extend(history_messages)
+        if stable:
+            context_message = self._build_context_message(current_time, background)
+            messages.append({"role": "system", "content": context_message})
+            log_info(f"构建的情景消息:\n---\n{context_message}\n---")
+        messages.append(new_user_message)
+
+        for section, tokens in report.items():
+            PROMPT_SECTION_TOKENS.labels(section).observe(tokens)
+        log_info(f"prompt token 估算（预算 {self.context_budget or '不限'}）: "
+                 f"{', '.join(f'{section}={tokens}' for section, tokens in report.items())}, "
+                 f"合计={sum(report.values())}, 保留对话 {kept_history} 条，未发送 {dropped} 条")
         return messages
@@ -0,0 +1,381 @@
+"""离线回放与压测
+把录制的聊天记录（chat_history/*.json）或合成流量按时间间隔注入 FakeWeChat
+（经由 wxauto 传输）或通过 HTTP 提交给本地消息网关，由真实的 app.py 流水线
+（合并、分发、上下文、模型、审查、发送）处理，模型和审查接口由独立进程中的 FakeOpenAIServer 提供。
+运行数据和日志写在临时目录（日志也可用 --log-dir 指定），不影响 data/ 和 logs/。
+
+用法：
+    python -m utils.replay --synthetic 200 --users 20 --rate 10
+    python -m utils.replay --history chat_history/2025-01-01.json --speed 20
+    python -m utils.replay --synthetic 1000 --users 100 --rate 50 --transport http --set send_delay=[0,0]
+"""
+
+import argparse
+import glob
+import importlib
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import urllib.request
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from utils.fake_backends import FakeWeChat
+
+# (相对开始时间的秒数, 发送者, 内容)
+Traffic = List[Tuple[float, str, str]]
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+CONFIG_DIR = os.path.join(ROOT_DIR, 'config')
+
+
+def load_history(paths: List[str]) -> Traffic:
+    """从 chat_history 的 JSON 文件读取用户消息，保留原始的时间间隔"""
+    records = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, 'r', encoding='utf-8') as f:
+                records.extend(json.load(f))
+    traffic = []
+    for record in records:
+        try:
+            at = datetime.strptime(record['timestamp'], '%Y-%m-%d %H:%M:%S').timestamp()
+        except (KeyError, ValueError):
+            continue
+        sender = str(record.get('sender', '')).split('@')[0] or 'unknown'
+        # 连发合并后的记录按行拆回多条消息
+        for line in str(record.get('user_message', '')).splitlines():
+            if line.strip():
+                traffic.append((at, sender, line))
+    traffic.sort(key=lambda item: item[0])
+    if not traffic:
+        return []
+    start = traffic[0][0]
+    return [(at - start, sender, content) for at, sender, content in traffic]
+
+
+def synthetic_traffic(messages: int, users: int = 10, rate: float = 5.0,
+                      burst: float = 0.3, mention_rate: float = 0.0, seed: int = 0) -> Traffic:
+    """合成流量：连发串按泊松过程到达，每条之后以 burst 概率由同一用户在 0.5 秒内再发一条
+
+    Args:
+        messages: 消息总数
+        users: 用户数
+        rate: 平均每秒消息数（连发串的平均长度为 1/(1-burst)，到达率相应折算）
+        burst: 连发概率
+        mention_rate: 消息中提及机器人（泡泡）的比例，用于观察满载时的优先级调度
+    """
+    rng = random.Random(seed)
+    traffic: Traffic = []
+    at = 0.0
+    while len(traffic) < messages:
+        at += rng.expovariate(rate * (1 - burst))
+        sender = f"user{rng.randrange(users)}"
+        sent_at = at
+        while True:
+            mention = "泡泡，" if rng.random() < mention_rate else ""
+            traffic.append((sent_at, sender, f"{mention}第{len(traffic)}条消息，今天过得怎么样"))
+            if len(traffic) >= messages or rng.random() >= burst:
+                break
+            sent_at += rng.uniform(0.05, 0.5)
+    traffic.sort(key=lambda item: item[0])
+    return traffic
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class LatencyRecorder:
+    def __init__(self):
+        """记录每条消息从注入到该会话下一次发送之间的延迟"""
+        self._pending: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.sent = 0
+        self.last_send = 0.0
+
+    def pushed(self, chat_name: str):
+        with self._lock:
+            self._pending.setdefault(chat_name, deque()).append(time.perf_counter())
+
+    def on_send(self, chat_name: str, msg):
+        now = time.perf_counter()
+        with self._lock:
+            self.sent += 1
+            self.last_send = now
+            pending = self._pending.get(chat_name)
+            while pending:
+                self.latencies.append(now - pending.popleft())
+
+    def unanswered(self) -> int:
+        with self._lock:
+            return sum(len(pending) for pending in self._pending.values())
+
+
+def _write_config(workdir: str, base_url: str, overrides: Dict) -> str:
+    """复制配置目录，把所有接口指向本地假服务"""
+    config_dir = os.path.join(workdir, 'config')
+    shutil.copytree(CONFIG_DIR, config_dir)
+    with open(os.path.join(config_dir, 'config.json'), 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config['chat'] = {'base_url': base_url, 'key': 'fake'}
+    for name in ('image_processor_key', 'long_term_memory_key', 'moderator_key'):
+        config[name] = 'fake'
+    config['metrics_port'] = 0
+    config.update(overrides)
+    with open(os.path.join(config_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    return config_dir
+
+
+def _post_message(url: str, sender: str, content: str):
+    body = json.dumps({"sender": sender, "content": content}, ensure_ascii=False).encode("utf-8")
+    request = urllib.request.Request(url + "/messages", data=body, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+
+
+def start_fake_server(latency: float = 0.3, tps: float = 50.0, error_rate: float = 0.0):
+    """在子进程中启动 FakeOpenAIServer，返回 (进程, base_url)"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "utils.fake_backends", "--latency", str(latency),
+         "--tps", str(tps), "--error-rate", str(error_rate)],
+        cwd=ROOT_DIR, stdout=subprocess.PIPE, text=True)
+    base_url = process.stdout.readline().strip()
+    if not base_url:
+        process.kill()
+        raise RuntimeError("假服务启动失败")
+    return process, base_url
+
+
+def fetch_api_stats(base_url: str) -> Dict:
+    with urllib.request.urlopen(base_url + "/stats", timeout=10) as response:
+        return json.loads(response.read())
+
+
+def _idle(app, inbox_pending) -> bool:
+    # 满载时被丢弃的消息不会计入 processed，因此以队列清空且没有会话在处理为准
+    dispatcher_stats = app.dispatcher.stats()
+    return (inbox_pending() == 0
+            and app.coalescer.stats()["buffered"] == 0
+            and dispatcher_stats["pending"] == 0
+            and dispatcher_stats["active_chats"] == 0)
+
+
+def _redirect_file_logs(log_dir: str) -> str:
+    """把根日志的文件输出改写到 log_dir，返回新的日志文件路径"""
+    import utils.logger  # noqa: F401  先完成日志配置再替换文件输出
+    os.makedirs(log_dir, exist_ok=True)
+    log_file = os.path.join(log_dir, f"{datetime.now().strftime('%Y-%m-%d')}.log")
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.FileHandler):
+            root.removeHandler(handler)
+            handler.close()
+            file_handler = logging.FileHandler(log_file, encoding='utf-8', delay=True)
+            file_handler.setLevel(handler.level)
+            file_handler.setFormatter(handler.formatter)
+            root.addHandler(file_handler)
+    return log_file
+
+
+def run_replay(traffic: Traffic, base_url: str, app_module: str = "app", speed: float = 1.0,
+               reply_mode: str = "always", overrides: Optional[Dict] = None,
+               drain_timeout: float = 120.0, transport: str = "wechat",
+               log_dir: Optional[str] = None) -> Dict:
+    """经由真实的 app 模块回放一段流量并返回统计
+
+    一个进程只能运行一次（app 模块在导入时初始化全部组件）
+
+    Args:
+        traffic: 消息列表
+        base_url: 已启动的 FakeOpenAIServer 地址
+        app_module: 要加载的入口模块，app 或 appunsafe
+        speed: 回放倍速，时间间隔除以该值
+        reply_mode: 回复意愿的全局模式，默认 always 以便每条消息都产生回复
+        overrides: 覆盖 config.json 的配置项
+        drain_timeout: 注入完毕后等待处理完的最长秒数
+        transport: wechat 经由 wxauto 传输注入 FakeWeChat；http 通过 HTTP 提交给本地消息网关
+        log_dir: 日志目录，默认写到本次回放的临时目录
+    """
+    recorder = LatencyRecorder()
+    wechat = FakeWeChat(on_send=recorder.on_send)
+    workdir = tempfile.mkdtemp(prefix="openpop-replay-")
+    overrides = dict(overrides or {})
+    if transport == "http":
+        overrides.update({"transport": "http", "gateway_port": 0})
+    config_dir = _write_config(workdir, base_url, overrides)
+    log_file = _redirect_file_logs(log_dir or os.path.join(workdir, 'logs'))
+
+    # 运行数据（记忆库、日程、聊天记录、用户统计）全部写到临时目录
+    import utils.chat_history as chat_history
+    import utils.user_stats as user_stats
+    chat_history.HISTORY_DIR = os.path.join(workdir, 'chat_history')
+    os.makedirs(chat_history.HISTORY_DIR, exist_ok=True)
+    user_stats.USER_STATS_FILE = os.path.join(workdir, 'data', 'user_stats.json')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+
+    wxauto = types.ModuleType("wxauto")
+    wxauto.WeChat = lambda: wechat
+    sys.modules["wxauto"] = wxauto
+    os.environ["OPENPOP_CONFIG_DIR"] = config_dir
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    try:
+        app = importlib.import_module(app_module)
+        app.start()
+        services = app.services
+        services.willingness_calc.set_global_mode(reply_mode)
+        if transport == "http":
+            services.transport.on_send = recorder.on_send
+            inbox_pending = services.transport.pending
+            inject = lambda sender, content: _post_message(services.transport.url, sender, content)
+        else:
+            inbox_pending = wechat.pending
+            inject = wechat.push
+        runner = threading.Thread(target=app.scheduler.run, name="replay-scheduler", daemon=True)
+        runner.start()
+
+        start = time.perf_counter()
+        for offset, sender, content in traffic:
+            delay = start + offset / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            recorder.pushed(sender)
+            inject(sender, content)
+        injected = time.perf_counter()
+
+        # 消息在收件箱、合并器和分发器之间交接时有短暂空档，空闲需持续一段时间才算处理完
+        deadline = injected + drain_timeout
+        idle_since = None
+        while time.perf_counter() < deadline:
+            if not _idle(app, inbox_pending):
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.perf_counter()
+            elif time.perf_counter() - idle_since > 0.5:
+                break
+            time.sleep(0.05)
+        finished = max(recorder.last_send, injected)
+        report = {
+            "transport": transport,
+            "log_file": log_file,
+            "messages": len(traffic),
+            "replies_sent": recorder.sent,
+            "unanswered": recorder.unanswered(),
+            "inject_seconds": injected - start,
+            "total_seconds": finished - start,
+            "throughput": len(traffic) / max(finished - start, 1e-9),
+            "latency_p50": _percentile(recorder.latencies, 50),
+            "latency_p95": _percentile(recorder.latencies, 95),
+            "latency_p99": _percentile(recorder.latencies, 99),
+            "api": fetch_api_stats(base_url),
+            "dispatcher": app.dispatcher.stats(),
+            "coalescer": app.coalescer.stats(),
+            "pipeline": services.reply_pipeline.stats(),
+            "startup_ms": services.startup_report(),
+        }
+        app.shutdown()
+        return report
+    finally:
+        os.chdir(cwd)
+
+
+def print_report(report: Dict):
+    print(f"消息数={report['messages']}, 发送回复={report['replies_sent']}, 未回复={report['unanswered']}")
+    print(f"注入耗时={report['inject_seconds']:.2f}s, 总耗时={report['total_seconds']:.2f}s, "
+          f"吞吐={report['throughput']:.2f} msg/s")
+    print(f"回复延迟 p50={report['latency_p50']:.3f}s, p95={report['latency_p95']:.3f}s, "
+          f"p99={report['latency_p99']:.3f}s")
+    api = report["api"]
+    print(f"API 调用: {api['calls']}, prompt_tokens={api['prompt_tokens']}, "
+          f"completion_tokens={api['completion_tokens']}, "
+          f"缓存命中={api['prompt_cache_hit_tokens'] / max(api['prompt_tokens'], 1):.1%}")
+    print(f"启动耗时(ms): {report['startup_ms']}")
+    print(f"日志: {report['log_file']}")
+    print(f"合并: {report['coalescer']}")
+    dispatcher = report["dispatcher"]
+    print(f"分发: 丢弃={dispatcher['shed']}, 降级={dispatcher['degraded']}, "
+          f"平均排队(s)={ {name: round(wait, 3) for name, wait in dispatcher['avg_wait_by_priority'].items()} }")
+    print(f"{'stage':<18}{'count':>8}{'avg s':>10}{'max s':>10}{'failed':>8}")
+    for stage, stats in sorted(report["pipeline"].items()):
+        print(f"{stage:<18}{stats['count']:>8}{stats['avg']:>10.3f}{stats['max']:>10.3f}{stats['failed']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放聊天流量并统计吞吐和回复延迟")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--history", nargs="+", help="chat_history 下的 JSON 文件（支持通配符）")
+    source.add_argument("--synthetic", type=int, help="合成 N 条消息")
+    parser.add_argument("--users", type=int, default=10, help="合成流量的用户数")
+    parser.add_argument("--rate", type=float, default=5.0, help="合成流量每秒消息数")
+    parser.add_argument("--burst", type=float, default=0.3, help="合成流量的连发概率")
+    parser.add_argument("--mention-rate", type=float, default=0.0, help="合成流量中提及机器人的消息比例")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速")
+    parser.add_argument("--app", default="app", choices=["app", "appunsafe"])
+    parser.add_argument("--transport", default="wechat", choices=["wechat", "http"],
+                        help="wechat: 假微信窗口 + wxauto 传输；http: 本地 HTTP 消息网关")
+    parser.add_argument("--reply-mode", default="always", help="回复意愿全局模式")
+    parser.add_argument("--latency", type=float, default=0.3, help="假模型首字延迟秒数")
+    parser.add_argument("--tps", type=float, default=50.0, help="假模型每秒生成 token 数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假接口返回 500 的概率")
+    parser.add_argument("--set", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="覆盖 config.json 配置项，值按 JSON 解析，如 burst_window=0 stream_reply=false")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--log-dir", help="日志目录，默认写到本次回放的临时目录")
+    parser.add_argument("--verbose", action="store_true", help="在终端输出流水线日志（默认只写日志文件）")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        import utils.logger  # noqa: F401  先完成日志配置再调整终端输出级别
+        for handler in logging.getLogger().handlers:
+            if not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.WARNING)
+
+    overrides = {}
+    for item in args.set:
+        name, _, value = item.partition("=")
+        try:
+            overrides[name] = json.loads(value)
+        except json.JSONDecodeError:
+            overrides[name] = value
+
+    if args.history:
+        traffic = load_history(args.history)
+    else:
+        traffic = synthetic_traffic(args.synthetic, users=args.users, rate=args.rate, burst=args.burst,
+                                    mention_rate=args.mention_rate)
+    if not traffic:
+        print("没有可回放的消息")
+        return
+
+    server, base_url = start_fake_server(args.latency, args.tps, args.error_rate)
+    try:
+        report = run_replay(traffic, base_url, app_module=args.app, speed=args.speed,
+                            reply_mode=args.reply_mode, overrides=overrides, transport=args.transport,
+                            log_dir=args.log_dir)
+    finally:
+        server.terminate()
+        server.wait()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,20 @@ from datetime import datetime
 from openai import OpenAI
 from utils.logger import logger
 import os
+import threading
 
 class Schedule:
-    def __init__(self, baseurl,api_key: str):
+    def __init__(self, baseurl,api_key: str, client=None):
         """日程管理类
         
         Args:
             api_key: API密钥
+            client: 可选，共用的 OpenAI 客户端
         """
-        self.client = OpenAI(api_key=api_key, base_url=baseurl)
+        self.client = client or OpenAI(api_key=api_key, base_url=baseurl)
         self.schedule_file = "data/schedule.json"
+        # 并行处理多个会话时，只允许一个线程在日程缺失时生成新日程
+        self._generate_lock = threading.Lock()
         
     def generate_schedule(self) -> dict:
         """生成并返回日程JSON
@@ -71,8 +75,11 @@ class Schedule:
             with open(self.schedule_file, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except FileNotFoundError:
-            logger.warning("未找到日程文件，将生成新日程")
-            return self.generate_schedule()
+            with self._generate_lock:
+                if os.path.exists(self.schedule_file):
+                    return self.get_schedule()
+                logger.warning("未找到日程文件，将生成新日程")
+                return self.generate_schedule()
         except Exception as e:
             logger.error(f"读取日程失败: {str(e)}")
             raise
@@ -0,0 +1,247 @@
+"""轮询调度模块
+替代固定间隔的 time.sleep 主循环：有新消息时快速轮询，空闲时按指数退避逐步拉长间隔；
+定时任务（每日日程、统计输出等）挂在时间轮上，由单独的线程执行，不阻塞轮询。
+同时统计每分钟唤醒次数和 CPU 占用
+"""
+
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from utils.logger import log_error
+
+
+class ScheduledJob:
+    def __init__(self, name: str, func: Callable, next_delay: Callable[[], float]):
+        """时间轮上的定时任务
+
+        Args:
+            name: 任务名
+            func: 任务函数
+            next_delay: 返回距下次执行的秒数
+        """
+        self.name = name
+        self.func = func
+        self.next_delay = next_delay
+        self.deadline_tick = 0
+        self.runs = 0
+        self.failures = 0
+        self.running = False
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(self, tick: float = 1.0, slots: int = 60, clock: Callable[[], float] = time.monotonic):
+        """单层哈希时间轮
+
+        Args:
+            tick: 每格代表的秒数，即定时精度
+            slots: 格数；超过一圈的任务在到期前会被跳过若干圈
+            clock: 单调时钟
+        """
+        self.tick = tick
+        self.slots = slots
+        self.clock = clock
+        self._wheel: List[List[ScheduledJob]] = [[] for _ in range(slots)]
+        self._current_tick = int(clock() / tick)
+
+    def schedule(self, job: ScheduledJob, delay: float, now: Optional[float] = None):
+        """delay 秒后到期（至少一格）；到期格按真实时间向上取整，任务不会早于目标时间触发"""
+        target = (self.clock() if now is None else now) + delay
+        job.deadline_tick = max(self._current_tick + 1, math.ceil(target / self.tick))
+        self._wheel[job.deadline_tick % self.slots].append(job)
+
+    def advance(self, now: Optional[float] = None) -> List[ScheduledJob]:
+        """把时间轮推进到 now，返回到期的任务"""
+        now_tick = int((self.clock() if now is None else now) / self.tick)
+        due: List[ScheduledJob] = []
+        # 长时间未推进（如系统休眠）时每格最多扫一次
+        steps = min(now_tick - self._current_tick, self.slots)
+        for step in range(1, steps + 1):
+            slot = self._wheel[(self._current_tick + step) % self.slots]
+            remaining = []
+            for job in slot:
+                if job.cancelled:
+                    continue
+                (due if job.deadline_tick <= now_tick else remaining).append(job)
+            slot[:] = remaining
+        self._current_tick = max(self._current_tick, now_tick)
+        return due
+
+    def next_deadline(self) -> Optional[float]:
+        """最近一个任务的到期时间（单调时钟秒数），没有任务时返回None"""
+        ticks = [job.deadline_tick for slot in self._wheel for job in slot if not job.cancelled]
+        return min(ticks) * self.tick if ticks else None
+
+
+class PollingScheduler:
+    def __init__(self, poll: Callable[[], int], min_interval: float = 0.2, max_interval: float = 5.0,
+                 backoff: float = 2.0, tick: float = 1.0, job_workers: int = 2):
+        """初始化自适应轮询调度器
+
+        Args:
+            poll: 轮询函数，返回本次收到的新消息数
+            min_interval: 有新消息时的轮询间隔（下限）
+            max_interval: 空闲退避的间隔上限
+            backoff: 每次空闲轮询后间隔的放大倍数
+            tick: 时间轮精度秒数
+            job_workers: 执行定时任务的线程数
+        """
+        self.poll = poll
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.backoff = backoff
+        self.interval = min_interval
+        self.wheel = TimerWheel(tick=tick)
+        self._jobs: Dict[str, ScheduledJob] = {}
+        self._executor = ThreadPoolExecutor(max_workers=job_workers, thread_name_prefix="scheduled-job")
+        self._wake = threading.Event()
+        self._poll_requested = False
+        self._stopped = False
+        self._lock = threading.Lock()
+
+        self.polls = 0
+        self.active_polls = 0
+        self.wakeups = 0
+        self._started_wall = time.monotonic()
+        self._started_cpu = time.process_time()
+        self._last_sample = (self._started_wall, self._started_cpu, 0)
+
+    def every(self, interval: float, func: Callable, name: Optional[str] = None,
+              run_now: bool = False) -> ScheduledJob:
+        """每隔 interval 秒执行一次 func"""
+        job = ScheduledJob(name or func.__name__, func, lambda: interval)
+        self._add_job(job, 0 if run_now else interval)
+        return job
+
+    def daily(self, hour: int, minute: int, func: Callable, name: Optional[str] = None) -> ScheduledJob:
+        """每天在 hour:minute（本地时间）执行一次 func
+
+        单调时钟和本地时间可能有偏差，执行前按本地时间再核对一次，未到点时等到点再执行，
+        以免任务在前一天的最后一秒运行（如生成的日程标成前一天的日期）
+        """
+        def next_target(after: datetime) -> datetime:
+            target = after.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if target <= after:
+                target += timedelta(days=1)
+            return target
+
+        now = datetime.now()
+        state = {"due": next_target(now), "firing": None}
+
+        def next_delay() -> float:
+            # 在任务到期时调用：本次的目标时间交给 run，下次的目标从本次目标之后算起，提前触发也不会重复执行
+            now = datetime.now()
+            state["firing"] = state["due"]
+            state["due"] = next_target(max(now, state["due"]))
+            return (state["due"] - now).total_seconds()
+
+        def run():
+            firing = state["firing"]
+            early = (firing - datetime.now()).total_seconds() if firing is not None else 0
+            if early > 0:
+                time.sleep(early)
+            func()
+
+        job = ScheduledJob(name or func.__name__, run, next_delay)
+        self._add_job(job, (state["due"] - now).total_seconds())
+        return job
+
+    def _add_job(self, job: ScheduledJob, delay: float):
+        with self._lock:
+            self._jobs[job.name] = job
+            self.wheel.schedule(job, delay)
+        self._wake.set()
+
+    def cancel(self, name: str):
+        with self._lock:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                job.cancelled = True
+
+    def wake(self):
+        """立即唤醒并轮询一次（例如外部得知有新消息时）"""
+        self._poll_requested = True
+        self._wake.set()
+
+    def _run_job(self, job: ScheduledJob):
+        try:
+            job.func()
+        except Exception as e:
+            job.failures += 1
+            log_error(f"定时任务 {job.name} 执行失败: {str(e)}")
+        finally:
+            job.runs += 1
+            job.running = False
+
+    def _dispatch_due_jobs(self):
+        with self._lock:
+            due = self.wheel.advance()
+            for job in due:
+                self.wheel.schedule(job, job.next_delay())
+        for job in due:
+            # 上一次还没执行完的任务跳过本轮，避免堆积
+            if job.running:
+                continue
+            job.running = True
+            self._executor.submit(self._run_job, job)
+
+    def _poll_once(self):
+        try:
+            received = self.poll()
+        except Exception as e:
+            log_error(f"轮询新消息失败: {str(e)}")
+            received = 0
+        self.polls += 1
+        if received:
+            self.active_polls += 1
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+    def run(self):
+        """阻塞运行轮询循环，直到 stop() 被调用"""
+        next_poll = time.monotonic()
+        while not self._stopped:
+            now = time.monotonic()
+            if now >= next_poll:
+                self._poll_once()
+                next_poll = time.monotonic() + self.interval
+            self._dispatch_due_jobs()
+
+            with self._lock:
+                next_job = self.wheel.next_deadline()
+            wake_at = next_poll if next_job is None else min(next_poll, next_job)
+            self._wake.wait(max(0.0, wake_at - time.monotonic()))
+            self._wake.clear()
+            if self._poll_requested:
+                self._poll_requested = False
+                next_poll = time.monotonic()
+            self.wakeups += 1
+
+    def stop(self, wait: bool = True):
+        """停止轮询循环和定时任务线程"""
+        self._stopped = True
+        self._wake.set()
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict:
+        """返回轮询统计；*_recent 为距上次调用 stats() 期间的数值"""
+        now_wall, now_cpu = time.monotonic(), time.process_time()
+        last_wall, last_cpu, last_wakeups = self._last_sample
+        self._last_sample = (now_wall, now_cpu, self.wakeups)
+        elapsed = max(now_wall - self._started_wall, 1e-9)
+        recent = max(now_wall - last_wall, 1e-9)
+        return {
+            "interval": self.interval,
+            "polls": self.polls,
+            "active_polls": self.active_polls,
+            "wakeups_per_minute": self.wakeups * 60 / elapsed,
+            "wakeups_per_minute_recent": (self.wakeups - last_wakeups) * 60 / recent,
+            "cpu_percent": (now_cpu - self._started_cpu) * 100 / elapsed,
+            "cpu_percent_recent": (now_cpu - last_cpu) * 100 / recent,
+            "jobs": {name: {"runs": job.runs, "failures": job.failures} for name, job in self._jobs.items()},
+        }
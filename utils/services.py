@@ -0,0 +1,225 @@
+"""服务容器
+配置只在启动时校验一次；各组件和 API 客户端在第一次使用时才创建，
+base_url 和 key 相同的组件共用同一个 OpenAI / AsyncOpenAI 客户端（连接池）。
+openai、numpy 等较重的依赖随相应组件一起按需导入，进程启动后可以立即开始轮询，
+其余组件由后台线程预热；导入和各组件的创建耗时记录在 timings 中
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.config_manager import validate_config
+from utils.logger import log_error, log_info
+
+# 后台预热的组件，reply_pipeline 会连带创建它依赖的记忆、日程和审查组件
+DEFAULT_WARM_UP = ("transport", "reply_pipeline", "memory_writer")
+
+
+def load_config(config_dir: str) -> Tuple[Dict, List[str]]:
+    """读取并校验 config.json 和 listen_list.json，返回 (主配置, 监听列表)"""
+    with open(os.path.join(config_dir, 'listen_list.json'), 'r', encoding='utf-8') as f:
+        listen_list = json.load(f)['listen_list']
+    with open(os.path.join(config_dir, 'config.json'), 'r', encoding='utf-8') as f:
+        app_config = validate_config(json.load(f))
+    return app_config, listen_list
+
+
+class ClientPool:
+    def __init__(self):
+        """按 (base_url, key) 缓存 OpenAI 客户端，同一组参数只创建一次"""
+        self._clients: Dict[Tuple[str, str, bool], object] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, api_key: str, asynchronous: bool = False):
+        cache_key = (base_url, api_key, asynchronous)
+        client = self._clients.get(cache_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(cache_key)
+                if client is None:
+                    from openai import AsyncOpenAI, OpenAI
+                    client = (AsyncOpenAI if asynchronous else OpenAI)(api_key=api_key, base_url=base_url)
+                    self._clients[cache_key] = client
+        return client
+
+    def __len__(self):
+        return len(self._clients)
+
+
+class ServiceContainer:
+    def __init__(self, config: Dict, import_seconds: float = 0.0, moderate_replies: bool = True):
+        """初始化服务容器（不创建任何组件）
+
+        Args:
+            config: 经过 validate_config 校验的主配置
+            import_seconds: 入口模块的导入耗时，用于启动报告
+            moderate_replies: 回复流水线是否审查待发送的消息
+        """
+        self.config = config
+        self.moderate_replies = moderate_replies
+        self.base_url = config['chat']['base_url']
+        self.key = config['chat']['key']
+        self.clients = ClientPool()
+        self.timings: Dict[str, float] = {"import": import_seconds}
+        self._services: Dict[str, object] = {}
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory: Callable[[], object]):
+        service = self._services.get(name)
+        if service is not None:
+            return service
+        with self._lock:
+            if name not in self._services:
+                start = time.perf_counter()
+                self._services[name] = factory()
+                self.timings[name] = time.perf_counter() - start
+                log_info(f"已创建 {name}，耗时 {self.timings[name] * 1000:.1f} ms")
+            return self._services[name]
+
+    def built(self, name: str) -> bool:
+        return name in self._services
+
+    # ---- API 客户端 ----
+
+    def client(self, api_key: Optional[str] = None):
+        return self.clients.get(self.base_url, api_key or self.key)
+
+    def async_client(self, api_key: Optional[str] = None):
+        return self.clients.get(self.base_url, api_key or self.key, asynchronous=True)
+
+    # ---- 组件 ----
+
+    @property
+    def transport(self):
+        def create():
+            from utils.transport import create_transport
+            return create_transport(self.config)
+        return self._get("transport", create)
+
+    @property
+    def willingness_calc(self):
+        def create():
+            from utils.willingness import WillingnessCalculator
+            return WillingnessCalculator(self.config)
+        return self._get("willingness_calc", create)
+
+    @property
+    def prompt_builder(self):
+        def create():
+            from utils.prompt_builder import PromptBuilder
+            return PromptBuilder(self.config)
+        return self._get("prompt_builder", create)
+
+    @property
+    def memory_manager(self):
+        def create():
+            from utils.memory_manager import MemoryManager
+            on_evict = self.memory_summarizer.add_evicted if self.config.get('rolling_summary', True) else None
+            return MemoryManager(max_rounds=self.config.get('memory_max_rounds', 50), on_evict=on_evict)
+        return self._get("memory_manager", create)
+
+    @property
+    def memory_summarizer(self):
+        def create():
+            from utils.memory_summary import ConversationSummarizer
+            # 摘要与聊天共用同一个接口；DeepSeek 上 deepseek-chat 已是最便宜的模型，
+            # 摘要请求不带工具定义、按 summary_min_turns 批量发送，换用其他服务商时可另配更便宜的 summary_model
+            return ConversationSummarizer(self.client(), model=self.config.get('summary_model', 'deepseek-chat'),
+                                          min_new_turns=self.config.get('summary_min_turns', 10),
+                                          bot_name=self.config.get('name', '我'))
+        return self._get("memory_summarizer", create)
+
+    @property
+    def image_processor(self):
+        def create():
+            from utils.image_processor import ImageProcessor
+            return ImageProcessor(base_url=self.base_url, api_key=self.config['image_processor_key'])
+        return self._get("image_processor", create)
+
+    @property
+    def long_term_memory(self):
+        def create():
+            from utils.long_term_memory import LongTermMemory
+            key = self.config['long_term_memory_key']
+            return LongTermMemory(baseurl=self.base_url, api_key=key,
+                                  index_dtype=self.config.get('memory_index_dtype', 'float32'),
+                                  client=self.client(key), async_client=self.async_client(key))
+        return self._get("long_term_memory", create)
+
+    @property
+    def memory_writer(self):
+        def create():
+            from utils.memory_writer import MemoryWriter
+            return MemoryWriter(self.long_term_memory)
+        return self._get("memory_writer", create)
+
+    @property
+    def memory_consolidator(self):
+        def create():
+            from utils.memory_consolidation import MemoryConsolidator
+            return MemoryConsolidator(self.long_term_memory, client=self.client())
+        return self._get("memory_consolidator", create)
+
+    @property
+    def schedule_manager(self):
+        def create():
+            from utils.schedule import Schedule
+            return Schedule(baseurl=self.base_url, api_key=self.key, client=self.client())
+        return self._get("schedule_manager", create)
+
+    @property
+    def moderator(self):
+        def create():
+            from utils.moderation import ContentModerator
+            key = self.config['moderator_key']
+            return ContentModerator(baseurl=self.base_url, api_key=key,
+                                    client=self.client(key), async_client=self.async_client(key))
+        return self._get("moderator", create)
+
+    @property
+    def reply_pipeline(self):
+        def create():
+            from utils.async_pipeline import ReplyPipeline
+            return ReplyPipeline(self.async_client(), self.prompt_builder, self.memory_manager,
+                                 self.long_term_memory, self.schedule_manager,
+                                 moderator=self.moderator if self.moderate_replies else None,
+                                 image_processor=self.image_processor,
+                                 summarizer=self.memory_summarizer if self.config.get('rolling_summary', True) else None)
+        return self._get("reply_pipeline", create)
+
+    # ---- 启动与关闭 ----
+
+    def warm_up(self, names=DEFAULT_WARM_UP) -> threading.Thread:
+        """在后台线程中依次创建组件，避免第一条消息承担初始化耗时"""
+        def run():
+            start = time.perf_counter()
+            for name in names:
+                try:
+                    getattr(self, name)
+                except Exception as e:
+                    log_error(f"预热 {name} 失败: {str(e)}")
+            self.timings["warm_up"] = time.perf_counter() - start
+            log_info(f"启动报告: {self.startup_report()}")
+
+        thread = threading.Thread(target=run, name="service-warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def startup_report(self) -> Dict:
+        """各阶段耗时（毫秒）和共用的客户端数量"""
+        report = {name: round(seconds * 1000, 1) for name, seconds in self.timings.items()}
+        report["clients"] = len(self.clients)
+        return report
+
+    def close(self):
+        """按依赖的反序关闭已创建的组件"""
+        for name in ("reply_pipeline", "memory_writer", "memory_summarizer", "transport"):
+            service = self._services.get(name)
+            if service is not None:
+                try:
+                    service.close()
+                except Exception as e:
+                    log_error(f"关闭 {name} 失败: {str(e)}")
@@ -0,0 +1,64 @@
+"""token 估算模块
+为 prompt 预算估算文本的 token 数。安装了 tiktoken 时用它的 cl100k_base 编码计数，
+否则按 DeepSeek 文档给出的换算估算：一个中文字符约 0.6 token，一个英文字符约 0.3 token。
+同一条消息在多次请求中反复出现，估算结果按文本缓存
+"""
+
+import math
+import threading
+from functools import lru_cache
+
+from utils.logger import log_info, log_warning
+
+# 每条消息在对话格式中的额外开销（角色标记等）
+MESSAGE_OVERHEAD = 4
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """按需加载 tiktoken 编码，未安装或加载失败时返回 None"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                    log_info("token 估算使用 tiktoken cl100k_base 编码")
+                except ImportError:
+                    log_info("未安装 tiktoken，token 数按字符换算估算")
+                except Exception as e:
+                    log_warning(f"加载 tiktoken 编码失败，token 数按字符换算估算: {str(e)}")
+                _encoding_loaded = True
+    return _encoding
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x3000 <= code <= 0x303F
+            or 0xFF00 <= code <= 0xFFEF)
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3)
+
+
+def estimate_message_tokens(message: dict) -> int:
+    """估算一条 OpenAI 格式消息的 token 数（只计文本内容）"""
+    content = message.get("content")
+    if isinstance(content, list):
+        text = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    else:
+        text = str(content or "")
+    return estimate_tokens(text) + MESSAGE_OVERHEAD
@@ -1,22 +1,23 @@
 import requests
 import json
 
-def get_weather_by_city(city_name):
+WEATHER_API = "https://api.asilu.com/weather/"
+
+def get_weather_by_city(city_name, session=None, timeout=(3.05, 8.0)):
     """
     获取指定城市的天气信息
     
     参数:
         city_name (str): 城市名称
+        session (requests.Session): 可选，复用连接的会话，不传则单独发起请求
+        timeout: (连接, 读取) 超时秒数，避免外部接口卡住时一直等待
         
     返回:
         dict: 包含天气信息的JSON数据
     """
-    # 构造API URL
-    url = f"https://api.asilu.com/weather/?city={city_name}"
-    
     try:
-        # 发送GET请求
-        response = requests.get(url)
+        # 发送GET请求（城市名作为查询参数编码）
+        response = (session or requests).get(WEATHER_API, params={"city": city_name}, timeout=timeout)
         response.raise_for_status()  # 检查请求是否成功
         
         # 返回JSON数据
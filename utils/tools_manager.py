@@ -1,17 +1,183 @@
 import json
 import os
-from typing import Dict, Any
-from utils.tools.weather import get_weather_by_city
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.logger import log_info, log_warning
+from utils.metrics import TOOL_CACHE
+
+# 各工具结果的缓存时间（秒），未列出的工具不缓存
+TOOL_TTLS = {
+    "get_weather": 600,
+}
+HTTP_TIMEOUT = (3.05, 8.0)  # 工具访问外部接口的 (连接, 读取) 超时秒数
+HTTP_POOL_SIZE = 8  # 每个主机保持的连接数，与 api_utils 的工具线程池大小一致
+MAX_CACHE_ITEMS = 512
+INFLIGHT_TIMEOUT = 10.0  # 等待相同调用结果的最长秒数，与 api_utils.TOOL_TIMEOUT 一致
+
+_tools = None
+_session = None
+_session_lock = threading.Lock()
+
 
 def get_tools():
-    """读取并返回./../data/tools.json文件内容"""
-    file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'tools.json')
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """读取并返回./../data/tools.json文件内容（只读一次）"""
+    global _tools
+    if _tools is None:
+        file_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'tools.json')
+        with open(file_path, 'r', encoding='utf-8') as f:
+            _tools = json.load(f)
+    return _tools
+
+
+def get_session():
+    """工具共用的 requests.Session，复用连接；第一次使用时才导入 requests"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def _normalize_text(value: str) -> str:
+    return unicodedata.normalize("NFKC", value).strip().lower()
+
+
+def _normalize_location(params: Dict) -> Dict:
+    """“北京市”“ 北京 ”都按“北京”查询和缓存"""
+    location = _normalize_text(str(params.get("location", "")))
+    if len(location) > 2 and location.endswith("市"):
+        location = location[:-1]
+    return {"location": location}
+
+
+# 各工具的参数规范化，结果既用于调用也用于缓存键
+_NORMALIZERS: Dict[str, Callable[[Dict], Dict]] = {
+    "get_weather": _normalize_location,
+}
+
+
+class _InFlight:
+    """正在执行的一次工具调用，相同参数的并发调用等待它的结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class ToolExecutor:
+    def __init__(self, ttls: Optional[Dict[str, float]] = None, max_items: int = MAX_CACHE_ITEMS):
+        """工具执行层：按工具名和规范化后的参数缓存结果，合并相同参数的并发调用
+
+        Args:
+            ttls: 各工具结果的缓存秒数，默认 TOOL_TTLS
+            max_items: 缓存的最大条数，超出时淘汰最久未用的
+        """
+        self.ttls = TOOL_TTLS if ttls is None else ttls
+        self.max_items = max_items
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], _InFlight] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+
+    def run(self, tool_name: str, params: Any) -> Any:
+        """执行工具；缓存有效时直接返回，相同调用正在进行时等待其结果"""
+        if isinstance(params, dict) and tool_name in _NORMALIZERS:
+            params = _NORMALIZERS[tool_name](params)
+        ttl = self.ttls.get(tool_name)
+        if not ttl:
+            return _call_tool(tool_name, params)
+
+        key = (tool_name, json.dumps(params, ensure_ascii=False, sort_keys=True))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                TOOL_CACHE.labels(tool_name, "hit").inc()
+                return cached[1]
+            inflight = self._inflight.get(key)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[key] = _InFlight()
+                self.misses += 1
+            else:
+                self.shared += 1
+        TOOL_CACHE.labels(tool_name, "miss" if leader else "shared").inc()
+
+        if not leader:
+            # 不无限等待：先发起的调用卡住时，等待者按超时返回，不占住工具线程
+            if not inflight.done.wait(INFLIGHT_TIMEOUT):
+                log_warning(f"等待相同的 {tool_name} 调用超时（{INFLIGHT_TIMEOUT} 秒）")
+                return {"error": f"{tool_name} 调用超时，没有拿到结果"}
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.result
+
+        try:
+            inflight.result = _call_tool(tool_name, params)
+            # 出错的结果不缓存，下次重新请求
+            if inflight.result is not None and not (isinstance(inflight.result, dict) and "error" in inflight.result):
+                with self._lock:
+                    self._cache[key] = (time.monotonic() + ttl, inflight.result)
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.max_items:
+                        self._cache.popitem(last=False)
+            return inflight.result
+        except BaseException as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "shared": self.shared, "cached": len(self._cache)}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _call_tool(tool_name: str, params_dict: Any) -> Any:
+    # 根据工具名执行不同操作
+    if tool_name == "get_weather":
+        # 工具依赖（requests 等）在第一次调用时才导入，不拖慢启动
+        from utils.tools.weather import get_weather_by_city
+        location = params_dict.get("location") if isinstance(params_dict, dict) else params_dict
+        if not location:
+            return {"error": "缺少 location 参数，请先问清要查询的城市"}
+        log_info(f"查询天气: {location}")
+        result = get_weather_by_city(location, session=get_session(), timeout=HTTP_TIMEOUT)
+        if result is None:
+            log_warning(f"获取 {location} 的天气失败")
+            return {"error": f"暂时查不到{location}的天气"}
+        return result
+    else:
+        return {"error": f"Tool '{tool_name}' not found"}
+
+
+executor = ToolExecutor()
+
 
 def use_tools(tool_name: str, params) -> Dict[str, Any]:
     """
-    根据工具名和参数执行相应操作
+    根据工具名和参数执行相应操作（经过缓存和并发合并）
     :param tool_name: 工具名（如 "get_weather"）
     :param params: 参数，可以是 JSON 字符串、字典或其他类型
     :return: 执行结果（字典格式）
@@ -27,9 +193,4 @@ def use_tools(tool_name: str, params) -> Dict[str, Any]:
     else:
         params_dict = params  # 其他类型直接传递
 
-    # 根据工具名执行不同操作
-    if tool_name == "get_weather":
-        return get_weather_by_city(params_dict)
-    else:
-        return {"error": f"Tool '{tool_name}' not found"}
-
+    return executor.run(tool_name, params_dict)
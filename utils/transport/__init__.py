@@ -0,0 +1,25 @@
+"""消息传输层
+transport 配置项选择实现：wxauto（默认，微信客户端）或 http（本地 HTTP 网关）
+"""
+
+from typing import Dict
+
+from utils.transport.base import IncomingMessage, Transport
+
+
+def create_transport(config: Dict) -> Transport:
+    """按配置创建传输实例；各实现只在选用时才导入"""
+    kind = config.get('transport', 'wxauto')
+    if kind == 'wxauto':
+        from utils.transport.wxauto_transport import WxautoTransport
+        return WxautoTransport()
+    if kind == 'http':
+        from utils.transport.http_gateway import HttpGatewayTransport
+        return HttpGatewayTransport(
+            host=config.get('gateway_host', '127.0.0.1'),
+            port=config.get('gateway_port', 8765),
+        )
+    raise ValueError(f"未知的消息传输: {kind}")
+
+
+__all__ = ["IncomingMessage", "Transport", "create_transport"]
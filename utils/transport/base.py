@@ -0,0 +1,64 @@
+"""消息传输接口
+回复引擎只通过 Transport 收发消息、管理监听，不直接依赖具体的客户端（wxauto、HTTP 网关等）
+"""
+
+from typing import Callable, Dict, List, Optional
+
+
+class IncomingMessage:
+    def __init__(self, chat: str, sender: str, content: str, type: str = "friend"):
+        """收到的一条消息
+
+        Args:
+            chat: 会话标识，发送回复时原样传回 Transport.send
+            sender: 发送者名称
+            content: 消息内容
+            type: 消息类型，好友消息为 friend，其余（系统、自己发出的等）由引擎忽略
+        """
+        self.chat = chat
+        self.sender = sender
+        self.content = content
+        self.type = type
+
+    def __repr__(self):
+        return f"IncomingMessage(chat={self.chat!r}, sender={self.sender!r}, content={self.content!r})"
+
+
+class Transport:
+    """消息传输基类
+
+    receive() 由轮询线程调用；send() 由工作线程并发调用，实现需自行保证线程安全
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._notify: Optional[Callable[[], None]] = None
+
+    def set_notify(self, callback: Optional[Callable[[], None]]):
+        """设置新消息到达时的通知回调（如 PollingScheduler.wake）；只有推送式传输会调用"""
+        self._notify = callback
+
+    def notify(self):
+        if self._notify is not None:
+            self._notify()
+
+    def receive(self) -> Dict[str, List[IncomingMessage]]:
+        """取出自上次调用以来的新消息，按会话分组"""
+        raise NotImplementedError
+
+    def send(self, chat: str, message) -> None:
+        """向会话发送一条消息"""
+        raise NotImplementedError
+
+    def add_listen(self, name: str, callback: Optional[Callable] = None) -> None:
+        """开始监听一个会话"""
+
+    def remove_listen(self, name: str) -> None:
+        """停止监听一个会话"""
+
+    def init_worker_thread(self) -> None:
+        """发送消息的工作线程启动时调用，用于线程级初始化"""
+
+    def close(self) -> None:
+        """释放连接、停止后台线程"""
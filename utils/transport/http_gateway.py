@@ -0,0 +1,184 @@
+"""本地 HTTP 消息网关
+不依赖微信客户端，任何程序都可以通过 HTTP 与机器人对话，便于在 Linux 上运行多会话和压测：
+
+    POST /messages          {"sender": "张三", "content": "你好", "chat": "张三"}（chat 可省略，也可传数组批量提交）
+    GET  /replies?chat=张三&timeout=10   长轮询取回该会话的回复
+    GET  /health            收件箱与发件箱状态
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from utils.logger import log_info
+from utils.transport.base import IncomingMessage, Transport
+
+
+class _GatewayHandler(BaseHTTPRequestHandler):
+    server: "_GatewayServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/messages":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"null")
+            items = payload if isinstance(payload, list) else [payload]
+            messages = [
+                IncomingMessage(str(item.get("chat") or item["sender"]), str(item["sender"]),
+                                str(item["content"]), str(item.get("type", "friend")))
+                for item in items
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": f"invalid message: {str(e)}"})
+            return
+        accepted = self.server.gateway.push(messages)
+        if accepted < len(messages):
+            self._send_json(503, {"accepted": accepted, "error": "inbox full"})
+        else:
+            self._send_json(202, {"accepted": accepted})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        gateway = self.server.gateway
+        if url.path == "/health":
+            self._send_json(200, gateway.stats())
+            return
+        if url.path != "/replies":
+            self._send_json(404, {"error": "not found"})
+            return
+        query = parse_qs(url.query)
+        chat = (query.get("chat") or [""])[0]
+        if not chat:
+            self._send_json(400, {"error": "chat is required"})
+            return
+        try:
+            timeout = min(float((query.get("timeout") or ["0"])[0]), 60.0)
+        except ValueError:
+            timeout = 0.0
+        self._send_json(200, {"chat": chat, "messages": gateway.replies(chat, timeout)})
+
+
+class _GatewayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    gateway: "HttpGatewayTransport"
+
+
+class HttpGatewayTransport(Transport):
+    name = "http"
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, max_pending: int = 10000,
+                 max_outbox: int = 1000, on_send: Optional[Callable[[str, object], None]] = None):
+        """启动本地 HTTP 网关
+
+        Args:
+            host: 监听地址，默认只监听本机
+            port: 监听端口，0 表示随机空闲端口
+            max_pending: 收件箱上限，超过时拒绝新消息（返回 503）
+            max_outbox: 每个会话保留的未取回复条数上限，超过时丢弃最旧的
+            on_send: 可选，每发送一条回复时以 (会话, 消息) 调用
+        """
+        super().__init__()
+        self.max_pending = max_pending
+        self.max_outbox = max_outbox
+        self.on_send = on_send
+        self.listening: set = set()
+        self._inbox: Deque[IncomingMessage] = deque()
+        self._outbox: Dict[str, Deque] = {}
+        self._cond = threading.Condition()
+        self.received = 0
+        self.rejected = 0
+        self.sent = 0
+
+        self.httpd = _GatewayServer((host, port), _GatewayHandler)
+        self.httpd.gateway = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="http-gateway", daemon=True)
+        self._thread.start()
+        log_info(f"HTTP 消息网关已启动: {self.url}")
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def push(self, messages: List[IncomingMessage]) -> int:
+        """把消息放入收件箱，返回接受的条数"""
+        with self._cond:
+            room = max(0, self.max_pending - len(self._inbox))
+            accepted = messages[:room]
+            self._inbox.extend(accepted)
+            self.received += len(accepted)
+            self.rejected += len(messages) - len(accepted)
+        if accepted:
+            self.notify()
+        return len(accepted)
+
+    def receive(self) -> Dict[str, List[IncomingMessage]]:
+        with self._cond:
+            items, self._inbox = list(self._inbox), deque()
+        received: Dict[str, List[IncomingMessage]] = {}
+        for msg in items:
+            received.setdefault(msg.chat, []).append(msg)
+        return received
+
+    def send(self, chat: str, message) -> None:
+        with self._cond:
+            outbox = self._outbox.get(chat)
+            if outbox is None:
+                outbox = self._outbox[chat] = deque(maxlen=self.max_outbox)
+            outbox.append(message)
+            self.sent += 1
+            self._cond.notify_all()
+        if self.on_send is not None:
+            self.on_send(chat, message)
+
+    def replies(self, chat: str, timeout: float = 0.0) -> List:
+        """取回会话的全部待取回复；没有回复时最多等待 timeout 秒"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self._outbox.get(chat):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            return list(self._outbox.pop(chat))
+
+    def add_listen(self, name: str, callback: Optional[Callable] = None) -> None:
+        self.listening.add(name)
+
+    def remove_listen(self, name: str) -> None:
+        self.listening.discard(name)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._inbox)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "pending": len(self._inbox),
+                "received": self.received,
+                "rejected": self.rejected,
+                "sent": self.sent,
+                "unread_chats": sum(1 for outbox in self._outbox.values() if outbox),
+            }
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,74 @@
+"""基于 wxauto 的微信传输
+wxauto 操作的是同一个微信窗口，轮询、发送等界面操作全部通过一把锁串行
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+from utils.transport.base import IncomingMessage, Transport
+
+
+class WxautoTransport(Transport):
+    name = "wxauto"
+
+    def __init__(self, wx=None):
+        """初始化微信传输
+
+        Args:
+            wx: 可选，已创建的 WeChat 实例；不传则在此导入 wxauto 并创建
+        """
+        super().__init__()
+        if wx is None:
+            from wxauto import WeChat
+            wx = WeChat()
+        self.wx = wx
+        self._lock = threading.Lock()
+        self._chats: Dict[str, object] = {}
+
+    @staticmethod
+    def _chat_id(chat) -> str:
+        return getattr(chat, "name", None) or str(chat)
+
+    def receive(self) -> Dict[str, List[IncomingMessage]]:
+        with self._lock:
+            msgs = self.wx.GetNextNewMessage()
+        received: Dict[str, List[IncomingMessage]] = {}
+        for chat in msgs:
+            chat_id = self._chat_id(chat)
+            # 记下会话对象，回复时直接用它发送
+            self._chats[chat_id] = chat
+            received[chat_id] = [
+                IncomingMessage(chat_id, msg.sender, msg.content, msg.type) for msg in msgs.get(chat)
+            ]
+        return received
+
+    def send(self, chat: str, message) -> None:
+        target = self._chats.get(chat)
+        with self._lock:
+            if target is not None and hasattr(target, "SendMsg"):
+                target.SendMsg(message)
+            else:
+                self.wx.SendMsg(message, who=chat)
+
+    def add_listen(self, name: str, callback: Optional[Callable] = None) -> None:
+        with self._lock:
+            self.wx.AddListenChat(nickname=name, callback=callback)
+
+    def remove_listen(self, name: str) -> None:
+        with self._lock:
+            if hasattr(self.wx, "RemoveListenChat"):
+                self.wx.RemoveListenChat(nickname=name)
+
+    def get_history(self) -> List:
+        """加载并返回当前聊天窗口的历史消息"""
+        with self._lock:
+            self.wx.LoadMoreMessage()
+            return self.wx.GetAllMessage()
+
+    def init_worker_thread(self) -> None:
+        """工作线程在调用 wxauto 前初始化 COM（Windows 界面自动化要求每个线程单独初始化）"""
+        try:
+            import pythoncom
+            pythoncom.CoInitialize()
+        except ImportError:
+            pass
@@ -5,20 +5,24 @@
 import json
 import os
 import re
+import threading
 from pathlib import Path
 from datetime import datetime
 
 USER_STATS_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'user_stats.json')
 MAX_WEIGHT = 15
+# 多个会话并行处理时串行化统计文件的读改写
+_stats_lock = threading.Lock()
 
 def init_user_stats():
     """初始化用户统计数据文件"""
     data_dir = os.path.dirname(USER_STATS_FILE)
     Path(data_dir).mkdir(parents=True, exist_ok=True)
     
-    if not os.path.exists(USER_STATS_FILE):
-        with open(USER_STATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({"users": {}}, f, ensure_ascii=False, indent=2)
+    with _stats_lock:
+        if not os.path.exists(USER_STATS_FILE):
+            with open(USER_STATS_FILE, 'w', encoding='utf-8') as f:
+                json.dump({"users": {}}, f, ensure_ascii=False, indent=2)
 
 def calculate_weight(days: int, base_weight: float = 1.0) -> float:
     """计算时间权重
@@ -37,7 +41,7 @@ def update_user_interaction(username: str):
     """
     init_user_stats()
     
-    with open(USER_STATS_FILE, 'r+', encoding='utf-8') as f:
+    with _stats_lock, open(USER_STATS_FILE, 'r+', encoding='utf-8') as f:
         data = json.load(f)
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
@@ -82,7 +86,7 @@ def set_user_weight(username: str, weight: float):
     init_user_stats()
     weight = max(1, min(MAX_WEIGHT, weight))  # 限制在1-15之间
     
-    with open(USER_STATS_FILE, 'r+', encoding='utf-8') as f:
+    with _stats_lock, open(USER_STATS_FILE, 'r+', encoding='utf-8') as f:
         data = json.load(f)
         if username not in data['users']:
             data['users'][username] = {
@@ -104,7 +108,7 @@ def get_user_stats(username: str) -> dict:
     """
     init_user_stats()
     
-    with open(USER_STATS_FILE, 'r', encoding='utf-8') as f:
+    with _stats_lock, open(USER_STATS_FILE, 'r', encoding='utf-8') as f:
         data = json.load(f)
         return data['users'].get(username, {
             "interaction_count": 0,
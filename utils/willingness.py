@@ -6,10 +6,23 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from utils.logger import log_info, log_warning
 
+# 消息优先级（数值越小越优先），供分发器在满载时决定先处理谁、先丢弃谁
+PRIORITY_ADMIN = 0
+PRIORITY_MENTION = 1
+PRIORITY_FOLLOW_UP = 2
+PRIORITY_NORMAL = 3
+PRIORITY_NAMES = {
+    PRIORITY_ADMIN: "admin",
+    PRIORITY_MENTION: "mention",
+    PRIORITY_FOLLOW_UP: "follow_up",
+    PRIORITY_NORMAL: "normal",
+}
+
 class WillingnessCalculator:
     def __init__(self, bot_config: Dict):
         self.bot_name = bot_config.get("name", "泡泡")
-        self.bot_aliases = bot_config.get("other_name", [])
+        self.bot_aliases = [name for name in bot_config.get("other_name", []) if name]
+        self.admin = bot_config.get("admin", {}) or {}
         
         self.user_profiles: Dict[str, Dict[str, Any]] = {}
         self.last_check_time = datetime.now()
@@ -147,6 +160,23 @@ class WillingnessCalculator:
 
         return final_prob
 
+    def classify_priority(self, content: str, sender: str, chat_name: str, chat: str = "") -> int:
+        """按管理员、提及、连续对话判断消息优先级，只做字符串比较，不记日志、不改状态
+
+        Args:
+            chat_name: 与 calculate_reply_probability 相同的位置名（如 私聊）
+            chat: 消息所在会话的名称，用于识别管理员的指令群
+        """
+        if sender == self.admin.get("name") or (chat and chat == self.admin.get("command_group")):
+            return PRIORITY_ADMIN
+        if any(kw and kw in content for kw in [self.bot_name] + self.bot_aliases):
+            return PRIORITY_MENTION
+        profile = self.user_profiles.get(f"{sender}@{chat_name}")
+        if profile and profile["last_reply_time"] and \
+                datetime.now() - profile["last_reply_time"] < self.FOLLOW_UP_THRESHOLD:
+            return PRIORITY_FOLLOW_UP
+        return PRIORITY_NORMAL
+
     def update_state_after_reply(self, sender: str, chat_name: str):
         user_key = f"{sender}@{chat_name}"
         profile = self._get_or_create_user_profile(user_key)